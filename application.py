@@ -1,30 +1,33 @@
+import io
 import json
-import os.path
+import sys
 
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import cm
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Table
 from reportlab.platypus import Spacer
 from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.lib.styles import ParagraphStyle
 
 from birthday_to_numeral import num_to_text_hundreds, num_to_text_thousands
+from text_fit import (FitError, draw_para, original_fit_error,
+                      shared_para)
+from form_setup import FormStyles, setup_form
+from layout import load_plan, run_preflight
+from qr_path import draw_qr
+from image_assets import image_asset
+from reference_code import (encoded_reference, reference_code,
+                            print_reference)
+from signing import load_signer, write_document
+from signing_daemon import SignerClient
 
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.serialization.pkcs12 import (
-    load_key_and_certificates
-)
-from endesive import pdf as endesivepdf
 
-import datetime
 import argparse
 import uuid
 
-import qrcode
 
 PAGE_WIDTH, PAGE_HEIGHT = A4
 
@@ -40,46 +43,42 @@ GENDER_BYLINE = {
     'mf': 'Ο - Η Αιτ.'
 }
 
-DEFAULT_OUTPUT_FILE = 'application.pdf'
-
-STYLES = getSampleStyleSheet()
-
-
-def setup(config_filename, styles):
+PAYLOAD_FILE = 'application.json'
 
-    with open(config_filename, 'r') as config_file:
-        config_data = json.load(config_file)
+LAYOUT_FILE = 'application_layout.json'
 
-    for path_font_regular, path_font_bold in zip(config_data['font-regular'],
-                                                 config_data['font-bold']):
-        if os.path.exists(path_font_regular) and os.path.exists(path_font_bold):
-            pdfmetrics.registerFont(TTFont('Font-Regular', path_font_regular))
-            pdfmetrics.registerFont(TTFont('Font-Bold', path_font_bold))
-            break
-
-    styles.add(ParagraphStyle(name='Bold',
-                              fontName='Font-Bold',
-                              fontSize=9,
-                              leading=16,
-                              alignment=TA_JUSTIFY))
+DEFAULT_OUTPUT_FILE = 'application.pdf'
 
-    styles.add(ParagraphStyle(name='Heading',
-                              fontName='Font-Bold',
-                              fontSize=13,
-                              alignment=TA_CENTER,
-                              spaceAfter=5))
+COAT_OF_ARMS = image_asset('coat_of_arms_of_greece.png')
+
+FONTS = ('Font-Regular', 'Font-Bold')
+
+STYLES = FormStyles(
+    ParagraphStyle(name='Bold',
+                   fontName='Font-Bold',
+                   fontSize=9,
+                   leading=16,
+                   alignment=TA_JUSTIFY),
+    ParagraphStyle(name='Heading',
+                   fontName='Font-Bold',
+                   fontSize=13,
+                   alignment=TA_CENTER,
+                   spaceAfter=5),
+    ParagraphStyle(name='NameSignature',
+                   fontName='Font-Regular',
+                   fontSize=10,
+                   alignment=TA_CENTER),
+    ParagraphStyle(name='Notes',
+                   fontName='Font-Regular',
+                   fontSize=9,
+                   alignment=TA_JUSTIFY,
+                   spaceAfter=0,
+                   leading=9),
+)
 
-    styles.add(ParagraphStyle(name='NameSignature',
-                              fontName='Font-Regular',
-                              fontSize=10,
-                              alignment=TA_CENTER)),
 
-    styles.add(ParagraphStyle(name='Notes',
-                              fontName='Font-Regular',
-                              fontSize=9,
-                              alignment=TA_JUSTIFY,
-                              spaceAfter=0,
-                              leading=9))
+def setup(config_filename):
+    setup_form(config_filename, FONTS)
 
 
 def load_payload(payload_filename):
@@ -88,42 +87,13 @@ def load_payload(payload_filename):
     return json_data
 
 
-def shrink_to_fit(paragraph, style, assigned_width, assigned_height):
-    w, h = paragraph.wrap(assigned_width, assigned_height)
-    if assigned_width < w or assigned_height < h:
-        style = style.clone('default')
-    while assigned_width < w or assigned_height < h:
-        style.fontSize -= 1
-        paragraph = Paragraph(paragraph.text, style)
-        w, h = paragraph.wrap(assigned_width, assigned_height)
-    return paragraph, style
-
-
-def create_para(contents, width, height,
-                font_name='Font-Regular',
-                font_size=10):
-    style = ParagraphStyle('default',
-                           fontName=font_name,
-                           fontSize=font_size)
-    paragraph = Paragraph(contents, style)
-    paragraph, _ = shrink_to_fit(paragraph, style, width, height)
-    return paragraph
-
-
-def draw_para(canvas, contents, origin_x, origin_y, width, height,
-              font_name='Font-Regular',
-              font_size=10):
-    paragraph = create_para(contents,
-                            width, height,
-                            font_name=font_name,
-                            font_size=font_size)
-    paragraph.drawOn(canvas, origin_x, origin_y)
-
-
 def make_first_page(canvas, doc, qr, payload):
 
     canvas.saveState()
 
+    plan = load_plan(LAYOUT_FILE)
+    plan.static_layer.stamp(canvas)
+
     digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
     payload['uuid'] = uuid.uuid4().hex
     digest.update(json.dumps(payload).encode('utf-8'))
@@ -131,125 +101,25 @@ def make_first_page(canvas, doc, qr, payload):
     payload['digest'] = digest_hex
 
     # QR code
-    qr = qrcode.make(digest_hex)
-    canvas.drawInlineImage(qr,
-                           x=PAGE_WIDTH - 5 * cm,
-                           y=PAGE_HEIGHT - 3.5 * cm,
-                           width=2.5 * cm,
-                           height=2.5 * cm)
-
-    draw_para(canvas, f'Κωδικός: {digest_hex}',
+    draw_qr(canvas, encoded_reference(digest_hex),
+            x=PAGE_WIDTH - 5 * cm,
+            y=PAGE_HEIGHT - 3.5 * cm,
+            size=2.5 * cm)
+
+    draw_para(canvas, f'Κωδικός: {reference_code(digest_hex)}',
               0.5 * cm, PAGE_HEIGHT - 0.75 * cm,
               15 * cm, 0.5 * cm,
               font_name='Font-Regular',
               font_size=9)
 
     # Coat of arms
-    canvas.drawImage('coat_of_arms_of_greece.png',
-                     x=PAGE_WIDTH - PAGE_WIDTH / 2 - 1.75 * cm / 2,
-                     y=PAGE_HEIGHT - 2.7 * cm,
-                     width=1.75 * cm,
-                     height=1.75 * cm)
-
-    # Frame Rectangle
-    canvas.roundRect(1 * cm, PAGE_HEIGHT - 13.5 * cm,
-                     19 * cm, 8.5 * cm, 3, stroke=1, fill=0)
-
-    draw_para(canvas, 'Όνομα: ',
-              1.5 * cm, PAGE_HEIGHT - 6 * cm,
-              2 * cm, 0.5 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-
-    draw_para(canvas, payload['firstname'],
-              3 * cm, PAGE_HEIGHT - 6 * cm,
-              14.5 * cm, 0.5 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-
-    draw_para(canvas, 'Επώνυμο: ',
-              1.5 * cm, PAGE_HEIGHT - 7 * cm,
-              2 * cm, 0.5 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-
-    draw_para(canvas, payload['surname'],
-              3.5 * cm, PAGE_HEIGHT - 7 * cm,
-              14.5 * cm, 0.5 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-
-    draw_para(canvas, 'ΑΦΜ: ',
-              1.5 * cm, PAGE_HEIGHT - 8 * cm,
-              2 * cm, 0.5 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-
-    draw_para(canvas, payload['afm'],
-              3 * cm, PAGE_HEIGHT - 8 * cm,
-              14.5 * cm, 0.5 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-
-    draw_para(canvas, 'ΑΜΚΑ: ',
-              1.5 * cm, PAGE_HEIGHT - 9 * cm,
-              2 * cm, 0.5 * cm,
-              font_name='Font-Regular',
-              font_size=9)
+    COAT_OF_ARMS.draw(canvas,
+                      x=PAGE_WIDTH - PAGE_WIDTH / 2 - 1.75 * cm / 2,
+                      y=PAGE_HEIGHT - 2.7 * cm,
+                      width=1.75 * cm,
+                      height=1.75 * cm)
 
-    draw_para(canvas, payload['amka'],
-              3 * cm, PAGE_HEIGHT - 9 * cm,
-              14.5 * cm, 0.5 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-
-    draw_para(canvas, 'Αριθμός Δελτίου Ταυτότητας: ',
-              1.5 * cm, PAGE_HEIGHT - 10 * cm,
-              5 * cm, 0.5 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-
-    draw_para(canvas, payload['adt'],
-              6 * cm, PAGE_HEIGHT - 10 * cm,
-              11.5 * cm, 0.5 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-
-    draw_para(canvas, 'Email: ',
-              1.5 * cm, PAGE_HEIGHT - 11 * cm,
-              2 * cm, 0.5 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-
-    draw_para(canvas, payload['email'],
-              3 * cm, PAGE_HEIGHT - 11 * cm,
-              14.5 * cm, 0.5 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-
-    draw_para(canvas, 'Τηλέφωνο: ',
-              1.5 * cm, PAGE_HEIGHT - 12 * cm,
-              2 * cm, 0.5 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-
-    draw_para(canvas, payload['tel'],
-              3.5 * cm, PAGE_HEIGHT - 12 * cm,
-              14.5 * cm, 0.5 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-
-    draw_para(canvas, 'IBAN: ',
-              1.5 * cm, PAGE_HEIGHT - 13 * cm,
-              2 * cm, 0.5 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-
-    draw_para(canvas, payload['iban'],
-              3 * cm, PAGE_HEIGHT - 13 * cm,
-              14.5 * cm, 0.5 * cm,
-              font_name='Font-Regular',
-              font_size=9)
+    plan.draw_fields(canvas, payload)
 
     canvas.restoreState()
 
@@ -264,12 +134,12 @@ def make_later_pages(canvas, doc):
 
 def make_heading(element, contents):
     for pcontent in contents:
-        elements.append(Paragraph(pcontent, STYLES["Heading"]))
+        elements.append(shared_para(pcontent, STYLES["Heading"]))
 
 
 def make_subtitle(element, contents):
     for pcontent in contents:
-        elements.append(Paragraph(pcontent, STYLES["Info"]))
+        elements.append(shared_para(pcontent, STYLES["Info"]))
 
 
 def make_human_signature(elements, payload):
@@ -304,47 +174,6 @@ def make_application_text(elements, payload):
     elements.append(paragraph)
 
 
-def crypto_sign(certificate_filename, password, pdf_filename):
-
-    backend = default_backend()
-
-    with open(certificate_filename, 'rb') as cert_in:
-        cert_data = cert_in.read()
-    cert = load_key_and_certificates(cert_data, password.encode('utf-8'),
-                                     backend)
-
-    with open(pdf_filename, 'rb') as decl_file:
-        decl_pdf = decl_file.read()
-
-    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S+02'00'")
-
-    dct = {
-        b'sigflags': 3,
-        b'sigpage': 0,
-        b'sigbutton': True,
-        b'contact': b'support@grnet.gr',
-        b'location': b'Athens',
-        b'signingdate': timestamp.encode('utf-8'),
-        b'reason': b'GRNET Signing Service',
-        b'signature': f'Verified by GRNET S.A. {timestamp}'.encode('utf-8'),
-        b'signaturebox': (450, 0, 600, 100),
-    }
-
-    decl_signed = endesivepdf.cms.sign(decl_pdf,
-                                       dct,
-                                       cert[0],
-                                       cert[1],
-                                       cert[2],
-                                       'sha256'
-                                       )
-
-    filename, file_extension = os.path.splitext(pdf_filename)
-    signed_pdf_filename = f'{filename}-signed{file_extension}'
-    with open(signed_pdf_filename, 'wb') as decl_signed_file:
-        decl_signed_file.write(decl_pdf)
-        decl_signed_file.write(decl_signed)
-
-
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(
@@ -355,21 +184,37 @@ if __name__ == "__main__":
     parser.add_argument('-c', '--certificate', help='certificate file')
     parser.add_argument('-p', '--password', help='certificate password',
                         default=None)
+    parser.add_argument('--signer', metavar='SOCKET',
+                        help='sign with the signing daemon listening on '
+                        'SOCKET instead of a certificate file')
+    parser.add_argument('--keep-unsigned', action='store_true',
+                        help='when signing, also write the unsigned '
+                        'document')
     parser.add_argument('-q', '--qr_code',
                         action='store_true',
                         help='embed reference and QR code')
     parser.add_argument('-s', '--setup',
                         default='setup.json',
                         help='setup configuration file')
+    parser.add_argument('--preflight', nargs='*', metavar='PAYLOAD',
+                        help='only check that the fields of the payload files '
+                        f'(default: {PAYLOAD_FILE}) fit their boxes and '
+                        'print a JSON report line for each')
     args = parser.parse_args()
 
-    setup(args.setup, STYLES)
+    setup(args.setup)
 
-    doc = SimpleDocTemplate(args.output, pagesize=A4)
+    if args.preflight is not None:
+        ok = run_preflight(LAYOUT_FILE, args.preflight or [PAYLOAD_FILE],
+                           load_payload, None)
+        sys.exit(0 if ok else 1)
+
+    output = io.BytesIO()
+    doc = SimpleDocTemplate(output, pagesize=A4)
 
     elements = []
 
-    payload = load_payload('application.json')
+    payload = load_payload(PAYLOAD_FILE)
     elements.append(Spacer(0, 1 * cm))
     make_heading(elements, [payload['title']])
     make_application_text(elements, payload)
@@ -382,10 +227,17 @@ if __name__ == "__main__":
                                                                 args.qr_code,
                                                                 payload)
 
-    decl = doc.build(elements,
-                     onFirstPage=make_first_page_ld,
-                     onLaterPages=make_later_pages)
-
-    if args.certificate and args.password:
-        crypto_sign(args.certificate, args.password, args.output)
-    print(payload['digest'])
+    try:
+        decl = doc.build(elements,
+                         onFirstPage=make_first_page_ld,
+                         onLaterPages=make_later_pages)
+    except FitError as e:
+        sys.exit(f'{PAYLOAD_FILE}: {original_fit_error(e)}')
+
+    signer = None
+    if args.signer:
+        signer = SignerClient(args.signer)
+    elif args.certificate and args.password:
+        signer = load_signer(args.certificate, args.password)
+    write_document(args.output, output.getvalue(), signer, args.keep_unsigned)
+    print_reference(payload['digest'])
@@ -1,29 +1,32 @@
+import io
 import json
-import os.path
+import sys
 
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import cm
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Table
+from reportlab.platypus import SimpleDocTemplate, Spacer, PageBreak, Table
 from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.lib.styles import ParagraphStyle
 
 from birthday_to_numeral import num_to_text_hundreds, num_to_text_thousands
+from text_fit import (FitError, draw_para, original_fit_error,
+                      shared_para)
+from form_setup import FormStyles, setup_form
+from layout import load_plan, run_preflight
+from qr_path import draw_qr
+from image_assets import image_asset
+from reference_code import (encoded_reference, reference_code,
+                            print_reference)
+from signing import load_signer, write_document
+from signing_daemon import SignerClient
 
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.serialization.pkcs12 import (
-    load_key_and_certificates
-)
-from endesive import pdf as endesivepdf
 
-import datetime
 import argparse
 import uuid
 
-import qrcode
 
 PAGE_WIDTH, PAGE_HEIGHT = A4
 
@@ -73,53 +76,44 @@ SUBTITLE = ['Τα στοιχεία που περιλαμβάνονται στη
 PAGE_DESCR = "Βεβαίωση Γέννησης"
 
 
+PAYLOAD_FILE = 'birth_affir.json'
+
+LAYOUT_FILE = 'birth_affirmation_layout.json'
+
 DEFAULT_OUTPUT_FILE = 'birth_affir.pdf'
 
-STYLES = getSampleStyleSheet()
-
-
-def setup(config_filename, styles):
-
-    with open(config_filename, 'r') as config_file:
-        config_data = json.load(config_file)
-
-    for path_font_regular, path_font_bold, path_font_bold_italic \
-        in zip(config_data['font-regular'],
-               config_data['font-bold'],
-               config_data['font-bold-italic']):
-        if os.path.exists(path_font_regular) and os.path.exists(path_font_bold):
-            pdfmetrics.registerFont(
-                TTFont('Font-Regular', path_font_regular))
-            pdfmetrics.registerFont(TTFont('Font-Bold', path_font_bold))
-            pdfmetrics.registerFont(
-                TTFont('Font-Bold-Italic', path_font_bold_italic))
-            break
-
-    styles.add(ParagraphStyle(name='Bold',
-                              fontName='Font-Bold',
-                              fontSize=9,
-                              leading=16,
-                              alignment=TA_JUSTIFY))
-
-    styles.add(ParagraphStyle(name='Heading',
-                              fontName='Font-Bold',
-                              fontSize=15,
-                              alignment=TA_CENTER,
-                              spaceAfter=5))
-
-    styles.add(ParagraphStyle(name='Info',
-                              fontName='Font-Bold',
-                              fontSize=9,
-                              alignment=TA_JUSTIFY,
-                              spaceAfter=0,
-                              leading=9))
-
-    styles.add(ParagraphStyle(name='Subtitle',
-                              fontName='Font-Regular',
-                              fontSize=9,
-                              alignment=TA_JUSTIFY,
-                              spaceAfter=0,
-                              leading=9))
+COAT_OF_ARMS = image_asset('coat_of_arms_of_greece.png')
+
+FONTS = ('Font-Regular', 'Font-Bold', 'Font-Bold-Italic')
+
+STYLES = FormStyles(
+    ParagraphStyle(name='Bold',
+                   fontName='Font-Bold',
+                   fontSize=9,
+                   leading=16,
+                   alignment=TA_JUSTIFY),
+    ParagraphStyle(name='Heading',
+                   fontName='Font-Bold',
+                   fontSize=15,
+                   alignment=TA_CENTER,
+                   spaceAfter=5),
+    ParagraphStyle(name='Info',
+                   fontName='Font-Bold',
+                   fontSize=9,
+                   alignment=TA_JUSTIFY,
+                   spaceAfter=0,
+                   leading=9),
+    ParagraphStyle(name='Subtitle',
+                   fontName='Font-Regular',
+                   fontSize=9,
+                   alignment=TA_JUSTIFY,
+                   spaceAfter=0,
+                   leading=9),
+)
+
+
+def setup(config_filename):
+    setup_form(config_filename, FONTS)
 
 
 def load_payload(payload_filename):
@@ -128,42 +122,40 @@ def load_payload(payload_filename):
     return json_data
 
 
-def shrink_to_fit(paragraph, style, assigned_width, assigned_height):
-    w, h = paragraph.wrap(assigned_width, assigned_height)
-    if assigned_width < w or assigned_height < h:
-        style = style.clone('default')
-    while assigned_width < w or assigned_height < h:
-        style.fontSize -= 1
-        paragraph = Paragraph(paragraph.text, style)
-        w, h = paragraph.wrap(assigned_width, assigned_height)
-    return paragraph, style
-
-
-def create_para(contents, width, height,
-                font_name='Font-Regular',
-                font_size=10):
-    style = ParagraphStyle('default',
-                           fontName=font_name,
-                           fontSize=font_size)
-    paragraph = Paragraph(contents, style)
-    paragraph, _ = shrink_to_fit(paragraph, style, width, height)
-    return paragraph
-
-
-def draw_para(canvas, contents, origin_x, origin_y, width, height,
-              font_name='Font-Regular',
-              font_size=10):
-    paragraph = create_para(contents,
-                            width, height,
-                            font_name=font_name,
-                            font_size=font_size)
-    paragraph.drawOn(canvas, origin_x, origin_y)
+def make_fields(payload):
+    """Return the payload with the values the layout computes from it."""
+    day, month, year = (int(x)
+                        for x in payload['birthdate'].split('-')[0].replace('/', '-').split('-'))
+    day_str = (num_to_text_hundreds(day, True).capitalize()
+               if day != 1 else "Πρώτη")
+    month_str = MONTHS[month - 1]
+    year_str = num_to_text_thousands(year)
+    fields = dict(payload,
+                  birthdate_words=f'{day_str} {month_str} {year_str}',
+                  birth_city=None,
+                  male_registry={})
+    if payload['birthcountry'] != 'Ελλάδα':
+        fields['birth_city'] = payload['birthregion']
+    if payload['gender'] == 'Άρρεν':
+        male_registry = fields['male_registry']
+        for key in ('mansdecentraladmin', 'mansmunicipalityname',
+                    'mansmunicipalunitname', 'mansmuniccommname'):
+            male_registry[key] = payload[key]
+        if payload['mansdecentraladmin'] is not None:
+            male_registry['mansrecordaa'] = payload['mansrecordaa']
+            male_registry['mansrecordyear'] = payload['mansrecordyear']
+        if payload['mansreckind'] is not None:
+            male_registry['registration'] = payload['mansrecordaa']
+    return fields
 
 
 def make_first_page(canvas, doc, qr, payload):
 
     canvas.saveState()
 
+    plan = load_plan(LAYOUT_FILE)
+    plan.static_layer.stamp(canvas)
+
     digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
     payload['uuid'] = uuid.uuid4().hex
     digest.update(json.dumps(payload).encode('utf-8'))
@@ -171,297 +163,25 @@ def make_first_page(canvas, doc, qr, payload):
     payload['digest'] = digest_hex
 
     # QR code
-    qr = qrcode.make(digest_hex)
-    canvas.drawInlineImage(qr,
-                           x=PAGE_WIDTH - 5 * cm,
-                           y=PAGE_HEIGHT - 3.5 * cm,
-                           width=2.5 * cm,
-                           height=2.5 * cm)
-
-    draw_para(canvas, f'Κωδικός: {digest_hex}',
+    draw_qr(canvas, encoded_reference(digest_hex),
+            x=PAGE_WIDTH - 5 * cm,
+            y=PAGE_HEIGHT - 3.5 * cm,
+            size=2.5 * cm)
+
+    draw_para(canvas, f'Κωδικός: {reference_code(digest_hex)}',
               0.5 * cm, PAGE_HEIGHT - 0.75 * cm,
               15 * cm, 0.5 * cm,
               font_name='Font-Regular',
               font_size=9)
 
     # Coat of arms
-    canvas.drawImage('coat_of_arms_of_greece.png',
-                     x=PAGE_WIDTH - PAGE_WIDTH / 2 - 1.75 * cm / 2,
-                     y=PAGE_HEIGHT - 2.7 * cm,
-                     width=1.75 * cm,
-                     height=1.75 * cm)
-
-    # heading line
-    canvas.line(9.05 * cm, PAGE_HEIGHT - 7.5 * cm,
-                PAGE_WIDTH - 9.05 * cm, PAGE_HEIGHT - 7.5 * cm)
-
-    draw_para(canvas, 'Επώνυμο',
-              3.2 * cm, PAGE_HEIGHT - 11.7 * cm, 2 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    draw_para(canvas, payload['surname'],
-              10 * cm, PAGE_HEIGHT - 11.7 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    if payload['secondsurname'] is not None:
-        draw_para(canvas, payload['secondsurname'],
-                  15 * cm, PAGE_HEIGHT - 11.7 * cm, 5 * cm, 1 * cm,
-                  font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Όνομα',
-              3.2 * cm, PAGE_HEIGHT - 12.2 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    draw_para(canvas, payload['firstname'],
-              10 * cm, PAGE_HEIGHT - 12.2 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    if payload['secondname'] is not None:
-        draw_para(canvas, payload['secondname'],
-                  14 * cm, PAGE_HEIGHT - 12.2 * cm, 4 * cm, 1 * cm,
-                  font_name='Font-Regular', font_size=9)
-    if payload['thirdname'] is not None:
-        draw_para(canvas, payload['thirdname'],
-                  18 * cm, PAGE_HEIGHT - 12.2 * cm, 4 * cm, 1 * cm,
-                  font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Φύλο',
-              3.2 * cm, PAGE_HEIGHT - 12.7 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    draw_para(canvas, payload['gender'],
-              10 * cm, PAGE_HEIGHT - 12.7 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Όνομα Πατέρα',
-              3.2 * cm, PAGE_HEIGHT - 13.2 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    draw_para(canvas, payload['fatherfirstname'],
-              10 * cm, PAGE_HEIGHT - 13.2 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    if payload['fathersecondname'] is not None:
-        draw_para(canvas, payload['fathersecondname'],
-                  15 * cm, PAGE_HEIGHT - 13.2 * cm, 5 * cm, 1 * cm,
-                  font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Επώνυμο Πατέρα',
-              3.2 * cm, PAGE_HEIGHT - 13.7 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    draw_para(canvas, payload['fathersurname'],
-              10 * cm, PAGE_HEIGHT - 13.7 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    if payload['fathersecondsurname'] is not None:
-        draw_para(canvas, payload['fathersecondsurname'],
-                  15 * cm, PAGE_HEIGHT - 13.7 * cm, 5 * cm, 1 * cm,
-                  font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Όνομα Μητέρας',
-              3.2 * cm, PAGE_HEIGHT - 14.2 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    draw_para(canvas, payload['motherfirstname'],
-              10 * cm, PAGE_HEIGHT - 14.2 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    if payload['mothersecondname'] is not None:
-        draw_para(canvas, payload['mothersecondname'],
-                  15 * cm, PAGE_HEIGHT - 14.2 * cm, 5 * cm, 1 * cm,
-                  font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Επώνυμο Μητέρας',
-              3.2 * cm, PAGE_HEIGHT - 14.7 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    draw_para(canvas, payload['mothersurname'],
-              10 * cm, PAGE_HEIGHT - 14.7 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    if payload['mothersecondsurname'] is not None:
-        draw_para(canvas, payload['mothersecondsurname'],
-                  15 * cm, PAGE_HEIGHT - 14.7 * cm, 5 * cm, 1 * cm,
-                  font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Γένος Μητέρας',
-              3.2 * cm, PAGE_HEIGHT - 15.2 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    if payload['mothergenos'] is not None:
-        draw_para(canvas, payload['mothergenos'],
-                  10 * cm, PAGE_HEIGHT - 15.2 * cm, 5 * cm, 1 * cm,
-                  font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Ειδικός Εκλογικός αριθμός',
-              3.2 * cm, PAGE_HEIGHT - 15.7 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    draw_para(canvas, payload['eklspecialno'],
-              10 * cm, PAGE_HEIGHT - 15.7 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Ημερομηνία γέννησης',
-              3.2 * cm, PAGE_HEIGHT - 16.2 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    draw_para(canvas, payload['birthdate'],
-              10 * cm, PAGE_HEIGHT - 16.2 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Ημερομηνία γέννησης ολογράφως',
-              3.2 * cm, PAGE_HEIGHT - 16.7 * cm, 6 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    day, month, year = (int(x)
-                        for x in payload['birthdate'].split('-')[0].replace('/', '-').split('-'))
-    day_str = (num_to_text_hundreds(day, True).capitalize()
-               if day != 1 else "Πρώτη")
-    month_str = MONTHS[month - 1]
-    year_str = num_to_text_thousands(year)
-    birthday_w = f'{day_str} {month_str} {year_str}'
-    draw_para(canvas, birthday_w,
-              10 * cm, PAGE_HEIGHT - 16.7 * cm, 10 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Οικισμός γέννησης',
-              3.2 * cm, PAGE_HEIGHT - 17.2 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    if payload['birthoikismos'] is not None:
-        draw_para(canvas, payload['birthoikismos'],
-                  10 * cm, PAGE_HEIGHT - 17.2 * cm, 5 * cm, 1 * cm,
-                  font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Τοπ./Δημ. Κοινότητα ή Κοινότητα γέννησης',
-              3.2 * cm, PAGE_HEIGHT - 18.1 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    if payload['birthmuniccomm'] is not None:
-        draw_para(canvas, payload['birthmuniccomm'],
-                  10 * cm, PAGE_HEIGHT - 18.1 * cm, 5 * cm, 1 * cm,
-                  font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Δημοτική Ενότητα γέννησης',
-              3.2 * cm, PAGE_HEIGHT - 18.6 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    if payload['birthmunicipalunit'] is not None:
-        draw_para(canvas, payload['birthmunicipalunit'],
-                  10 * cm, PAGE_HEIGHT - 18.6 * cm, 5 * cm, 1 * cm,
-                  font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Δήμος γέννησης',
-              3.2 * cm, PAGE_HEIGHT - 19.1 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    draw_para(canvas, payload['birthmunicipal'],
-              10 * cm, PAGE_HEIGHT - 19.1 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Πόλη γέννησης',
-              3.2 * cm, PAGE_HEIGHT - 19.6 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    if payload['birthcountry'] != 'Ελλάδα':
-        draw_para(canvas, payload['birthregion'],
-                  10 * cm, PAGE_HEIGHT - 19.6 * cm, 5 * cm, 1 * cm,
-                  font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Νομός γέννησης',
-              3.2 * cm, PAGE_HEIGHT - 20.1 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
+    COAT_OF_ARMS.draw(canvas,
+                      x=PAGE_WIDTH - PAGE_WIDTH / 2 - 1.75 * cm / 2,
+                      y=PAGE_HEIGHT - 2.7 * cm,
+                      width=1.75 * cm,
+                      height=1.75 * cm)
 
-    draw_para(canvas, payload['birthregion'],
-              10 * cm, PAGE_HEIGHT - 20.1 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Χώρα γέννησης',
-              3.2 * cm, PAGE_HEIGHT - 20.6 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    draw_para(canvas, payload['birthcountry'],
-              10 * cm, PAGE_HEIGHT - 20.6 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Ιθαγένεια',
-              3.2 * cm, PAGE_HEIGHT - 21.1 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    draw_para(canvas, payload['mainnationality'],
-              10 * cm, PAGE_HEIGHT - 21.1 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Ημ/νία Κτήσης Ιθαγένειας<super>3</super>',
-              3.2 * cm, PAGE_HEIGHT - 21.6 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    draw_para(canvas, payload['grnatgaindate'],
-              10 * cm, PAGE_HEIGHT - 21.6 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Ημ/νία Κτήσης Δημοτικότητας',
-              3.2 * cm, PAGE_HEIGHT - 22.1 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    draw_para(canvas, payload['gainmunrecdate'],
-              10 * cm, PAGE_HEIGHT - 22.1 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'ΑΜΚΑ',
-              3.2 * cm, PAGE_HEIGHT - 22.6 * cm, 1 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    draw_para(canvas, 'Μητρώο Αρρένων',
-              3.2 * cm, PAGE_HEIGHT - 23.1 * cm, 3 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    if payload['gender'] == 'Άρρεν':
-        if payload['mansdecentraladmin'] is not None:
-            draw_para(canvas, payload['mansdecentraladmin'],
-                      10 * cm, PAGE_HEIGHT - 23.1 * cm, 3 * cm, 1 * cm,
-                      font_name='Font-Regular', font_size=9)
-        if payload['mansmunicipalityname'] is not None:
-            draw_para(canvas, payload['mansmunicipalityname'],
-                      13 * cm, PAGE_HEIGHT - 23.1 * cm, 3 * cm, 1 * cm,
-                      font_name='Font-Regular', font_size=9)
-        if payload['mansmunicipalunitname'] is not None:
-            draw_para(canvas, payload['mansmunicipalunitname'],
-                      16 * cm, PAGE_HEIGHT - 23.1 * cm, 3 * cm, 1 * cm,
-                      font_name='Font-Regular', font_size=9)
-        if payload['mansmuniccommname'] is not None:
-            draw_para(canvas, payload['mansmuniccommname'],
-                      19 * cm, PAGE_HEIGHT - 23.1 * cm, 3 * cm, 1 * cm,
-                      font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Αριθμός - Έτος Μ.Α',
-              3.2 * cm, PAGE_HEIGHT - 23.6 * cm, 3 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    if payload['gender'] == 'Άρρεν':
-        if payload['mansdecentraladmin'] is not None:
-            draw_para(canvas, payload['mansrecordaa'],
-                      10 * cm, PAGE_HEIGHT - 23.6 * cm, 3 * cm, 1 * cm,
-                      font_name='Font-Regular', font_size=9)
-        if payload['mansdecentraladmin'] is not None:
-            draw_para(canvas, payload['mansrecordyear'],
-                      10 * cm, PAGE_HEIGHT - 23.6 * cm, 3 * cm, 1 * cm,
-                      font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Εγγραφή Μ.Α',
-              3.2 * cm, PAGE_HEIGHT - 24.1 * cm, 3 * cm, 1 * cm,
-              font_name='Font-Bold-Italic', font_size=9)
-
-    if payload['gender'] == 'Άρρεν':
-        if payload['mansreckind'] is not None:
-            draw_para(canvas, payload['mansrecordaa'],
-                      10 * cm, PAGE_HEIGHT - 24.1 * cm, 3 * cm, 1 * cm,
-                      font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Ο/Η Προϊστάμενος του Τμήματος Αστικής & Δημοτικής Κατάστασης',
-              14 * cm, PAGE_HEIGHT - 27.5 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=10)
+    plan.draw_fields(canvas, make_fields(payload))
 
     canvas.restoreState()
 
@@ -477,41 +197,41 @@ def make_later_pages(canvas, doc):
 
 def make_heading(element, contents):
     for pcontent in contents:
-        elements.append(Paragraph(pcontent, STYLES["Heading"]))
+        elements.append(shared_para(pcontent, STYLES["Heading"]))
 
 
 def make_info(element, contents):
     for pcontent in contents:
-        elements.append(Paragraph(pcontent, STYLES["Info"]))
+        elements.append(shared_para(pcontent, STYLES["Info"]))
 
 
 def make_subtitle(element, contents):
-    elements.append(Paragraph(contents, STYLES["Subtitle"]))
+    elements.append(shared_para(contents, STYLES["Subtitle"]))
 
 
 def make_sub(element, contents, payload):
     contents = contents % (1, 2, 3, 4, 5, 6, 7)
-    elements.append(Paragraph(contents, STYLES["Subtitle"]))
+    elements.append(shared_para(contents, STYLES["Subtitle"]))
 
 
 def make_text_intro(element, payload):
     content = 'Η παρούσα εκδόθηκε από αίτηση του ενδιαφέρομενου %s %s για :' \
         % (1, 2)
-    element.append(Paragraph(content, STYLES["Subtitle"]))
+    element.append(shared_para(content, STYLES["Subtitle"]))
 
 
 def make_text(element, payload):
     Spacer(0 * cm, 1 * cm),
     content = 'djnskdjndskjcndskjcndskcjdnskcjdncksjncdksjnkjcnskcdjnckjsnck'
-    element.append(Paragraph(content, STYLES["Subtitle"]))
+    element.append(shared_para(content, STYLES["Subtitle"]))
 
 
 def make_signature(element, payload):
     signature = [
         [
             Spacer(5.5 * cm, 3 * cm),
-            Paragraph('<Ο/Η> αρμόδι<ος/α> υπάλληλος του <ΚΕΠ>',
-                      STYLES['Subtitle'])
+            shared_para('<Ο/Η> αρμόδι<ος/α> υπάλληλος του <ΚΕΠ>',
+                        STYLES['Subtitle'])
         ]
     ]
 
@@ -519,47 +239,6 @@ def make_signature(element, payload):
     element.append(signature)
 
 
-def crypto_sign(certificate_filename, password, pdf_filename):
-
-    backend = default_backend()
-
-    with open(certificate_filename, 'rb') as cert_in:
-        cert_data = cert_in.read()
-    cert = load_key_and_certificates(cert_data, password.encode('utf-8'),
-                                     backend)
-
-    with open(pdf_filename, 'rb') as decl_file:
-        decl_pdf = decl_file.read()
-
-    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S+02'00'")
-
-    dct = {
-        b'sigflags': 3,
-        b'sigpage': 0,
-        b'sigbutton': True,
-        b'contact': b'support@grnet.gr',
-        b'location': b'Athens',
-        b'signingdate': timestamp.encode('utf-8'),
-        b'reason': b'GRNET Signing Service',
-        b'signature': f'Verified by GRNET S.A. {timestamp}'.encode('utf-8'),
-        b'signaturebox': (450, 0, 600, 100),
-    }
-
-    decl_signed = endesivepdf.cms.sign(decl_pdf,
-                                       dct,
-                                       cert[0],
-                                       cert[1],
-                                       cert[2],
-                                       'sha256'
-                                       )
-
-    filename, file_extension = os.path.splitext(pdf_filename)
-    signed_pdf_filename = f'{filename}-signed{file_extension}'
-    with open(signed_pdf_filename, 'wb') as decl_signed_file:
-        decl_signed_file.write(decl_pdf)
-        decl_signed_file.write(decl_signed)
-
-
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(
@@ -570,21 +249,37 @@ if __name__ == "__main__":
     parser.add_argument('-c', '--certificate', help='certificate file')
     parser.add_argument('-p', '--password', help='certificate password',
                         default=None)
+    parser.add_argument('--signer', metavar='SOCKET',
+                        help='sign with the signing daemon listening on '
+                        'SOCKET instead of a certificate file')
+    parser.add_argument('--keep-unsigned', action='store_true',
+                        help='when signing, also write the unsigned '
+                        'document')
     parser.add_argument('-q', '--qr_code',
                         action='store_true',
                         help='embed reference and QR code')
     parser.add_argument('-s', '--setup',
                         default='setup.json',
                         help='setup configuration file')
+    parser.add_argument('--preflight', nargs='*', metavar='PAYLOAD',
+                        help='only check that the fields of the payload files '
+                        f'(default: {PAYLOAD_FILE}) fit their boxes and '
+                        'print a JSON report line for each')
     args = parser.parse_args()
 
-    setup(args.setup, STYLES)
+    setup(args.setup)
 
-    doc = SimpleDocTemplate(args.output, pagesize=A4)
+    if args.preflight is not None:
+        ok = run_preflight(LAYOUT_FILE, args.preflight or [PAYLOAD_FILE],
+                           load_payload, make_fields)
+        sys.exit(0 if ok else 1)
+
+    output = io.BytesIO()
+    doc = SimpleDocTemplate(output, pagesize=A4)
 
     elements = []
 
-    payload = load_payload('birth_affir.json')
+    payload = load_payload(PAYLOAD_FILE)
     elements.append(Spacer(0, 1 * cm))
     make_info(elements, INFO)
     elements.append(Spacer(0, 1.5 * cm))
@@ -602,10 +297,17 @@ if __name__ == "__main__":
                                                                 args.qr_code,
                                                                 payload)
 
-    decl = doc.build(elements,
-                     onFirstPage=make_first_page_ld,
-                     onLaterPages=make_later_pages)
-
-    if args.certificate and args.password:
-        crypto_sign(args.certificate, args.password, args.output)
-    print(payload['digest'])
+    try:
+        decl = doc.build(elements,
+                         onFirstPage=make_first_page_ld,
+                         onLaterPages=make_later_pages)
+    except FitError as e:
+        sys.exit(f'{PAYLOAD_FILE}: {original_fit_error(e)}')
+
+    signer = None
+    if args.signer:
+        signer = SignerClient(args.signer)
+    elif args.certificate and args.password:
+        signer = load_signer(args.certificate, args.password)
+    write_document(args.output, output.getvalue(), signer, args.keep_unsigned)
+    print_reference(payload['digest'])
@@ -1,30 +1,33 @@
+import io
 import json
-import os.path
+import sys
 
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import cm
-from reportlab.platypus import SimpleDocTemplate, Paragraph
+from reportlab.platypus import SimpleDocTemplate
 from reportlab.platypus import Spacer
 from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.lib.styles import ParagraphStyle
 
 from birthday_to_numeral import num_to_text_hundreds, num_to_text_thousands
+from text_fit import (FitError, draw_para, original_fit_error,
+                      shared_para)
+from form_setup import FormStyles, setup_form
+from layout import load_plan, run_preflight
+from qr_path import draw_qr
+from image_assets import image_asset
+from reference_code import (encoded_reference, reference_code,
+                            print_reference)
+from signing import load_signer, write_document
+from signing_daemon import SignerClient
 
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.serialization.pkcs12 import (
-    load_key_and_certificates
-)
-from endesive import pdf as endesivepdf
 
-import datetime
 import argparse
 import uuid
 
-import qrcode
 
 PAGE_WIDTH, PAGE_HEIGHT = A4
 
@@ -53,48 +56,44 @@ INFO = ['ΕΛΛΗΝΙΚΗ ΔΗΜΟΚΡΑΤΙΑ', 'ΝΟΜΟΣ:',
 PAGE_DESCR = "Απόσπασμα Ληξιαρχικής Πράξης Γέννησης"
 
 
-DEFAULT_OUTPUT_FILE = 'birth_cert.pdf'
-
-STYLES = getSampleStyleSheet()
-
-
-def setup(config_filename, styles):
+PAYLOAD_FILE = 'birth_data.json'
 
-    with open(config_filename, 'r') as config_file:
-        config_data = json.load(config_file)
+LAYOUT_FILE = 'birth_certificate_layout.json'
 
-    for path_font_regular, path_font_bold in zip(config_data['font-regular'],
-                                                 config_data['font-bold']):
-        if os.path.exists(path_font_regular) and os.path.exists(path_font_bold):
-            pdfmetrics.registerFont(TTFont('Font-Regular', path_font_regular))
-            pdfmetrics.registerFont(TTFont('Font-Bold', path_font_bold))
-            break
-
-    styles.add(ParagraphStyle(name='Bold',
-                              fontName='Font-Bold',
-                              fontSize=9,
-                              leading=16,
-                              alignment=TA_JUSTIFY))
+DEFAULT_OUTPUT_FILE = 'birth_cert.pdf'
 
-    styles.add(ParagraphStyle(name='Heading',
-                              fontName='Font-Bold',
-                              fontSize=13,
-                              alignment=TA_CENTER,
-                              spaceAfter=5))
+COAT_OF_ARMS = image_asset('coat_of_arms_of_greece.png')
+
+FONTS = ('Font-Regular', 'Font-Bold')
+
+STYLES = FormStyles(
+    ParagraphStyle(name='Bold',
+                   fontName='Font-Bold',
+                   fontSize=9,
+                   leading=16,
+                   alignment=TA_JUSTIFY),
+    ParagraphStyle(name='Heading',
+                   fontName='Font-Bold',
+                   fontSize=13,
+                   alignment=TA_CENTER,
+                   spaceAfter=5),
+    ParagraphStyle(name='Info',
+                   fontName='Font-Regular',
+                   fontSize=9,
+                   alignment=TA_JUSTIFY,
+                   spaceAfter=0,
+                   leading=9),
+    ParagraphStyle(name='Notes',
+                   fontName='Font-Regular',
+                   fontSize=9,
+                   alignment=TA_JUSTIFY,
+                   spaceAfter=0,
+                   leading=9),
+)
 
-    styles.add(ParagraphStyle(name='Info',
-                              fontName='Font-Regular',
-                              fontSize=9,
-                              alignment=TA_JUSTIFY,
-                              spaceAfter=0,
-                              leading=9))
 
-    styles.add(ParagraphStyle(name='Notes',
-                              fontName='Font-Regular',
-                              fontSize=9,
-                              alignment=TA_JUSTIFY,
-                              spaceAfter=0,
-                              leading=9))
+def setup(config_filename):
+    setup_form(config_filename, FONTS)
 
 
 def load_payload(payload_filename):
@@ -103,42 +102,13 @@ def load_payload(payload_filename):
     return json_data
 
 
-def shrink_to_fit(paragraph, style, assigned_width, assigned_height):
-    w, h = paragraph.wrap(assigned_width, assigned_height)
-    if assigned_width < w or assigned_height < h:
-        style = style.clone('default')
-    while assigned_width < w or assigned_height < h:
-        style.fontSize -= 1
-        paragraph = Paragraph(paragraph.text, style)
-        w, h = paragraph.wrap(assigned_width, assigned_height)
-    return paragraph, style
-
-
-def create_para(contents, width, height,
-                font_name='Font-Regular',
-                font_size=10):
-    style = ParagraphStyle('default',
-                           fontName=font_name,
-                           fontSize=font_size)
-    paragraph = Paragraph(contents, style)
-    paragraph, _ = shrink_to_fit(paragraph, style, width, height)
-    return paragraph
-
-
-def draw_para(canvas, contents, origin_x, origin_y, width, height,
-              font_name='Font-Regular',
-              font_size=10):
-    paragraph = create_para(contents,
-                            width, height,
-                            font_name=font_name,
-                            font_size=font_size)
-    paragraph.drawOn(canvas, origin_x, origin_y)
-
-
 def make_first_page(canvas, doc, qr, payload):
 
     canvas.saveState()
 
+    plan = load_plan(LAYOUT_FILE)
+    plan.static_layer.stamp(canvas)
+
     digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
     payload['uuid'] = uuid.uuid4().hex
     digest.update(json.dumps(payload).encode('utf-8'))
@@ -146,324 +116,25 @@ def make_first_page(canvas, doc, qr, payload):
     payload['digest'] = digest_hex
 
     # QR code
-    qr = qrcode.make(digest_hex)
-    canvas.drawInlineImage(qr,
-                           x=PAGE_WIDTH - 5 * cm,
-                           y=PAGE_HEIGHT - 3.5 * cm,
-                           width=2.5 * cm,
-                           height=2.5 * cm)
-
-    draw_para(canvas, f'Κωδικός: {digest_hex}',
+    draw_qr(canvas, encoded_reference(digest_hex),
+            x=PAGE_WIDTH - 5 * cm,
+            y=PAGE_HEIGHT - 3.5 * cm,
+            size=2.5 * cm)
+
+    draw_para(canvas, f'Κωδικός: {reference_code(digest_hex)}',
               0.5 * cm, PAGE_HEIGHT - 0.75 * cm,
               15 * cm, 0.5 * cm,
               font_name='Font-Regular',
               font_size=9)
 
     # Coat of arms
-    canvas.drawImage('coat_of_arms_of_greece.png',
-                     x=PAGE_WIDTH - PAGE_WIDTH / 2 - 1.75 * cm / 2,
-                     y=PAGE_HEIGHT - 2.7 * cm,
-                     width=1.75 * cm,
-                     height=1.75 * cm)
-
-    draw_para(canvas, payload['district'],
-              4.5 * cm, PAGE_HEIGHT - 3.5 * cm, 2.5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['municipality'],
-              4.5 * cm, PAGE_HEIGHT - 3.8 * cm, 2.5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['registry_office'],
-              5 * cm, PAGE_HEIGHT - 4.1 * cm, 2.5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['street'],
-              4 * cm, PAGE_HEIGHT - 4.4 * cm, 2.5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['telephone'],
-              4.5 * cm, PAGE_HEIGHT - 4.7 * cm, 2.5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    # heading line
-    canvas.line(2 * cm, PAGE_HEIGHT - 5.3 * cm,
-                PAGE_WIDTH - 2 * cm, PAGE_HEIGHT - 5.3 * cm)
-
-    draw_para(canvas, 'ΣΤΟΙΧΕΙΑ ΛΗΞ.ΠΡΑΞΗΣ',
-              2.1 * cm, PAGE_HEIGHT - 6 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=10)
-
-    canvas.line(2.1 * cm, PAGE_HEIGHT - 6.05 * cm,
-                PAGE_WIDTH - 14.9 * cm, PAGE_HEIGHT - 6.05 * cm)
-
-    draw_para(canvas, 'Χαρακτηριστικά Ασφαλείας:',
-              2.1 * cm, PAGE_HEIGHT - 6.5 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['insurance_attr'],
-              6.3 * cm, PAGE_HEIGHT - 6.5 * cm, 2.5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Στοιχεία Ληξ. Πράξης Γέννησης (Αριθμός/τόμος/έτος):',
-              2.1 * cm, PAGE_HEIGHT - 7 * cm, 8 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['birth_cert_info'],
-              10 * cm, PAGE_HEIGHT - 7 * cm, 2.5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Ημερομηνία δήλωσης:',
-              2.1 * cm, PAGE_HEIGHT - 7.5 * cm, 8 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['decl_date'],
-              5.5 * cm, PAGE_HEIGHT - 7.5 * cm, 2.5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'ΣΤΟΙΧΕΙΑ ΝΕΟΓΝΟΥ',
-              2.1 * cm, PAGE_HEIGHT - 8 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=10)
-
-    canvas.line(2.1 * cm, PAGE_HEIGHT - 8.05 * cm,
-                PAGE_WIDTH - 15.45 * cm, PAGE_HEIGHT - 8.05 * cm)
+    COAT_OF_ARMS.draw(canvas,
+                      x=PAGE_WIDTH - PAGE_WIDTH / 2 - 1.75 * cm / 2,
+                      y=PAGE_HEIGHT - 2.7 * cm,
+                      width=1.75 * cm,
+                      height=1.75 * cm)
 
-    draw_para(canvas, 'Επώνυμο:',
-              2.1 * cm, PAGE_HEIGHT - 8.5 * cm, 2 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['newborn_surname'],
-              3.8 * cm, PAGE_HEIGHT - 8.5 * cm, 2.5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Όνομα:',
-              2.1 * cm, PAGE_HEIGHT - 9 * cm, 2 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['newborn_name'],
-              3.5 * cm, PAGE_HEIGHT - 9 * cm, 2.5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Φύλλο:',
-              2.1 * cm, PAGE_HEIGHT - 9.5 * cm, 2 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['newborn_gender'],
-              3.5 * cm, PAGE_HEIGHT - 9.5 * cm, 2.5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Ημερομηνία:',
-              2.1 * cm, PAGE_HEIGHT - 10 * cm, 2 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['newborn_date'],
-              4.2 * cm, PAGE_HEIGHT - 10 * cm, 2.5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'ΑΜΚΑ:',
-              2.1 * cm, PAGE_HEIGHT - 10.5 * cm, 1 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['newborn_amka'],
-              3.5 * cm, PAGE_HEIGHT - 10.5 * cm, 2.5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Τόπος Γέννησης (Οδός, Αρ., ΤΚ, Δημ./Τοπ. Κοιν. , Δημ. Ενότ, Δήμος, Νομός Χώρα):',
-              2.1 * cm, PAGE_HEIGHT - 12.7 * cm, 3 * cm, 5 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['newborn_birth_place'],
-              4.5 * cm, PAGE_HEIGHT - 12.7 * cm, 2.5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Πατέρας',
-              9 * cm, PAGE_HEIGHT - 13.2 * cm, 2 * cm, 1 * cm,
-              font_name='Font-Bold', font_size=9)
-
-    draw_para(canvas, 'Μητέρα',
-              16 * cm, PAGE_HEIGHT - 13.2 * cm, 2 * cm, 1 * cm,
-              font_name='Font-Bold', font_size=9)
-
-    draw_para(canvas, 'ΣΤΟΙΧΕΙΑ ΓΟΝΕΩΝ',
-              2.1 * cm, PAGE_HEIGHT - 13.7 * cm, 4 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=10)
-
-    canvas.line(2.1 * cm, PAGE_HEIGHT - 13.75 * cm,
-                PAGE_WIDTH - 15.6 * cm, PAGE_HEIGHT - 13.75 * cm)
-
-    draw_para(canvas, 'Επώνυμο:',
-              2.1 * cm, PAGE_HEIGHT - 14.2 * cm, 2 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['father_surname'],
-              8 * cm, PAGE_HEIGHT - 14.2 * cm, 7 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['mother_surname'],
-              15 * cm, PAGE_HEIGHT - 14.2 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Όνομα:',
-              2.1 * cm, PAGE_HEIGHT - 14.7 * cm, 2 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['father_name'],
-              8 * cm, PAGE_HEIGHT - 14.7 * cm, 7 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['mother_name'],
-              15 * cm, PAGE_HEIGHT - 14.7 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Ιθαγένεια:',
-              2.1 * cm, PAGE_HEIGHT - 15.4 * cm, 2 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['father_nationality'],
-              8 * cm, PAGE_HEIGHT - 15.4 * cm, 7 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['mother_nationality'],
-              15 * cm, PAGE_HEIGHT - 15.4 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Τόπος Κατοικίας (Οδός, Αρ., ΤΚ, Δημ/Τοπ. Κοιν.,Δημ. Ενότ, Δήμος, Νομός, Χώρα):',
-              2.1 * cm, PAGE_HEIGHT - 16.7 * cm, 4.5 * cm, 5 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['father_nationality'],
-              8 * cm, PAGE_HEIGHT - 16.7 * cm, 7 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['mother_nationality'],
-              15 * cm, PAGE_HEIGHT - 16.7 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Πόλη Εξωτερικού:',
-              2.1 * cm, PAGE_HEIGHT - 17.2 * cm, 3 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['father_foreign_city'],
-              8 * cm, PAGE_HEIGHT - 17.2 * cm, 7 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['mother_foreign_city'],
-              15 * cm, PAGE_HEIGHT - 17.2 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Δημοτολόγιο:',
-              2.1 * cm, PAGE_HEIGHT - 17.7 * cm, 2 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['father_municipality_logs'],
-              8 * cm, PAGE_HEIGHT - 17.7 * cm, 7 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['mother_municipality_logs'],
-              15 * cm, PAGE_HEIGHT - 17.7 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Αρ. Δημοτολογίου:',
-              2.1 * cm, PAGE_HEIGHT - 18.2 * cm, 3 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['father_municipality_logs'],
-              8 * cm, PAGE_HEIGHT - 18.2 * cm, 7 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['mother_municipality_logs'],
-              15 * cm, PAGE_HEIGHT - 18.2 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'ΑΦΜ:',
-              2.1 * cm, PAGE_HEIGHT - 18.7 * cm, 1 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['father_afm'],
-              8 * cm, PAGE_HEIGHT - 18.7 * cm, 7 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['mother_afm'],
-              15 * cm, PAGE_HEIGHT - 18.7 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'ΑΜΚΑ:',
-              2.1 * cm, PAGE_HEIGHT - 19.2 * cm, 1 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['father_amka'],
-              8 * cm, PAGE_HEIGHT - 19.2 * cm, 7 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['mother_amka'],
-              15 * cm, PAGE_HEIGHT - 19.2 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Φορείς Ασφάλισης:',
-              2.1 * cm, PAGE_HEIGHT - 19.7 * cm, 3 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, '1)',
-              5 * cm, PAGE_HEIGHT - 19.7 * cm, 1 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    if '1' in payload['father_insurance']:
-        draw_para(canvas, payload['father_insurance']['1'],
-                  8 * cm, PAGE_HEIGHT - 19.7 * cm, 7 * cm, 1 * cm,
-                  font_name='Font-Regular', font_size=9)
-    if '1' in payload['mother_insurance']:
-        draw_para(canvas, payload['mother_insurance']['1'],
-                  15 * cm, PAGE_HEIGHT - 19.7 * cm, 5 * cm, 1 * cm,
-                  font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, '2)',
-              5 * cm, PAGE_HEIGHT - 20.15 * cm, 1 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    if '2' in payload['father_insurance']:
-        draw_para(canvas, payload['father_insurance']['2'],
-                  8 * cm, PAGE_HEIGHT - 20.15 * cm, 7 * cm, 1 * cm,
-                  font_name='Font-Regular', font_size=9)
-    if '2' in payload['mother_insurance']:
-        draw_para(canvas, payload['mother_insurance']['2'],
-                  15 * cm, PAGE_HEIGHT - 20.15 * cm, 5 * cm, 1 * cm,
-                  font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, '3)',
-              5 * cm, PAGE_HEIGHT - 20.55 * cm, 1 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    if '3' in payload['father_insurance']:
-        draw_para(canvas, payload['father_insurance']['3'],
-                  8 * cm, PAGE_HEIGHT - 20.55 * cm, 7 * cm, 1 * cm,
-                  font_name='Font-Regular', font_size=9)
-    if '3' in payload['mother_insurance']:
-        draw_para(canvas, payload['mother_insurance']['3'],
-                  15 * cm, PAGE_HEIGHT - 20.55 * cm, 5 * cm, 1 * cm,
-                  font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Επών. Πατρός (μόνο μητέρα):',
-              2.1 * cm, PAGE_HEIGHT - 21.05 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, payload['mother_father_surname'],
-              15 * cm, PAGE_HEIGHT - 21.05 * cm, 5 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'ΠΑΡΑΤΗΡΗΣΕΙΣ',
-              2.1 * cm, PAGE_HEIGHT - 21.55 * cm, 3 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=10)
-
-    canvas.line(2.1 * cm, PAGE_HEIGHT - 21.6 * cm,
-                PAGE_WIDTH - 16.2 * cm, PAGE_HEIGHT - 21.6 * cm)
-
-    draw_para(canvas, payload['notes'],
-              2.1 * cm, PAGE_HEIGHT - 22.3 * cm, 10 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
-
-    draw_para(canvas, 'Ο/Η Ληξίαρχος',
-              15 * cm, PAGE_HEIGHT - 22.5 * cm, 3 * cm, 1 * cm,
-              font_name='Font-Regular', font_size=9)
+    plan.draw_fields(canvas, payload)
 
     canvas.restoreState()
 
@@ -478,53 +149,12 @@ def make_later_pages(canvas, doc):
 
 def make_heading(element, contents):
     for pcontent in contents:
-        elements.append(Paragraph(pcontent, STYLES["Heading"]))
+        elements.append(shared_para(pcontent, STYLES["Heading"]))
 
 
 def make_subtitle(element, contents):
     for pcontent in contents:
-        elements.append(Paragraph(pcontent, STYLES["Info"]))
-
-
-def crypto_sign(certificate_filename, password, pdf_filename):
-
-    backend = default_backend()
-
-    with open(certificate_filename, 'rb') as cert_in:
-        cert_data = cert_in.read()
-    cert = load_key_and_certificates(cert_data, password.encode('utf-8'),
-                                     backend)
-
-    with open(pdf_filename, 'rb') as decl_file:
-        decl_pdf = decl_file.read()
-
-    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S+02'00'")
-
-    dct = {
-        b'sigflags': 3,
-        b'sigpage': 0,
-        b'sigbutton': True,
-        b'contact': b'support@grnet.gr',
-        b'location': b'Athens',
-        b'signingdate': timestamp.encode('utf-8'),
-        b'reason': b'GRNET Signing Service',
-        b'signature': f'Verified by GRNET S.A. {timestamp}'.encode('utf-8'),
-        b'signaturebox': (450, 0, 600, 100),
-    }
-
-    decl_signed = endesivepdf.cms.sign(decl_pdf,
-                                       dct,
-                                       cert[0],
-                                       cert[1],
-                                       cert[2],
-                                       'sha256'
-                                       )
-
-    filename, file_extension = os.path.splitext(pdf_filename)
-    signed_pdf_filename = f'{filename}-signed{file_extension}'
-    with open(signed_pdf_filename, 'wb') as decl_signed_file:
-        decl_signed_file.write(decl_pdf)
-        decl_signed_file.write(decl_signed)
+        elements.append(shared_para(pcontent, STYLES["Info"]))
 
 
 if __name__ == "__main__":
@@ -537,21 +167,37 @@ if __name__ == "__main__":
     parser.add_argument('-c', '--certificate', help='certificate file')
     parser.add_argument('-p', '--password', help='certificate password',
                         default=None)
+    parser.add_argument('--signer', metavar='SOCKET',
+                        help='sign with the signing daemon listening on '
+                        'SOCKET instead of a certificate file')
+    parser.add_argument('--keep-unsigned', action='store_true',
+                        help='when signing, also write the unsigned '
+                        'document')
     parser.add_argument('-q', '--qr_code',
                         action='store_true',
                         help='embed reference and QR code')
     parser.add_argument('-s', '--setup',
                         default='setup.json',
                         help='setup configuration file')
+    parser.add_argument('--preflight', nargs='*', metavar='PAYLOAD',
+                        help='only check that the fields of the payload files '
+                        f'(default: {PAYLOAD_FILE}) fit their boxes and '
+                        'print a JSON report line for each')
     args = parser.parse_args()
 
-    setup(args.setup, STYLES)
+    setup(args.setup)
 
-    doc = SimpleDocTemplate(args.output, pagesize=A4)
+    if args.preflight is not None:
+        ok = run_preflight(LAYOUT_FILE, args.preflight or [PAYLOAD_FILE],
+                           load_payload, None)
+        sys.exit(0 if ok else 1)
+
+    output = io.BytesIO()
+    doc = SimpleDocTemplate(output, pagesize=A4)
 
     elements = []
 
-    payload = load_payload('birth_data.json')
+    payload = load_payload(PAYLOAD_FILE)
 
     make_subtitle(elements, INFO)
     make_heading(elements, [TITLE])
@@ -560,10 +206,17 @@ if __name__ == "__main__":
                                                                 args.qr_code,
                                                                 payload)
 
-    decl = doc.build(elements,
-                     onFirstPage=make_first_page_ld,
-                     onLaterPages=make_later_pages)
-
-    if args.certificate and args.password:
-        crypto_sign(args.certificate, args.password, args.output)
-    print(payload['digest'])
+    try:
+        decl = doc.build(elements,
+                         onFirstPage=make_first_page_ld,
+                         onLaterPages=make_later_pages)
+    except FitError as e:
+        sys.exit(f'{PAYLOAD_FILE}: {original_fit_error(e)}')
+
+    signer = None
+    if args.signer:
+        signer = SignerClient(args.signer)
+    elif args.certificate and args.password:
+        signer = load_signer(args.certificate, args.password)
+    write_document(args.output, output.getvalue(), signer, args.keep_unsigned)
+    print_reference(payload['digest'])
@@ -0,0 +1,166 @@
+import atexit
+import collections
+import os.path
+import sqlite3
+import threading
+
+from reportlab.pdfbase import pdfmetrics
+
+DEFAULT_MEMORY_ENTRIES = 4096
+DEFAULT_DISK_ENTRIES = 100000
+
+# Disk hits whose last use is written together, in one transaction.
+USED_BATCH = 256
+
+
+def font_fingerprint(font_name):
+    """Identify the font file behind a registered font name.
+
+    The same name (e.g. 'Font-Regular') may point to different files
+    depending on the setup file, so disk entries are keyed by file.
+    """
+    font = pdfmetrics.getFont(font_name)
+    face = getattr(font, 'face', None)
+    filename = getattr(face, 'filename', None)
+    if filename is None:
+        return font_name
+    return f'{font_name}:{os.path.abspath(filename)}'
+
+
+class FitCache:
+    """Fitted font sizes keyed by text, font, start size and box.
+
+    Lookups go to an in-process LRU first and then, if a database path
+    is given, to an SQLite file shared by all runs. The file holds at
+    most disk_entries rows; the least recently used ones are evicted.
+    The last use of the rows read is kept in memory and written with
+    the next insert, every USED_BATCH hits, or on close, so that a warm
+    lookup does not write to the disk.
+    """
+
+    def __init__(self, memory_entries=DEFAULT_MEMORY_ENTRIES,
+                 path=None, disk_entries=DEFAULT_DISK_ENTRIES):
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._clock = 0
+        self._disk_count = 0
+        # Disk key -> last use not yet written.
+        self._used = {}
+        if path is not None:
+            self._open(path)
+
+    def _open(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS fits ('
+                         'key TEXT PRIMARY KEY, '
+                         'font_size REAL NOT NULL, '
+                         'used INTEGER NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS fits_used '
+                         'ON fits (used)')
+        self._db.commit()
+        row = self._db.execute('SELECT MAX(used), COUNT(*) '
+                               'FROM fits').fetchone()
+        self._clock = row[0] or 0
+        self._disk_count = row[1]
+        atexit.register(self.close)
+
+    @staticmethod
+    def make_key(contents, font_name, font_size, width, height):
+        return (contents, font_name, font_size,
+                round(width, 2), round(height, 2))
+
+    @staticmethod
+    def _disk_key(key):
+        contents, font_name, font_size, width, height = key
+        return '\x1f'.join((contents, font_fingerprint(font_name),
+                            repr(font_size), repr(width), repr(height)))
+
+    def get(self, key):
+        with self._lock:
+            font_size = self._entries.get(key)
+            if font_size is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return font_size
+            if self._db is not None:
+                disk_key = self._disk_key(key)
+                row = self._db.execute(
+                    'SELECT font_size FROM fits WHERE key = ?',
+                    (disk_key,)).fetchone()
+                if row is not None:
+                    self._clock += 1
+                    self._used[disk_key] = self._clock
+                    if len(self._used) >= USED_BATCH:
+                        self._write_used()
+                        self._db.commit()
+                    self._remember(key, row[0])
+                    self.hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key, font_size):
+        with self._lock:
+            self._remember(key, font_size)
+            if self._db is None:
+                return
+            self._write_used()
+            self._clock += 1
+            cursor = self._db.execute(
+                'INSERT OR REPLACE INTO fits VALUES (?, ?, ?)',
+                (self._disk_key(key), font_size, self._clock))
+            self._disk_count += cursor.rowcount
+            if self._disk_count > self.disk_entries:
+                self._evict()
+            self._db.commit()
+
+    def _write_used(self):
+        if self._used:
+            self._db.executemany('UPDATE fits SET used = ? WHERE key = ?',
+                                 [(used, key)
+                                  for key, used in self._used.items()])
+            self._used.clear()
+
+    def _remember(self, key, font_size):
+        self._entries[key] = font_size
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.memory_entries:
+            self._entries.popitem(last=False)
+
+    def _evict(self):
+        # Other processes may share the file, so recount before deleting.
+        count = self._db.execute('SELECT COUNT(*) FROM fits').fetchone()[0]
+        excess = count - self.disk_entries
+        if excess > 0:
+            # Drop a tenth more than needed so that eviction does not
+            # run on every insert once the cache is full.
+            excess += self.disk_entries // 10
+            cursor = self._db.execute(
+                'DELETE FROM fits WHERE key IN ('
+                'SELECT key FROM fits ORDER BY used LIMIT ?)', (excess,))
+            count -= cursor.rowcount
+        self._disk_count = count
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._used.clear()
+                self._db.execute('DELETE FROM fits')
+                self._db.commit()
+                self._disk_count = 0
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                atexit.unregister(self.close)
+                self._write_used()
+                self._db.commit()
+                self._db.close()
+                self._db = None
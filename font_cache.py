@@ -0,0 +1,228 @@
+"""Parsed TrueType fonts kept on disk between runs.
+
+Registering a TTFont parses the whole font file (character maps,
+metrics, glyph locations) every time a generator starts, which takes
+longer than rendering a document from a warm process. A FontCache keeps
+the parsed tables of each font file in a directory, keyed by the file
+path, modification time and size and by the ReportLab version, and
+builds the TTFont from them instead.
+
+The tables are stored as marshal data of plain lists, dicts, numbers
+and strings, never as pickles, and a cache file is only read if it
+belongs to the user running the generator and only they can write it.
+
+The font file itself, whose glyph data is copied into the subsets
+embedded in documents, is not read into memory but mapped read-only,
+with or without the cache. Processes that load the same fonts then
+share one copy of the file in the page cache instead of holding one
+each, so more generator processes fit on a host. A font file must be
+replaced (a new file renamed over it, as package managers do) rather
+than rewritten in place while processes have it mapped.
+
+The cache also remembers which of the candidate paths of a setup file
+were found, so the candidates are only probed again when one of the
+fonts found changes or disappears. A font installed later at an earlier
+candidate path is picked up once the cache directory is cleared.
+"""
+
+import hashlib
+import json
+import marshal
+import mmap
+import os
+import tempfile
+from fnmatch import fnmatch
+from weakref import WeakKeyDictionary
+
+import reportlab
+from reportlab import rl_config
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFontFace, TTEncoding, TTFNameBytes
+
+from font_subsets import SharedSubsetFont
+
+FONT_CACHE_VERSION = 2
+
+PATHS_FILE = 'paths.json'
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_mtime_ns, stat.st_size]
+
+
+def _pdf_scale(units_per_em):
+    if units_per_em == 1000:
+        return lambda x: x
+    scale = 1000 / units_per_em
+    return lambda x: x * scale
+
+
+def map_font_file(path):
+    """Return the contents of a font file as a read-only memory map."""
+    with open(path, 'rb') as font_file:
+        return mmap.mmap(font_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def parse_font(font_name, path):
+    """Return a TTFont of the file, with its data mapped from the file."""
+    font = SharedSubsetFont(font_name, path)
+    # The parser reads the whole file; swap that copy for the mapping.
+    font.face._ttf_data = map_font_file(path)
+    return font
+
+
+def _make_font(font_name, face):
+    # What TTFont.__init__ does once it has parsed the face; checked
+    # against it by test_font_cache.
+    font = SharedSubsetFont.__new__(SharedSubsetFont)
+    font.fontName = font_name
+    font.face = face
+    font.encoding = TTEncoding()
+    font.state = WeakKeyDictionary()
+    font._asciiReadable = rl_config.ttfAsciiReadable
+    font.shapable = not any(fnmatch(font_name, glob)
+                            for glob in rl_config.unShapedFontGlob)
+    font.clear_subsets()
+    return font
+
+
+def _face_data(face):
+    """Return the parsed tables of a face as plain data for marshal.
+
+    The names of the strings that are TTFNameBytes are listed apart.
+    """
+    attributes = {}
+    name_bytes = []
+    for name, value in vars(face).items():
+        if name in ('_ttf_data', '_pdfScale'):
+            continue
+        if isinstance(value, TTFNameBytes):
+            name_bytes.append(name)
+            value = bytes(value)
+        attributes[name] = value
+    return attributes, name_bytes
+
+
+def _read_private(path):
+    """Return the contents of a file only its owner, the user, can write.
+
+    Returns None if the file is missing or anyone else could have
+    written it.
+    """
+    try:
+        with open(path, 'rb') as private_file:
+            stat = os.fstat(private_file.fileno())
+            if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+                return None
+            return private_file.read()
+    except OSError:
+        return None
+
+
+def _write_atomically(path, data):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+class FontCache:
+    """A directory of parsed font files and resolved candidate paths."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _face_path(self, key):
+        name = hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.face')
+
+    def load_font(self, font_name, path):
+        """Return a TTFont of the file, parsing it only on a cache miss."""
+        key = [FONT_CACHE_VERSION, reportlab.Version] + _file_key(path)
+        face_path = self._face_path(key)
+        data = _read_private(face_path)
+        try:
+            stored_key, attributes, name_bytes = marshal.loads(data)
+        except (TypeError, EOFError, ValueError):
+            stored_key = None
+        if stored_key != key:
+            font = parse_font(font_name, path)
+            _write_atomically(face_path, marshal.dumps(
+                (key,) + _face_data(font.face)))
+            return font
+        face = TTFontFace.__new__(TTFontFace)
+        face.__dict__.update(attributes)
+        for name in name_bytes:
+            setattr(face, name, TTFNameBytes(attributes[name]))
+        face._ttf_data = map_font_file(path)
+        face._pdfScale = _pdf_scale(face.unitsPerEm)
+        return _make_font(font_name, face)
+
+    def resolve(self, candidates):
+        """Return the cached choice of candidate paths, or None."""
+        entry = self._read_paths().get(json.dumps(candidates))
+        if entry is None:
+            return None
+        try:
+            if [_file_key(path) for path in entry['paths']] != entry['keys']:
+                return None
+        except OSError:
+            return None
+        return entry['paths']
+
+    def remember(self, candidates, paths):
+        entries = self._read_paths()
+        entries[json.dumps(candidates)] = {
+            'paths': paths,
+            'keys': [_file_key(path) for path in paths],
+        }
+        _write_atomically(os.path.join(self.directory, PATHS_FILE),
+                          json.dumps(entries).encode('utf-8'))
+
+    def _read_paths(self):
+        try:
+            with open(os.path.join(self.directory, PATHS_FILE)) as paths_file:
+                return json.load(paths_file)
+        except (OSError, ValueError):
+            return {}
+
+
+def register_fonts(config_data, fonts, family=None):
+    """Register the first set of candidate fonts that all exist.
+
+    fonts maps each font name to the setup file key listing its
+    candidate paths; the n-th candidates of all the keys form a set.
+    family maps the keys of fonts already registered to their paths:
+    only the sets whose candidates of those keys are these paths are
+    tried, so that the fonts of a form come from one family. With a
+    "font-cache" directory in the setup file, fonts are loaded through
+    a FontCache. Returns the paths registered, or None if no set of
+    candidates exists.
+    """
+    family = family or {}
+    names = list(fonts)
+    keys = [fonts[name] for name in names] + list(family)
+    candidates = [list(paths[:len(names)]) for paths in
+                  zip(*(config_data[key] for key in keys))
+                  if list(paths[len(names):]) == list(family.values())]
+    cache = (FontCache(config_data['font-cache'])
+             if 'font-cache' in config_data else None)
+    paths = cache.resolve(candidates) if cache is not None else None
+    if paths is None:
+        paths = next((paths for paths in candidates
+                      if all(os.path.exists(path) for path in paths)), None)
+        if paths is None:
+            return None
+        if cache is not None:
+            cache.remember(candidates, paths)
+    for name, path in zip(names, paths):
+        font = (cache.load_font(name, path) if cache is not None
+                else parse_font(name, path))
+        pdfmetrics.registerFont(font)
+    return paths
@@ -0,0 +1,167 @@
+"""Font subsets shared by the documents of a process.
+
+ReportLab embeds the TrueType fonts of a document as subsets of at most
+256 characters each, numbered in the order the characters are first
+drawn. For every document it cuts each subset out of the font file,
+builds its ToUnicode map and compresses both, although consecutive
+documents of a form mostly end up with the same subsets.
+
+SharedSubsetFont keeps the compressed font file, ToUnicode map and
+widths of the subsets it has embedded, keyed by the characters of the
+subset, and reuses them for any later document of the process with the
+same subset. font_cache registers every font as a SharedSubsetFont.
+
+Subsets only repeat if characters are assigned codes in the same order.
+In canonical mode (configure_subsets, or "canonical-subsets" in the
+setup file) every font used by a document first gets the codes of
+CANONICAL_CHARSET, printable ASCII and Greek, after any the static
+layer has already assigned. Every document of a form then has the same
+subsets unless its payload uses other characters, at the cost of
+embedding the glyphs of the whole character set.
+"""
+
+import collections
+import threading
+import unicodedata
+
+from reportlab.pdfbase import pdfdoc
+from reportlab.pdfbase.ttfonts import (
+    TTFont, SUBSETN, makeToUnicodeCMap, FF_NONSYMBOLIC, FF_SYMBOLIC
+)
+
+SUBSET_ENTRIES = 64
+
+
+def _charset():
+    chars = [chr(code) for code in range(0x20, 0x7f)]
+    chars += [chr(code) for code in range(0x384, 0x3cf)
+              if unicodedata.category(chr(code)) != 'Cn']
+    chars += '«»·°§€‐–—‘’“”…'
+    return ''.join(chars)
+
+
+# Printable ASCII, the Greek alphabet with its accents and common
+# punctuation: all of it fits the first subset of a font.
+CANONICAL_CHARSET = _charset()
+
+CANONICAL = False
+
+
+def configure_subsets(canonical):
+    """Turn canonical subsets on or off for the process."""
+    global CANONICAL
+    CANONICAL = canonical
+
+
+def assign_canonical_codes(font, doc):
+    """Give CANONICAL_CHARSET its codes in the document, if not yet done."""
+    state = font._assignState(doc)
+    if not getattr(state, 'canonical', False):
+        state.canonical = True
+        TTFont.splitString(font, CANONICAL_CHARSET, doc)
+
+
+def _encoded_stream(content, **entries):
+    # A stream compressed beforehand; PDFStream leaves it as it is. The
+    # document names the object it references, so every document needs
+    # an object of its own.
+    dictionary = pdfdoc.PDFDictionary(entries)
+    dictionary['Filter'] = pdfdoc.PDFArray([pdfdoc.PDFName('FlateDecode')])
+    return pdfdoc.PDFStream(dictionary, content)
+
+
+class _Subset:
+
+    def __init__(self, face, n, subset):
+        self.base_font_name = (b''.join((SUBSETN(n), b'+', face.name,
+                                         face.subfontNameX))).decode('pdfdoc')
+        self.widths = list(map(face.getCharWidth, subset))
+        self.cmap = pdfdoc.PDFZCompress.encode(
+            makeToUnicodeCMap(self.base_font_name, subset))
+        content = face.makeSubset(subset)
+        self.font_file = pdfdoc.PDFZCompress.encode(content)
+        self.font_file_length = len(content)
+
+
+class SharedSubsetFont(TTFont):
+    """A TrueType font whose embedded subsets are built once per process.
+
+    Documents are written as TTFont would write them; see the module
+    documentation.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.clear_subsets()
+
+    def clear_subsets(self):
+        self._subsets = collections.OrderedDict()
+        self._subsets_lock = threading.Lock()
+
+    def splitString(self, text, doc, encoding='utf-8'):
+        if CANONICAL:
+            assign_canonical_codes(self, doc)
+        return super().splitString(text, doc, encoding)
+
+    def _subset(self, n, subset):
+        key = (n, tuple(subset))
+        with self._subsets_lock:
+            entry = self._subsets.get(key)
+            if entry is not None:
+                self._subsets.move_to_end(key)
+                return entry
+        entry = _Subset(self.face, n, subset)
+        with self._subsets_lock:
+            self._subsets[key] = entry
+            while len(self._subsets) > SUBSET_ENTRIES:
+                self._subsets.popitem(last=False)
+        return entry
+
+    def addObjects(self, doc):
+        if not doc.compression:
+            return super().addObjects(doc)
+        state = self._assignState(doc)
+        state.frozen = 1
+        face = self.face
+        for n, subset in enumerate(state.subsets):
+            internalName = self.getSubsetInternalName(n, doc)[1:]
+            entry = self._subset(n, subset)
+            baseFontName = entry.base_font_name
+
+            pdfFont = pdfdoc.PDFTrueTypeFont()
+            pdfFont.__Comment__ = 'Font %s subset %d' % (self.fontName, n)
+            pdfFont.Name = internalName
+            pdfFont.BaseFont = baseFontName
+
+            pdfFont.FirstChar = 0
+            pdfFont.LastChar = len(subset) - 1
+
+            pdfFont.Widths = pdfdoc.PDFArray(entry.widths)
+            pdfFont.ToUnicode = doc.Reference(_encoded_stream(entry.cmap),
+                                              'toUnicodeCMap:' + baseFontName)
+
+            fontFile = _encoded_stream(entry.font_file,
+                                       Length1=entry.font_file_length)
+            fontFileRef = doc.Reference(fontFile, 'fontFile:%s(%s)'
+                                        % (face.filename, baseFontName))
+            fontDescriptor = pdfdoc.PDFDictionary({
+                'Type': '/FontDescriptor',
+                'Ascent': face.ascent,
+                'CapHeight': face.capHeight,
+                'Descent': face.descent,
+                'Flags': face.flags & ~FF_NONSYMBOLIC | FF_SYMBOLIC,
+                'FontBBox': pdfdoc.PDFArray(face.bbox),
+                'FontName': pdfdoc.PDFName(baseFontName),
+                'ItalicAngle': face.italicAngle,
+                'StemV': face.stemV,
+                'FontFile2': fontFileRef,
+                'MissingWidth': face.defaultWidth,
+                })
+            pdfFont.FontDescriptor = doc.Reference(
+                fontDescriptor, 'fontDescriptor:' + baseFontName)
+
+            # link it in
+            doc.Reference(pdfFont, internalName)
+            fontDict = doc.idToObject['BasicFonts'].dict
+            fontDict[internalName] = pdfFont
+        del self.state[doc]
@@ -0,0 +1,117 @@
+"""Process-wide setup shared by the forms.
+
+The generators used to add their paragraph styles to a module-level
+sample stylesheet and register their fonts in setup(), so setting up a
+form twice in one process failed and a long-lived process could not
+serve several forms. Styles are now a FormStyles built once per form at
+import, and setup_form() may be called any number of times, from any
+thread and for any form:
+
+* the setup file is applied (fit cache, canonical subsets, reference
+  code format, compact output, signature reservation) only when its
+  contents differ from the last one applied;
+* a font is registered the first time a form that needs it is set up,
+  and kept for the life of the process. It is taken from the same set
+  of candidates as the fonts registered before it, so all the variants
+  are of one family. Changing the candidate paths of a font already
+  registered has no effect until the process restarts, since fitted
+  sizes, width tables and compiled layouts depend on it.
+"""
+
+import collections.abc
+import hashlib
+import json
+import threading
+
+from font_cache import register_fonts
+from font_subsets import configure_subsets
+from pdf_compact import configure_compact
+from qr_path import configure_qr
+from reference_code import DEFAULT_REFERENCE_BITS, configure_reference
+from signing import configure_reservation
+from text_fit import configure_fit_cache
+
+# The setup file key listing the candidate paths of each font.
+FONT_KEYS = {
+    'Font-Regular': 'font-regular',
+    'Font-Bold': 'font-bold',
+    'Font-Bold-Italic': 'font-bold-italic',
+}
+
+_APPLIED = None
+_REGISTERED = {}
+_LOCK = threading.Lock()
+
+
+class SetupError(ValueError):
+    """Raised for a setup file that does not provide the fonts of a form."""
+
+
+class FormStyles(collections.abc.Mapping):
+    """The paragraph styles of a form, by name; read-only.
+
+    The styles themselves are shared by every document of the process
+    and key the paragraph pool, so they must not be changed either:
+    clone one to draw in another style.
+    """
+
+    def __init__(self, *styles):
+        self._styles = {style.name: style for style in styles}
+
+    def __getitem__(self, name):
+        return self._styles[name]
+
+    def __iter__(self):
+        return iter(self._styles)
+
+    def __len__(self):
+        return len(self._styles)
+
+
+def _apply(config_data):
+    configure_subsets(config_data.get('canonical-subsets', False))
+    configure_reference(config_data.get('reference-code', 'hex'),
+                        config_data.get('reference-bits',
+                                        DEFAULT_REFERENCE_BITS))
+    configure_qr(config_data.get('qr-error-correction', 'M'))
+    configure_compact(config_data.get('compact-output', False))
+    configure_reservation(config_data.get('reserve-signature', False))
+    if 'fit-cache' in config_data:
+        configure_fit_cache(config_data['fit-cache'])
+    else:
+        configure_fit_cache()
+
+
+def setup_form(config_filename, fonts):
+    """Apply a setup file and register the fonts a form needs.
+
+    fonts names the fonts of the form (keys of FONT_KEYS); the ones not
+    yet registered are registered together from the setup file, from
+    the set of candidates of the ones that are. Returns the parsed setup
+    file.
+    """
+    global _APPLIED
+    with open(config_filename, 'rb') as config_file:
+        data = config_file.read()
+    key = hashlib.sha256(data).hexdigest()
+    config_data = json.loads(data)
+    with _LOCK:
+        if _APPLIED != key:
+            _apply(config_data)
+            _APPLIED = key
+        missing = [name for name in fonts if name not in _REGISTERED]
+        if missing:
+            family = {FONT_KEYS[name]: path
+                      for name, path in _REGISTERED.items()}
+            paths = register_fonts(config_data, {name: FONT_KEYS[name]
+                                                 for name in missing},
+                                   family)
+            if paths is None:
+                raise SetupError(f'{config_filename}: no candidate paths of '
+                                 f'{", ".join(missing)} all exist'
+                                 + (' in the family of '
+                                    f'{", ".join(_REGISTERED)}'
+                                    if _REGISTERED else ''))
+            _REGISTERED.update(zip(missing, paths))
+    return config_data
+
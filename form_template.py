@@ -0,0 +1,285 @@
+"""Template backend for forms that always fit on one page.
+
+The Platypus renderer lays out the whole story and serialises every PDF
+object again for each document, although for a fixed form only a few
+strings change: the field values, the reference code and QR image, and
+the date and names under the signature. A FormTemplate renders the
+payload-independent part of the page once per process, through the
+usual Platypus code, and keeps the resulting PDF as bytes. Each document
+is then a fresh, small content stream with the payload-dependent
+operators appended to the kept page stream, written out with the kept
+font, image and form objects around it.
+
+Text operators refer to per-document font subsets, so the template
+fonts are subsetted up front with the canonical character set of
+font_subsets, which covers Greek and ASCII text, and every document
+starts from the same subset assignments. A document that needs a
+character outside them, another font or object, or a signature line
+that wraps raises TemplateMiss, and the caller renders it with Platypus
+instead.
+"""
+
+import copy
+import hashlib
+import io
+import re
+import threading
+import zlib
+
+from reportlab.lib.rl_accel import asciiBase85Decode
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.pdfdoc import TimeStamp
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.platypus import Flowable, Paragraph, SimpleDocTemplate
+
+from font_subsets import assign_canonical_codes
+
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
+
+class FormTemplateError(ValueError):
+    """Raised for a template story that does not fit on one page."""
+
+
+class TemplateMiss(Exception):
+    """Raised when a document cannot be rendered from its template."""
+
+
+class Slot(Flowable):
+    """A one-line paragraph of payload text in a template story.
+
+    It takes the place of Paragraph(text, style) in the story that is
+    rendered into the template, occupies the space a one-line paragraph
+    would, and remembers where it was drawn; the text is ignored.
+    """
+
+    def __init__(self, text, style):
+        super().__init__()
+        self.style = style
+        self.position = None
+
+    def wrap(self, availWidth, availHeight):
+        self.width = availWidth
+        self.height = self.style.leading
+        return self.width, self.height
+
+    def draw(self):
+        self.position = self.canv.absolutePosition(0, 0)
+
+
+class _TemplateDocument(SimpleDocTemplate):
+
+    def __init__(self, *args, fonts, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.template_fonts = fonts
+        self.font_mapping = None
+        self.font_states = None
+
+    def beforeDocument(self):
+        doc = self.canv._doc
+        for font_name in self.template_fonts:
+            font = pdfmetrics.getFont(font_name)
+            assign_canonical_codes(font, doc)
+            font.getSubsetInternalName(0, doc)
+
+    def afterPage(self):
+        if self.page > 1:
+            raise FormTemplateError('template story does not fit one page')
+        doc = self.canv._doc
+        self.font_mapping = dict(doc.fontMapping)
+        self.font_states = {}
+        for font_name in doc.fontMapping:
+            state = getattr(pdfmetrics.getFont(font_name), 'state', {})
+            if doc in state:
+                self.font_states[font_name] = copy.deepcopy(state[doc])
+
+
+class _CompiledTemplate:
+
+    def __init__(self, data, font_mapping, font_states, slots):
+        self.font_mapping = font_mapping
+        self.font_states = font_states
+        # (x, y, width, height, style) of each slot, in story order.
+        self.slots = slots
+        self._split(data)
+
+    def _split(self, data):
+        xref = int(re.search(rb'startxref\s+(\d+)', data).group(1))
+        count = int(re.match(rb'xref\s+0 (\d+)\s', data[xref:]).group(1))
+        table = data[xref:].split(b'\n', 2)[2]
+        offsets = [int(table[20 * i:20 * i + 10]) for i in range(1, count)]
+        self.header = data[:offsets[0]]
+        self.objects = [data[start:end] for start, end
+                        in zip(offsets, offsets[1:] + [xref])]
+        trailer = data[data.index(b'trailer', xref):data.rindex(b'startxref')]
+        # The parts of the trailer around the file identifier.
+        self.trailer = re.split(rb'/ID\s*\[<\w+><\w+>\]', trailer)
+        self.info = int(re.search(rb'/Info (\d+) 0 R', trailer).group(1)) - 1
+        contents = [int(match.group(1)) for match in
+                    re.finditer(rb'/Contents (\d+) 0 R', b''.join(self.objects))]
+        if len(contents) != 1:
+            raise FormTemplateError('template is not a one-page document')
+        self.contents = contents[0] - 1
+        self.stream = self._decode(self.objects[self.contents])
+
+    @staticmethod
+    def _decode(obj):
+        dictionary, rest = obj.split(b'stream', 1)
+        length = int(re.search(rb'/Length (\d+)', dictionary).group(1))
+        stream = rest.lstrip(b'\r')[1:length + 1]
+        filters = re.search(rb'/Filter \[([^\]]*)\]', dictionary)
+        for name in (filters.group(1).split() if filters else []):
+            if name == b'/ASCII85Decode':
+                stream = asciiBase85Decode(stream)
+            elif name == b'/FlateDecode':
+                stream = zlib.decompress(stream)
+            else:
+                raise FormTemplateError(f'cannot decode {name.decode()} '
+                                        f'page stream')
+        return stream
+
+    def seed(self, doc):
+        doc.fontMapping.update(self.font_mapping)
+        for font_name, state in self.font_states.items():
+            # Only the assignments and subsets change as text is drawn.
+            seeded = copy.copy(state)
+            seeded.assignments = dict(state.assignments)
+            seeded.subsets = [list(subset) for subset in state.subsets]
+            pdfmetrics.getFont(font_name).state[doc] = seeded
+
+    def check(self, doc):
+        if doc.fontMapping != self.font_mapping:
+            raise TemplateMiss('document uses fonts the template lacks')
+        for font_name, state in self.font_states.items():
+            if pdfmetrics.getFont(font_name).state[doc].nextCode \
+                    != state.nextCode:
+                raise TemplateMiss(f'text has characters outside the '
+                                   f'{font_name} subsets of the template')
+
+    def write(self, code):
+        stream = zlib.compress(self.stream + b'\nq\n' + code + b'\nQ\n')
+        objects = list(self.objects)
+        objects[self.contents] = (
+            b'%d 0 obj\n<<\n/Filter [ /FlateDecode ] /Length %d\n>>\n'
+            b'stream\n%s\nendstream\nendobj\n'
+            % (self.contents + 1, len(stream), stream))
+        ts = TimeStamp()
+        date = (b"D:%04d%02d%02d%02d%02d%02d%+03d'%02d'"
+                % (*ts.YMDhms, ts.dhh, ts.dmm))
+        objects[self.info] = re.sub(rb"D:\d{14}[-+]\d\d'\d\d'", date,
+                                    objects[self.info])
+        digest = hashlib.md5(stream).hexdigest().encode()
+        out = [self.header]
+        offset = len(self.header)
+        xref = [b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)]
+        for obj in objects:
+            xref.append(b'%010d 00000 n \n' % offset)
+            out.append(obj)
+            offset += len(obj)
+        out.extend(xref)
+        file_id = b'/ID [<%s><%s>]' % (digest, digest)
+        out.append(file_id.join(self.trailer))
+        out.append(b'startxref\n%d\n%%%%EOF\n' % offset)
+        return b''.join(out)
+
+
+class FormTemplate:
+    """The payload-independent part of a one-page form, rendered once.
+
+    draw_page(canvas, doc) is called as onFirstPage, and story is the
+    list of flowables of the page, with a Slot in place of each
+    one-line paragraph of payload text. fonts names the TrueType fonts
+    payload text may be drawn in. Further keyword arguments are passed
+    to SimpleDocTemplate, as for the Platypus renderer.
+    """
+
+    def __init__(self, draw_page, story, fonts, **doc_kwargs):
+        self.draw_page = draw_page
+        self.story = story
+        self.fonts = fonts
+        self.doc_kwargs = doc_kwargs
+        self._compiled = None
+        self._lock = threading.Lock()
+
+    def compile(self):
+        with self._lock:
+            if self._compiled is None:
+                self._compiled = self._compile()
+            return self._compiled
+
+    def _compile(self):
+        output = io.BytesIO()
+        doc = _TemplateDocument(output, fonts=self.fonts, **self.doc_kwargs)
+        doc.build(list(self.story), onFirstPage=self.draw_page)
+        slots = []
+        for flowable in _walk(self.story):
+            if isinstance(flowable, Slot):
+                if flowable.position is None:
+                    raise FormTemplateError('template slot was not drawn')
+                slots.append(flowable.position + (flowable.width,
+                                                  flowable.height,
+                                                  flowable.style))
+        return _CompiledTemplate(output.getvalue(), doc.font_mapping,
+                                 doc.font_states, slots)
+
+    def render(self, draw, slot_texts):
+        """Return the PDF of one document as bytes.
+
+        draw(canvas) draws the payload-dependent operators of the page,
+        and slot_texts gives the text of each slot of the story. Raises
+        TemplateMiss if the document has to be rendered with Platypus.
+        """
+        compiled = self.compile()
+        canvas = Canvas(io.BytesIO(), pagesize=self.doc_kwargs.get('pagesize'))
+        doc = canvas._doc
+        compiled.seed(doc)
+        objects = len(doc.idToObject)
+        draw(canvas)
+        for (x, y, width, height, style), text in zip(compiled.slots,
+                                                      slot_texts):
+            paragraph = Paragraph(text, style)
+            if paragraph.wrap(width, height)[1] > height:
+                raise TemplateMiss('signature line does not fit one line')
+            paragraph.drawOn(canvas, x, y)
+        if len(doc.idToObject) != objects:
+            raise TemplateMiss('document draws objects the template lacks')
+        compiled.check(doc)
+        return compiled.write('\n'.join(canvas._code).encode('latin-1'))
+
+
+def _walk(flowables):
+    for flowable in flowables:
+        yield flowable
+        for row in getattr(flowable, '_cellvalues', ()):
+            for cell in row:
+                yield from _walk(cell if isinstance(cell, (list, tuple))
+                                 else [cell])
+
+
+def compare_pdfs(first, second, dpi=100):
+    """Return the number of differing pixels on each page of two PDFs.
+
+    first and second are PDF documents as bytes. A page only one of them
+    has counts as differing entirely. Needs PyMuPDF.
+    """
+    if pymupdf is None:
+        raise RuntimeError('comparing renderings needs PyMuPDF')
+    pages = []
+    for data in (first, second):
+        with pymupdf.open(stream=data, filetype='pdf') as document:
+            pages.append([page.get_pixmap(dpi=dpi).samples
+                          for page in document])
+    differences = []
+    for index in range(max(len(pages[0]), len(pages[1]))):
+        if index >= len(pages[0]) or index >= len(pages[1]):
+            samples = max(pages, key=len)[index]
+            differences.append(len(samples) // 3)
+            continue
+        a, b = pages[0][index], pages[1][index]
+        differences.append(0 if a == b else
+                           sum(a[i:i + 3] != b[i:i + 3]
+                               for i in range(0, len(a), 3)))
+    return differences
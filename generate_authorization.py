@@ -1,30 +1,36 @@
+import io
 import json
-import os.path
+import os
+import sys
+import time
 
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import cm
 from reportlab.platypus import SimpleDocTemplate, Table, Paragraph, Frame
 from reportlab.platypus import Spacer
 from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.lib.styles import ParagraphStyle
 
 from birthday_to_numeral import num_to_text_hundreds, num_to_text_thousands
+from text_fit import (FitError, draw_para, original_fit_error,
+                      shared_para)
+from form_setup import FormStyles, setup_form
+from layout import load_plan, run_preflight
+from qr_path import QR_CACHE, draw_qr, format_qr_stats, prefetch_qr
+from reference_code import (encoded_reference, reference_code,
+                            print_reference)
+from signing import load_signer, write_document
+from signing_daemon import SignerClient
+from signing_pool import BatchWriter, SigningPool
+from form_template import FormTemplate, Slot, TemplateMiss, compare_pdfs
 
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.serialization.pkcs12 import (
-    load_key_and_certificates
-)
-from endesive import pdf as endesivepdf
 
-import datetime
 import argparse
 import uuid
 
-import qrcode
 
 PAGE_WIDTH, PAGE_HEIGHT = A4
 
@@ -63,373 +69,82 @@ IAUTHORIZE = 'Ε ξ ο υ σ ι ο δ ο τ ώ'
 
 PAGE_DESCR = "Εξουσιοδότηση"
 
-DEFAULT_OUTPUT_FILE = 'authorization.pdf'
-
-STYLES = getSampleStyleSheet()
+# Fonts payload text is drawn in.
+FONTS = ('Font-Regular', 'Font-Bold')
 
+PAYLOAD_FILE = 'auth_data.json'
 
-def setup(config_filename, styles):
+LAYOUT_FILE = 'authorization_layout.json'
 
-    with open(config_filename, 'r') as config_file:
-        config_data = json.load(config_file)
+DEFAULT_OUTPUT_FILE = 'authorization.pdf'
 
-    for path_font_regular, path_font_bold in zip(config_data['font-regular'],
-                                                 config_data['font-bold']):
-        if os.path.exists(path_font_regular) and os.path.exists(path_font_bold):
-            pdfmetrics.registerFont(TTFont('Font-Regular', path_font_regular))
-            pdfmetrics.registerFont(TTFont('Font-Bold', path_font_bold))
-            break
+STYLES = FormStyles(
+    ParagraphStyle(name='DeclHeading',
+                   fontName='Font-Bold',
+                   fontSize=16,
+                   alignment=TA_CENTER,
+                   spaceAfter=5),
+    ParagraphStyle(name='NameSignature',
+                   fontName='Font-Regular',
+                   fontSize=10,
+                   alignment=TA_CENTER),
+)
 
-    styles.add(ParagraphStyle(name='DeclHeading',
-                              fontName='Font-Bold',
-                              fontSize=16,
-                              alignment=TA_CENTER,
-                              spaceAfter=5))
 
-    styles.add(ParagraphStyle(name='NameSignature',
-                              fontName='Font-Regular',
-                              fontSize=10,
-                              alignment=TA_CENTER))
+def setup(config_filename):
+    setup_form(config_filename, FONTS)
 
 
 def load_payload(payload_filename):
     with open(payload_filename, 'r') as json_file:
         json_data = json.load(json_file)
+    if 'gender' not in json_data:
+        json_data['gender'] = 'mf'
     return json_data
 
 
-def shrink_to_fit(paragraph, style, assigned_width, assigned_height):
-    w, h = paragraph.wrap(assigned_width, assigned_height)
-    if assigned_width < w or assigned_height < h:
-        style = style.clone('default')
-    while assigned_width < w or assigned_height < h:
-        style.fontSize -= 1
-        paragraph = Paragraph(paragraph.text, style)
-        w, h = paragraph.wrap(assigned_width, assigned_height)
-    return paragraph, style
-
-
-def create_para(contents, width, height,
-                font_name='Font-Regular',
-                font_size=10):
-    style = ParagraphStyle('default',
-                           fontName=font_name,
-                           fontSize=font_size)
-    paragraph = Paragraph(contents, style)
-    paragraph, _ = shrink_to_fit(paragraph, style, width, height)
-    return paragraph
-
-
-def draw_para(canvas, contents, origin_x, origin_y, width, height,
-              font_name='Font-Regular',
-              font_size=10):
-    paragraph = create_para(contents,
-                            width, height,
-                            font_name=font_name,
-                            font_size=font_size)
-    paragraph.drawOn(canvas, origin_x, origin_y)
-
-
-def make_first_page(canvas, doc, qr, payload):
-
-    canvas.saveState()
-
+def make_reference(payload):
+    """Set the payload uuid and digest and return the digest."""
     digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
     payload['uuid'] = uuid.uuid4().hex
     digest.update(json.dumps(payload).encode('utf-8'))
     digest_hex = digest.finalize().hex()
     payload['digest'] = digest_hex
+    return digest_hex
 
-    if args.qr_code:
-        # QR code
-        qr = qrcode.make(digest_hex)
-        canvas.drawInlineImage(qr,
-                               x=PAGE_WIDTH - 5 * cm,
-                               y=PAGE_HEIGHT - 3.5 * cm,
-                               width=2.5 * cm,
-                               height=2.5 * cm)
-
-        draw_para(canvas, f'Κωδικός: {digest_hex}',
-                  0.5 * cm, PAGE_HEIGHT - 0.75 * cm,
-                  15 * cm, 0.5 * cm,
-                  font_name='Font-Regular',
-                  font_size=9)
-
-    draw_para(canvas, 'Ο/Η κάτωθι υπογεγραμμένος/η',
-              2.1 * cm, PAGE_HEIGHT - 4.8 * cm,
-              5 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-
-    # undersigned line
-    canvas.line(6.5 * cm, PAGE_HEIGHT - 4.8 * cm,
-                PAGE_WIDTH - 2 * cm, PAGE_HEIGHT - 4.8 * cm)
-    draw_para(canvas, payload['undersigned'],
-              7.5 * cm, PAGE_HEIGHT - 4.8 * cm,
-              13 * cm, 1 * cm)
-
-    draw_para(canvas, 'του',
-              2.1 * cm, PAGE_HEIGHT - 5.85 * cm,
-              5 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
 
-    # father_name line
-    canvas.line(2.6 * cm, PAGE_HEIGHT - 5.8 * cm,
-                PAGE_WIDTH - 11 * cm, PAGE_HEIGHT - 5.8 * cm)
-    draw_para(canvas, payload['father_name'],
-              4.5 * cm, PAGE_HEIGHT - 5.80 * cm,
-              5 * cm, 1 * cm)
+def draw_reference(canvas, digest_hex):
+    # QR code
+    draw_qr(canvas, encoded_reference(digest_hex),
+            x=PAGE_WIDTH - 5 * cm,
+            y=PAGE_HEIGHT - 3.5 * cm,
+            size=2.5 * cm)
 
-    draw_para(canvas, 'και της',
-              10 * cm, PAGE_HEIGHT - 5.85 * cm,
-              5 * cm, 1 * cm,
+    draw_para(canvas, f'Κωδικός: {reference_code(digest_hex)}',
+              0.5 * cm, PAGE_HEIGHT - 0.75 * cm,
+              15 * cm, 0.5 * cm,
               font_name='Font-Regular',
               font_size=9)
 
-    # mother_name line
-    canvas.line(11 * cm, PAGE_HEIGHT - 5.8 * cm,
-                PAGE_WIDTH - 2 * cm, PAGE_HEIGHT - 5.8 * cm)
-    draw_para(canvas, payload['mother_name'],
-              13 * cm, PAGE_HEIGHT - 5.8 * cm,
-              5 * cm, 1 * cm)
 
-    draw_para(canvas, 'γεννηθείς την',
-              2.1 * cm, PAGE_HEIGHT - 6.8 * cm,
-              5 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-    # date of birth line
-    canvas.line(4 * cm, PAGE_HEIGHT - 6.8 * cm,
-                PAGE_WIDTH - 12 * cm, PAGE_HEIGHT - 6.8 * cm)
-    draw_para(canvas, payload['date_of_birth'],
-              5 * cm, PAGE_HEIGHT - 6.8 * cm,
-              11 * cm, 1 * cm)
-
-    draw_para(canvas, ', στην',
-              9 * cm, PAGE_HEIGHT - 6.8 * cm,
-              5 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-    # birth place line
-    canvas.line(10 * cm, PAGE_HEIGHT - 6.8 * cm,
-                PAGE_WIDTH - 2 * cm, PAGE_HEIGHT - 6.8 * cm)
-    draw_para(canvas, payload['birth_place'],
-              12 * cm, PAGE_HEIGHT - 6.8 * cm,
-              11 * cm, 1 * cm)
-
-    draw_para(canvas, 'κάτοικος',
-              2.1 * cm, PAGE_HEIGHT - 7.8 * cm,
-              5 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-    # place of residence line
-    canvas.line(3.3 * cm, PAGE_HEIGHT - 7.8 * cm,
-                PAGE_WIDTH - 12 * cm, PAGE_HEIGHT - 7.8 * cm)
-    draw_para(canvas, payload['place_of_residence'],
-              5 * cm, PAGE_HEIGHT - 7.8 * cm,
-              11 * cm, 1 * cm)
-
-    draw_para(canvas, ', οδός',
-              9 * cm, PAGE_HEIGHT - 7.8 * cm,
-              11 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-    # street line
-    canvas.line(10 * cm, PAGE_HEIGHT - 7.8 * cm,
-                PAGE_WIDTH - 2 * cm, PAGE_HEIGHT - 7.8 * cm)
-    draw_para(canvas, payload['street'],
-              12 * cm, PAGE_HEIGHT - 7.8 * cm,
-              11 * cm, 1 * cm)
-
-    draw_para(canvas, 'αρ',
-              2.1 * cm, PAGE_HEIGHT - 8.8 * cm,
-              11 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-    # street number line
-    canvas.line(2.5 * cm, PAGE_HEIGHT - 8.8 * cm,
-                PAGE_WIDTH - 15 * cm, PAGE_HEIGHT - 8.8 * cm)
-    draw_para(canvas, payload['street_number'],
-              3 * cm, PAGE_HEIGHT - 8.8 * cm,
-              3.5 * cm, 1 * cm)
-
-    draw_para(canvas, ', με ΑΔΤ/Διαβατηρίου',
-              6 * cm, PAGE_HEIGHT - 8.8 * cm,
-              5 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-    # id number line
-    canvas.line(9 * cm, PAGE_HEIGHT - 8.8 * cm,
-                PAGE_WIDTH - 4.5 * cm, PAGE_HEIGHT - 8.8 * cm)
-    draw_para(canvas, payload['id_number'],
-              10 * cm, PAGE_HEIGHT - 8.80 * cm,
-              5.5 * cm, 1 * cm)
-
-    draw_para(canvas, 'που εκδόθηκε την',
-              16.5 * cm, PAGE_HEIGHT - 8.8 * cm,
-              4 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-    # id number line
-    canvas.line(2.1 * cm, PAGE_HEIGHT - 9.8 * cm,
-                PAGE_WIDTH - 14 * cm, PAGE_HEIGHT - 9.8 * cm)
-    draw_para(canvas, payload['id_issue_date'],
-              3 * cm, PAGE_HEIGHT - 9.8 * cm,
-              2.5 * cm, 1 * cm)
-    draw_para(canvas, 'από το',
-              7 * cm, PAGE_HEIGHT - 9.8 * cm,
-              3 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-    # place of issuance line
-    canvas.line(8 * cm, PAGE_HEIGHT - 9.8 * cm,
-                PAGE_WIDTH - 2 * cm, PAGE_HEIGHT - 9.8 * cm)
-    draw_para(canvas, payload['place_of_issuance'],
-              10.7 * cm, PAGE_HEIGHT - 9.8 * cm,
-              5 * cm, 1 * cm)
-
-# AUTHORIZED
-
-    draw_para(canvas, 'Τον/Την',
-              2.1 * cm, PAGE_HEIGHT - 13 * cm,
-              5 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
+def make_first_page(canvas, doc, qr, payload):
 
-    # undersigned line
-    canvas.line(3.2 * cm, PAGE_HEIGHT - 13 * cm,
-                PAGE_WIDTH - 2 * cm, PAGE_HEIGHT - 13 * cm)
-    draw_para(canvas, payload['authorized'],
-              5 * cm, PAGE_HEIGHT - 13 * cm,
-              13 * cm, 1 * cm)
+    canvas.saveState()
 
-    draw_para(canvas, 'του',
-              2.1 * cm, PAGE_HEIGHT - 14.05 * cm,
-              5 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
+    plan = load_plan(LAYOUT_FILE)
+    plan.static_layer.stamp(canvas)
 
-    # father_name line
-    canvas.line(2.6 * cm, PAGE_HEIGHT - 14.05 * cm,
-                PAGE_WIDTH - 11 * cm, PAGE_HEIGHT - 14.05 * cm)
-    draw_para(canvas, payload['authorized_father_name'],
-              4.5 * cm, PAGE_HEIGHT - 14.05 * cm,
-              5 * cm, 1 * cm)
+    if qr:
+        draw_reference(canvas, payload['digest'])
 
-    draw_para(canvas, 'και της',
-              10 * cm, PAGE_HEIGHT - 14.05 * cm,
-              5 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
+    plan.draw_fields(canvas, payload)
 
-    # mother_name line
-    canvas.line(11 * cm, PAGE_HEIGHT - 14.05 * cm,
-                PAGE_WIDTH - 2 * cm, PAGE_HEIGHT - 14.05 * cm)
-    draw_para(canvas, payload['authorized_mother_name'],
-              13 * cm, PAGE_HEIGHT - 14.05 * cm,
-              5 * cm, 1 * cm)
+    canvas.restoreState()
 
-    draw_para(canvas, 'γεννηθείς την',
-              2.1 * cm, PAGE_HEIGHT - 15 * cm,
-              5 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-    # date of birth line
-    canvas.line(4 * cm, PAGE_HEIGHT - 15 * cm,
-                PAGE_WIDTH - 12 * cm, PAGE_HEIGHT - 15 * cm)
-    draw_para(canvas, payload['authorized_date_of_birth'],
-              5 * cm, PAGE_HEIGHT - 15 * cm,
-              11 * cm, 1 * cm)
-
-    draw_para(canvas, ', στην',
-              9 * cm, PAGE_HEIGHT - 15 * cm,
-              5 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-    # birth place line
-    canvas.line(10 * cm, PAGE_HEIGHT - 15 * cm,
-                PAGE_WIDTH - 2 * cm, PAGE_HEIGHT - 15 * cm)
-    draw_para(canvas, payload['authorized_birth_place'],
-              12 * cm, PAGE_HEIGHT - 15 * cm,
-              11 * cm, 1 * cm)
-
-    draw_para(canvas, 'κάτοικος',
-              2.1 * cm, PAGE_HEIGHT - 16 * cm,
-              5 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-    # place of residence line
-    canvas.line(3.3 * cm, PAGE_HEIGHT - 16 * cm,
-                PAGE_WIDTH - 12 * cm, PAGE_HEIGHT - 16 * cm)
-    draw_para(canvas, payload['authorized_place_of_residence'],
-              5 * cm, PAGE_HEIGHT - 16 * cm,
-              11 * cm, 1 * cm)
-
-    draw_para(canvas, ', οδός',
-              9 * cm, PAGE_HEIGHT - 16 * cm,
-              11 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-    # street line
-    canvas.line(10 * cm, PAGE_HEIGHT - 16 * cm,
-                PAGE_WIDTH - 2 * cm, PAGE_HEIGHT - 16 * cm)
-    draw_para(canvas, payload['authorized_street'],
-              12 * cm, PAGE_HEIGHT - 16 * cm,
-              11 * cm, 1 * cm)
-
-    draw_para(canvas, 'αρ',
-              2.1 * cm, PAGE_HEIGHT - 17 * cm,
-              11 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-    # street number line
-    canvas.line(2.5 * cm, PAGE_HEIGHT - 17 * cm,
-                PAGE_WIDTH - 15 * cm, PAGE_HEIGHT - 17 * cm)
-    draw_para(canvas, payload['authorized_street_number'],
-              3 * cm, PAGE_HEIGHT - 17 * cm,
-              3.5 * cm, 1 * cm)
-
-    draw_para(canvas, ', με ΑΔΤ/Διαβατηρίου',
-              6 * cm, PAGE_HEIGHT - 17 * cm,
-              5 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-    # id number line
-    canvas.line(9 * cm, PAGE_HEIGHT - 17 * cm,
-                PAGE_WIDTH - 4.5 * cm, PAGE_HEIGHT - 17 * cm)
-    draw_para(canvas, payload['authorized_id_number'],
-              10 * cm, PAGE_HEIGHT - 17 * cm,
-              5.5 * cm, 1 * cm)
-
-    draw_para(canvas, 'που εκδόθηκε την',
-              16.5 * cm, PAGE_HEIGHT - 17 * cm,
-              4 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-    # issue date line
-    canvas.line(2.1 * cm, PAGE_HEIGHT - 18 * cm,
-                PAGE_WIDTH - 14 * cm, PAGE_HEIGHT - 18 * cm)
-    draw_para(canvas, payload['authorized_id_issue_date'],
-              3 * cm, PAGE_HEIGHT - 18 * cm,
-              2.5 * cm, 1 * cm)
-    draw_para(canvas, 'από το',
-              7 * cm, PAGE_HEIGHT - 18 * cm,
-              3 * cm, 1 * cm,
-              font_name='Font-Regular',
-              font_size=9)
-    # place of issuance line
-    canvas.line(8 * cm, PAGE_HEIGHT - 18 * cm,
-                PAGE_WIDTH - 2 * cm, PAGE_HEIGHT - 18 * cm)
-    draw_para(canvas, payload['authorized_place_of_issuance'],
-              10.7 * cm, PAGE_HEIGHT - 18 * cm,
-              5 * cm, 1 * cm)
-
-    # Declaration text
-    draw_para(canvas, payload['authorization_text'],
-              2.2 * cm, PAGE_HEIGHT - 22 * cm,
-              16 * cm, 10 * cm)
 
+def make_template_page(canvas, doc):
+    canvas.saveState()
+    load_plan(LAYOUT_FILE).static_layer.stamp(canvas)
     canvas.restoreState()
 
 
@@ -441,26 +156,32 @@ def make_later_pages(canvas, doc):
     canvas.restoreState()
 
 
-def make_heading(element, contents):
+def make_heading(elements, contents):
     for pcontent in contents:
-        elements.append(Paragraph(pcontent, STYLES["DeclHeading"]))
+        elements.append(shared_para(pcontent, STYLES["DeclHeading"]))
+
+
+def signature_lines(payload):
+    return [
+        payload['date'],
+        GENDER_BYLINE[payload['gender']],
+        f'{payload["undersigned"]}'
+    ]
 
 
-def make_human_signature(elements, payload):
+def make_human_signature(elements, lines, cell=Paragraph):
     signature = [
         [
             Spacer(0 * cm, 12 * cm),
-            Paragraph(payload['date'], STYLES['NameSignature'])
+            cell(lines[0], STYLES['NameSignature'])
         ],
         [
             Spacer(0 * cm, 0 * cm),
-            Paragraph(GENDER_BYLINE[payload['gender']],
-                      STYLES['NameSignature'])
+            cell(lines[1], STYLES['NameSignature'])
         ],
         [
             Spacer(0 * cm, 1 * cm),
-            Paragraph(f'{payload["undersigned"]}',
-                      STYLES['NameSignature'])
+            cell(lines[2], STYLES['NameSignature'])
         ]
     ]
 
@@ -469,45 +190,79 @@ def make_human_signature(elements, payload):
     elements.append(signature)
 
 
-def crypto_sign(certificate_filename, password, pdf_filename):
+def make_story(lines, cell=Paragraph):
+    elements = []
+    make_heading(elements, [TITLE])
+    elements.append(Spacer(0 * cm, 8 * cm))
+    make_heading(elements, [IAUTHORIZE])
+    make_human_signature(elements, lines, cell)
+    return elements
+
+
+def make_template():
+    """Return the template of the first page, for the template backend."""
+    return FormTemplate(make_template_page,
+                        make_story([None] * 3, cell=Slot),
+                        FONTS,
+                        pagesize=A4)
+
+
+def render_platypus(output, payload, qr=False):
+    doc = SimpleDocTemplate(output, pagesize=A4)
+
+    elements = make_story(signature_lines(payload))
+
+    def make_first_page_ld(canvas, doc): return make_first_page(canvas, doc,
+                                                                qr,
+                                                                payload)
+
+    doc.build(elements,
+              onFirstPage=make_first_page_ld,
+              onLaterPages=make_later_pages)
+
 
-    backend = default_backend()
+def render_template(template, payload, qr=False):
+    """Return the PDF of the authorization, or raise TemplateMiss."""
 
-    with open(certificate_filename, 'rb') as cert_in:
-        cert_data = cert_in.read()
-    cert = load_key_and_certificates(cert_data, password.encode('utf-8'),
-                                     backend)
+    def draw(canvas):
+        if qr:
+            draw_reference(canvas, payload['digest'])
+        load_plan(LAYOUT_FILE).draw_fields(canvas, payload)
 
-    with open(pdf_filename, 'rb') as decl_file:
-        decl_pdf = decl_file.read()
+    return template.render(draw, signature_lines(payload))
 
-    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S+02'00'")
 
-    dct = {
-        b'sigflags': 3,
-        b'sigpage': 0,
-        b'sigbutton': True,
-        b'contact': b'support@grnet.gr',
-        b'location': b'Athens',
-        b'signingdate': timestamp.encode('utf-8'),
-        b'reason': b'GRNET Signing Service',
-        b'signature': f'Verified by GRNET S.A. {timestamp}'.encode('utf-8'),
-        b'signaturebox': (450, 0, 600, 100),
-    }
+def render(payload, qr=False, template=None):
+    """Return the PDF of a payload whose reference is set.
 
-    decl_signed = endesivepdf.cms.sign(decl_pdf,
-                                       dct,
-                                       cert[0],
-                                       cert[1],
-                                       cert[2],
-                                       'sha256'
-                                       )
+    With a template from make_template() the page is drawn on a copy of
+    it, unless the document cannot be rendered that way.
+    """
+    if template is not None:
+        try:
+            return render_template(template, payload, qr)
+        except TemplateMiss:
+            pass
+    output = io.BytesIO()
+    render_platypus(output, payload, qr)
+    return output.getvalue()
 
-    filename, file_extension = os.path.splitext(pdf_filename)
-    signed_pdf_filename = f'{filename}-signed{file_extension}'
-    with open(signed_pdf_filename, 'wb') as decl_signed_file:
-        decl_signed_file.write(decl_pdf)
-        decl_signed_file.write(decl_signed)
+
+def render_batch(payloads, backend='platypus', qr=False):
+    """Set the reference of each payload and yield its PDF.
+
+    The references of the whole batch are made first, and with qr their
+    codes are encoded ahead, in parallel. With the template backend the
+    page is laid out once for the whole batch.
+    """
+    template = make_template() if backend == 'template' else None
+    for payload in payloads:
+        make_reference(payload)
+    if qr:
+        prefetch_qr([encoded_reference(payload['digest'])
+                     for payload in payloads])
+    for payload in payloads:
+        yield render(payload, qr, template)
 
 
 if __name__ == "__main__":
@@ -520,37 +275,101 @@ if __name__ == "__main__":
     parser.add_argument('-c', '--certificate', help='certificate file')
     parser.add_argument('-p', '--password', help='certificate password',
                         default=None)
+    parser.add_argument('--signer', metavar='SOCKET',
+                        help='sign with the signing daemon listening on '
+                        'SOCKET instead of a certificate file')
+    parser.add_argument('--keep-unsigned', action='store_true',
+                        help='when signing, also write the unsigned '
+                        'document')
     parser.add_argument('-q', '--qr_code',
                         action='store_true',
                         help='embed reference and QR code')
     parser.add_argument('-s', '--setup',
                         default='setup.json',
                         help='setup configuration file')
+    parser.add_argument('--preflight', nargs='*', metavar='PAYLOAD',
+                        help='only check that the fields of the payload files '
+                        f'(default: {PAYLOAD_FILE}) fit their boxes and '
+                        'print a JSON report line for each')
+    parser.add_argument('-b', '--backend',
+                        choices=['platypus', 'template'],
+                        default='platypus',
+                        help='renderer; the template backend falls back to '
+                        'platypus for documents it cannot render')
+    parser.add_argument('--compare', action='store_true',
+                        help='only render the payload with both backends and '
+                        'print the differing pixels of each page '
+                        '(needs PyMuPDF)')
+    parser.add_argument('--batch', nargs='+', metavar='PAYLOAD',
+                        help='render each payload file into a PDF file of '
+                        'the same name instead, in one process')
     args = parser.parse_args()
 
-    setup(args.setup, STYLES)
-
-    doc = SimpleDocTemplate(args.output, pagesize=A4)
-
-    elements = []
-
-    payload = load_payload('auth_data.json')
-    if 'gender' not in payload:
-        payload['gender'] = 'mf'
-
-    make_heading(elements, [TITLE])
-    elements.append(Spacer(0 * cm, 8 * cm))
-    make_heading(elements, [IAUTHORIZE])
-
-    def make_first_page_ld(canvas, doc): return make_first_page(canvas, doc,
-                                                                args.qr_code,
-                                                                payload)
-    make_human_signature(elements, payload)
-
-    decl = doc.build(elements,
-                     onFirstPage=make_first_page_ld,
-                     onLaterPages=make_later_pages)
-
-    if args.certificate and args.password:
-        crypto_sign(args.certificate, args.password, args.output)
-    print(payload['digest'])
+    setup(args.setup)
+
+    if args.preflight is not None:
+        ok = run_preflight(LAYOUT_FILE, args.preflight or [PAYLOAD_FILE],
+                           load_payload, None)
+        sys.exit(0 if ok else 1)
+
+    signer = None
+    if args.signer:
+        signer = SignerClient(args.signer)
+    elif args.certificate and args.password and not args.batch:
+        signer = load_signer(args.certificate, args.password)
+
+    if args.batch:
+        payloads = [load_payload(payload_filename)
+                    for payload_filename in args.batch]
+        # A batch signed with a certificate file is signed on every core.
+        pool = None
+        if signer is None and args.certificate and args.password:
+            pool = SigningPool(args.certificate, args.password)
+        pdfs = render_batch(payloads, args.backend, args.qr_code)
+        render_seconds = 0.0
+        try:
+            with BatchWriter(pool, signer, args.keep_unsigned) as writer:
+                for payload_filename, payload in zip(args.batch, payloads):
+                    start = time.perf_counter()
+                    try:
+                        pdf = next(pdfs)
+                    except FitError as e:
+                        sys.exit(f'{payload_filename}: '
+                                 f'{original_fit_error(e)}')
+                    render_seconds += time.perf_counter() - start
+                    writer.write(
+                        os.path.splitext(payload_filename)[0] + '.pdf', pdf)
+                    print_reference(payload['digest'])
+        finally:
+            if pool is not None:
+                pool.close()
+        sys.stderr.write(f'{len(payloads)} documents rendered in '
+                         f'{render_seconds:.2f} s\n')
+        if args.qr_code:
+            sys.stderr.write(format_qr_stats(QR_CACHE.stats()) + '\n')
+        sys.exit(0)
+
+    payload = load_payload(PAYLOAD_FILE)
+    make_reference(payload)
+
+    if args.compare:
+        platypus_pdf = io.BytesIO()
+        render_platypus(platypus_pdf, payload, args.qr_code)
+        try:
+            template_pdf = render_template(make_template(), payload,
+                                           args.qr_code)
+        except TemplateMiss as e:
+            print(f'not rendered from the template: {e}')
+            sys.exit(0)
+        differences = compare_pdfs(platypus_pdf.getvalue(), template_pdf)
+        for page, count in enumerate(differences, 1):
+            print(f'page {page}: {count} differing pixels')
+        sys.exit(1 if any(differences) else 0)
+
+    template = make_template() if args.backend == 'template' else None
+    try:
+        pdf = render(payload, args.qr_code, template)
+    except FitError as e:
+        sys.exit(f'{PAYLOAD_FILE}: {original_fit_error(e)}')
+    write_document(args.output, pdf, signer, args.keep_unsigned)
+    print_reference(payload['digest'])
@@ -0,0 +1,76 @@
+"""Images drawn on every document, decoded once per process.
+
+canvas.drawImage() with a file name opens, decodes and compresses the
+image again for every document, and resolves the name against the
+working directory. An ImageAsset resolves its file next to the
+generators, builds the compressed image XObject on first use and adds a
+copy of it, sharing the encoded stream, to each document it is drawn
+in; drawing it again in the same document refers to the same object.
+
+The XObject is named as drawImage would name it for the bare file name,
+so documents are the same as when the image was drawn with drawImage
+from the repository directory.
+"""
+
+import copy
+import os
+import threading
+
+from reportlab.lib.utils import _digester
+from reportlab.pdfbase import pdfdoc
+
+ASSET_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+_ASSETS = {}
+_ASSETS_LOCK = threading.Lock()
+
+
+def asset_path(filename):
+    """Return the path of an asset file shipped with the generators."""
+    return os.path.join(ASSET_DIRECTORY, filename)
+
+
+class ImageAsset:
+    """An image file, drawn as a shared, ready-encoded image XObject."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.path = asset_path(filename)
+        self.name = _digester(f'{filename}None'.encode('utf-8'))
+        self._xobject = None
+        self._lock = threading.Lock()
+
+    def xobject(self):
+        with self._lock:
+            if self._xobject is None:
+                self._xobject = pdfdoc.PDFImageXObject(self.name, self.path)
+            return self._xobject
+
+    def draw(self, canvas, x, y, width, height):
+        """Draw the image as canvas.drawImage would."""
+        prototype = self.xobject()
+        doc = canvas._doc
+        reg_name = doc.getXObjectName(self.name)
+        if reg_name not in doc.idToObject:
+            # The document names the object it references, so it gets a
+            # copy; the encoded stream is shared.
+            image = copy.copy(prototype)
+            canvas._setXObjects(image)
+            doc.Reference(image, reg_name)
+            doc.addForm(self.name, image)
+        canvas._currentPageHasImages = 1
+        canvas.saveState()
+        canvas.translate(x, y)
+        canvas.scale(width, height)
+        canvas._code.append(f'/{reg_name} Do')
+        canvas.restoreState()
+        canvas._formsinuse.append(self.name)
+
+
+def image_asset(filename):
+    """Return the process-wide ImageAsset of an asset file."""
+    with _ASSETS_LOCK:
+        asset = _ASSETS.get(filename)
+        if asset is None:
+            asset = _ASSETS[filename] = ImageAsset(filename)
+        return asset
@@ -0,0 +1,409 @@
+"""Declarative first-page layouts.
+
+A layout file is a JSON object with a "name", a "unit" ("cm", "mm",
+"inch" or "pt"), an optional "pagesize" (default "A4") and a list of
+"items", drawn in order. Coordinates are given in the unit, with y
+measured down from the top edge of the page to the point ReportLab
+draws from: the bottom edge of boxes and the origin of paragraphs.
+Line widths and corner radii are always in points. Item types:
+
+    line_width  {"width"}
+    box         {"x", "y", "width", "height", "radius"}
+    line        {"x1", "y1", "x2", "y2"}
+    label       {"text", "x", "y", "width", "height", "font", "size"}
+    field       {"field", "x", "y", "width", "height", "font", "size",
+                 "flow"}
+    frame       {"x", "y", "width", "height", "items"}
+
+"font" and "size" are optional and default to Font-Regular at 10pt.
+A field names a key of the fields dict passed to draw_fields; dotted
+names ("father_insurance.1") look into nested dicts, and a field is
+skipped if its value is None or a nested key is missing. A field with
+"flow": true is not shrunk below the legible size; see DrawPlan.flow.
+A frame lays out its items (each {"text", "width", "height", "font",
+"size"}) top down, like the footnotes of the declaration.
+
+compile_layout() resolves every coordinate to points and fits the
+labels once, so rendering a document only walks two lists.
+"""
+
+import hashlib
+import json
+import sys
+import threading
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm, mm, inch
+from reportlab.platypus import Flowable, Frame
+
+from image_assets import asset_path
+from text_fit import (FitError, create_para, measure_fit, split_para,
+                      get_style)
+from text_measure import single_line_fits, draw_line
+from static_layer import StaticLayer
+from segment_cache import SegmentCache
+
+UNITS = {
+    'cm': cm,
+    'mm': mm,
+    'inch': inch,
+    'pt': 1,
+}
+
+PAGE_SIZES = {
+    'A4': A4,
+}
+
+DEFAULT_FONT_NAME = 'Font-Regular'
+DEFAULT_FONT_SIZE = 10
+
+# Fields drawn smaller than this fail the preflight check.
+MIN_LEGIBLE_SIZE = 6
+
+# Payloads measured together by run_preflight.
+PREFLIGHT_BATCH = 256
+
+_PLANS = {}
+_PLANS_LOCK = threading.Lock()
+
+
+class LayoutError(ValueError):
+    """Raised for a layout file that cannot be compiled."""
+
+
+def _set_line_width(canvas, width):
+    canvas.setLineWidth(width)
+
+
+def _draw_box(canvas, x, y, width, height, radius):
+    canvas.roundRect(x, y, width, height, radius, stroke=1, fill=0)
+
+
+def _draw_line(canvas, x1, y1, x2, y2):
+    canvas.line(x1, y1, x2, y2)
+
+
+def _draw_paragraph(canvas, paragraph, x, y):
+    paragraph.drawOn(canvas, x, y)
+
+
+def _draw_frame(canvas, x, y, width, height, paragraphs):
+    # addFromList consumes its list and a Frame keeps its cursor, so
+    # both are made afresh for every drawing.
+    Frame(x, y, width, height).addFromList(list(paragraphs), canvas)
+
+
+def _paragraph_runs(paragraph):
+    """Return the (font name, text) runs a wrapped paragraph shows.
+
+    Returns None if a fragment of its lines has no font, e.g. an image.
+    """
+    lines = paragraph.blPara
+    if lines.kind == 0:
+        return [(lines.fontName, ' '.join(words))
+                for _, words in lines.lines]
+    runs = []
+    for line in lines.lines:
+        for word in line.words:
+            font_name = getattr(word, 'fontName', None)
+            if font_name is None:
+                return None
+            runs.append((font_name, getattr(word, 'text', '')))
+    return runs
+
+
+class DrawPlan:
+    """A compiled layout: static operations and field bindings."""
+
+    def __init__(self, name, pagesize, static_ops, field_ops):
+        self.name = name
+        self.pagesize = pagesize
+        # (function, args) pairs, called with the canvas first.
+        self.static_ops = static_ops
+        # (field, x, y, width, height, font name, font size, flow) tuples.
+        self.field_ops = field_ops
+        self.static_layer = StaticLayer(f'{name}Static', self.draw_static,
+                                        pagesize)
+        self.segments = SegmentCache()
+
+    def draw_static(self, canvas):
+        for function, args in self.static_ops:
+            function(canvas, *args)
+
+    def _values(self, fields):
+        return [lookup_field(fields, op[0]) for op in self.field_ops]
+
+    def _single_line(self, values_list):
+        items = []
+        for values in values_list:
+            for (_, _, _, width, height, font_name, font_size, _), value \
+                    in zip(self.field_ops, values):
+                items.append((value, font_name, font_size, width, height))
+        fits = single_line_fits(items)
+        count = len(self.field_ops)
+        return [fits[i:i + count] for i in range(0, len(fits), count)]
+
+    def measure_batch(self, fields_list):
+        """Find the fields of a batch of payloads that fit on one line.
+
+        Returns a list per payload with a boolean per field binding, for
+        draw_fields or preflight. The values of the whole batch are
+        measured together.
+        """
+        return self._single_line([self._values(fields)
+                                  for fields in fields_list])
+
+    def draw_fields(self, canvas, fields, single_line=None):
+        """Draw the bound fields of fields on canvas.
+
+        A field drawn with the same value before, in any document of
+        the process, is replayed from self.segments.
+        """
+        values = self._values(fields)
+        if single_line is None:
+            single_line, = self._single_line([values])
+        for index, ((field, x, y, width, height, font_name, font_size, _),
+                    value, one_line) in enumerate(zip(self.field_ops, values,
+                                                      single_line)):
+            if value is None:
+                continue
+            if isinstance(value, Flowable):
+                # Already fitted, e.g. the first part of a flowing field.
+                value.wrap(width, height)
+                value.drawOn(canvas, x, y)
+                continue
+            key = (index, value)
+            if self.segments.replay(canvas, key):
+                continue
+            start = len(canvas._code)
+            if one_line:
+                # Fits as it is; no need to parse, wrap or shrink it.
+                draw_line(canvas, value, x, y, font_name, font_size)
+                runs = [(font_name, value)]
+            else:
+                try:
+                    paragraph = create_para(value, width, height,
+                                            font_name=font_name,
+                                            font_size=font_size)
+                except FitError as e:
+                    raise FitError(e.text, e.width, e.height, e.min_size,
+                                   field) from None
+                paragraph.drawOn(canvas, x, y)
+                runs = _paragraph_runs(paragraph)
+                if runs is None:
+                    continue
+            self.segments.record(canvas, key, start, runs)
+
+    def preflight(self, fields, min_size=MIN_LEGIBLE_SIZE, single_line=None):
+        """Fit every bound field without drawing and report the result.
+
+        Each entry gives the field, its size in the layout, the size it
+        would be drawn at (None if it does not fit at all) and the ratio
+        of the height the text needs at the layout size to the box
+        height. Fields drawn below min_size are listed as illegible.
+        """
+        values = self._values(fields)
+        if single_line is None:
+            single_line, = self._single_line([values])
+        report = []
+        illegible = []
+        for (field, _, _, width, height, font_name, font_size, flow), \
+                value, one_line in zip(self.field_ops, values, single_line):
+            if value is None:
+                continue
+            if one_line:
+                fitted_size = font_size
+                overflow = get_style(font_name, font_size).leading / height
+            else:
+                fitted_size, overflow = measure_fit(value, width, height,
+                                                    font_name=font_name,
+                                                    font_size=font_size)
+            legible = fitted_size is not None and fitted_size >= min_size
+            continued = flow and not legible
+            if continued:
+                fitted_size = min_size
+                legible = True
+            report.append({
+                'field': field,
+                'font_size': font_size,
+                'fitted_size': fitted_size,
+                'overflow': round(overflow, 3),
+                'legible': legible,
+                'continued': continued,
+            })
+            if not legible:
+                illegible.append(field)
+        return {
+            'form': self.name,
+            'ok': not illegible,
+            'fields': report,
+            'illegible': illegible,
+        }
+
+    def flow(self, fields, min_size=MIN_LEGIBLE_SIZE):
+        """Split the flowing fields that would be drawn below min_size.
+
+        Such a field is set at min_size and wrapped once; the lines that
+        fit its box replace its value in the returned copy of fields, as
+        a Paragraph, and the rest are returned as a list of paragraphs
+        to be added to the story, so that they continue on later pages.
+        """
+        fields = dict(fields)
+        continuation = []
+        for field, _, _, width, height, font_name, _, flow \
+                in self.field_ops:
+            if not flow:
+                continue
+            value = fields[field]
+            if value is None:
+                continue
+            first, rest = split_para(value, width, height,
+                                     font_name=font_name,
+                                     font_size=min_size)
+            if not rest:
+                # Fits at min_size; draw_fields shrinks it as usual.
+                continue
+            fields[field] = first
+            continuation.extend(rest)
+        return fields, continuation
+
+
+def lookup_field(fields, field):
+    """Return the value of a (possibly dotted) field name, or None."""
+    first, *rest = field.split('.')
+    value = fields[first]
+    for key in rest:
+        if value is None or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compile_layout(spec):
+    name = spec.get('name')
+    if not name:
+        raise LayoutError('layout has no name')
+    try:
+        unit = UNITS[spec.get('unit', 'cm')]
+        pagesize = PAGE_SIZES[spec.get('pagesize', 'A4')]
+    except KeyError as e:
+        raise LayoutError(f'{name}: unknown unit or page size {e}') from None
+    page_height = pagesize[1]
+
+    def length(value):
+        return value * unit
+
+    def top(value):
+        return page_height - value * unit
+
+    static_ops = []
+    field_ops = []
+    for index, item in enumerate(spec.get('items', [])):
+        kind = item.get('type')
+        try:
+            if kind == 'line_width':
+                static_ops.append((_set_line_width, (item['width'],)))
+            elif kind == 'box':
+                static_ops.append((_draw_box, (
+                    length(item['x']), top(item['y']),
+                    length(item['width']), length(item['height']),
+                    item['radius'])))
+            elif kind == 'line':
+                static_ops.append((_draw_line, (
+                    length(item['x1']), top(item['y1']),
+                    length(item['x2']), top(item['y2']))))
+            elif kind == 'label':
+                paragraph = create_para(
+                    item['text'],
+                    length(item['width']), length(item['height']),
+                    font_name=item.get('font', DEFAULT_FONT_NAME),
+                    font_size=item.get('size', DEFAULT_FONT_SIZE))
+                static_ops.append((_draw_paragraph, (
+                    paragraph, length(item['x']), top(item['y']))))
+            elif kind == 'field':
+                flow = item.get('flow', False)
+                if flow and '.' in item['field']:
+                    raise LayoutError(f'{name}: item {index} flows a nested '
+                                      f'field')
+                field_ops.append((
+                    item['field'],
+                    length(item['x']), top(item['y']),
+                    length(item['width']), length(item['height']),
+                    item.get('font', DEFAULT_FONT_NAME),
+                    item.get('size', DEFAULT_FONT_SIZE),
+                    flow))
+            elif kind == 'frame':
+                paragraphs = tuple(
+                    create_para(
+                        entry['text'],
+                        length(entry['width']), length(entry['height']),
+                        font_name=entry.get('font', DEFAULT_FONT_NAME),
+                        font_size=entry.get('size', DEFAULT_FONT_SIZE))
+                    for entry in item['items'])
+                static_ops.append((_draw_frame, (
+                    length(item['x']), top(item['y']),
+                    length(item['width']), length(item['height']),
+                    paragraphs)))
+            else:
+                raise LayoutError(f'{name}: item {index} has unknown type '
+                                  f'{kind!r}')
+        except KeyError as e:
+            raise LayoutError(f'{name}: item {index} ({kind}) has no '
+                              f'{e}') from None
+    return DrawPlan(name, pagesize, static_ops, field_ops)
+
+
+def load_plan(filename):
+    """Compile a layout file, reusing the plan of an identical file.
+
+    Plans are cached by the hash of the file contents, so a changed file
+    is picked up while an unchanged one is compiled once per process.
+    Labels are fitted with the fonts registered at the time of the first
+    call, so setup() must have run. A relative filename names a layout
+    shipped next to the generators, whatever the working directory.
+    """
+    with open(asset_path(filename), 'rb') as layout_file:
+        data = layout_file.read()
+    key = hashlib.sha256(data).hexdigest()
+    with _PLANS_LOCK:
+        plan = _PLANS.get(key)
+        if plan is None:
+            plan = compile_layout(json.loads(data))
+            _PLANS[key] = plan
+        return plan
+
+
+def run_preflight(layout_filename, payload_filenames, load_payload,
+                  make_fields=None, min_size=MIN_LEGIBLE_SIZE,
+                  out=sys.stdout):
+    """Write a JSON line with the preflight report of each payload file.
+
+    Returns True if every payload fits legibly. A payload that cannot be
+    read or lacks a bound field is reported with an error instead.
+    """
+    plan = load_plan(layout_filename)
+    all_ok = True
+    for start in range(0, len(payload_filenames), PREFLIGHT_BATCH):
+        batch = []
+        for payload_filename in payload_filenames[start:start +
+                                                  PREFLIGHT_BATCH]:
+            try:
+                payload = load_payload(payload_filename)
+                fields = (payload if make_fields is None
+                          else make_fields(payload))
+                plan._values(fields)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                fields = f'{type(e).__name__}: {e}'
+            batch.append((payload_filename, fields))
+        single_line = iter(plan.measure_batch(
+            [fields for _, fields in batch if isinstance(fields, dict)]))
+        for payload_filename, fields in batch:
+            if isinstance(fields, dict):
+                report = plan.preflight(fields, min_size, next(single_line))
+            else:
+                report = {'form': plan.name, 'ok': False, 'error': fields}
+            all_ok = all_ok and report['ok']
+            out.write(json.dumps(dict(payload=payload_filename, **report),
+                                 ensure_ascii=False))
+            out.write('\n')
+    return all_ok
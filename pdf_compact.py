@@ -0,0 +1,440 @@
+"""Size-optimized output of the generated documents.
+
+With "compact-output": true in the setup file the generators write each
+document through compact_pdf(), which rewrites the file ReportLab made
+and reports both sizes:
+
+* streams are stored in binary, without the ASCII85 encoding ReportLab
+  adds, and deflated at the highest level;
+* numbers in content streams are written with at most four decimals
+  (a ten-thousandth of a point) instead of seven significant digits;
+* the embedded TrueType subsets lose their hinting instructions and the
+  long license texts of their name tables; viewers scale the outlines
+  without them;
+* identical objects are stored once, and every object that is not a
+  stream goes into a compressed object stream, indexed by a
+  cross-reference stream (PDF 1.5).
+
+Streams that are the same in every document of a form (font programs,
+images, the static part of the page) are rewritten once per process.
+"""
+
+import collections
+import hashlib
+import re
+import struct
+import sys
+import threading
+import zlib
+
+from reportlab.lib.rl_accel import asciiBase85Decode
+
+DECIMALS = 4
+
+DEFAULT_STREAM_ENTRIES = 256
+
+# The name table records kept in font subsets: copyright, family,
+# style, unique name, full name, version and PostScript name.
+KEPT_NAMES = range(7)
+
+_ENABLED = False
+
+# A string, which is copied as it is, or a number with decimals.
+_TOKEN = re.compile(rb'(\((?:\\.|[^\\()])*\)|<[0-9A-Fa-f\s]*>)'
+                    rb'|(?<![\w./#+-])(-?\d*\.\d+)(?![\w.])', re.S)
+_REFERENCE = re.compile(rb'(?<![\w.])(\d+) 0 R(?!\w)')
+
+# How the byte range of a reserved signature starts, with numbers of a
+# fixed width following.
+BYTE_RANGE = b'/ByteRange [ '
+
+# Composite glyph flags.
+_ARGS_ARE_WORDS = 0x0001
+_HAVE_SCALE = 0x0008
+_MORE_COMPONENTS = 0x0020
+_HAVE_XY_SCALE = 0x0040
+_HAVE_TWO_BY_TWO = 0x0080
+_HAVE_INSTRUCTIONS = 0x0100
+
+
+class CompactError(ValueError):
+    """Raised for a document compact_pdf cannot rewrite."""
+
+
+def configure_compact(enabled=False):
+    """Turn size-optimized output on or off for the process."""
+    global _ENABLED
+    _ENABLED = bool(enabled)
+
+
+def _number(match):
+    string, number = match.groups()
+    if string is not None:
+        return string
+    text = b'%.*f' % (DECIMALS, float(number))
+    text = text.rstrip(b'0').rstrip(b'.')
+    if text.startswith(b'-'):
+        sign, text = b'-', text[1:]
+    else:
+        sign = b''
+    if text.startswith(b'0.'):
+        text = text[1:]
+    if text in (b'', b'0'):
+        return b'0'
+    return sign + text
+
+
+def compact_numbers(code):
+    """Return PDF code with its numbers written with at most DECIMALS."""
+    return _TOKEN.sub(_number, code)
+
+
+def _checksum(data):
+    data += b'\0' * (-len(data) % 4)
+    return sum(struct.unpack(f'>{len(data) // 4}I', data)) & 0xFFFFFFFF
+
+
+def _glyph_without_instructions(glyph):
+    if not glyph:
+        return glyph
+    contours = struct.unpack('>h', glyph[:2])[0]
+    if contours >= 0:
+        start = 10 + 2 * contours
+        length = struct.unpack('>H', glyph[start:start + 2])[0]
+        glyph = glyph[:start] + b'\0\0' + glyph[start + 2 + length:]
+    else:
+        glyph = bytearray(glyph)
+        offset = 10
+        while True:
+            flags = struct.unpack('>H', glyph[offset:offset + 2])[0]
+            if flags & _HAVE_INSTRUCTIONS:
+                struct.pack_into('>H', glyph, offset,
+                                 flags & ~_HAVE_INSTRUCTIONS)
+            offset += 4 + (4 if flags & _ARGS_ARE_WORDS else 2)
+            if flags & _HAVE_SCALE:
+                offset += 2
+            elif flags & _HAVE_XY_SCALE:
+                offset += 4
+            elif flags & _HAVE_TWO_BY_TWO:
+                offset += 8
+            if not flags & _MORE_COMPONENTS:
+                break
+        glyph = bytes(glyph[:offset])
+    return glyph + b'\0' * (-len(glyph) % 4)
+
+
+def _short_name_table(table):
+    count, storage = struct.unpack('>2xHH', table[:6])
+    records = []
+    strings = []
+    offset = 0
+    for i in range(count):
+        (platform, encoding, language, name_id, length,
+         start) = struct.unpack('>6H', table[6 + 12 * i:18 + 12 * i])
+        if name_id in KEPT_NAMES:
+            records.append(struct.pack('>6H', platform, encoding, language,
+                                       name_id, length, offset))
+            strings.append(table[storage + start:storage + start + length])
+            offset += length
+    return (struct.pack('>3H', 0, len(records), 6 + 12 * len(records))
+            + b''.join(records) + b''.join(strings))
+
+
+def strip_font_program(font):
+    """Return a TrueType font program without hinting or license texts."""
+    count = struct.unpack('>H', font[4:6])[0]
+    tables = {}
+    for i in range(count):
+        tag, _, offset, length = struct.unpack(
+            '>4sIII', font[12 + 16 * i:28 + 16 * i])
+        tables[tag] = font[offset:offset + length]
+    for tag in (b'cvt ', b'fpgm', b'prep'):
+        tables.pop(tag, None)
+    if b'name' in tables:
+        tables[b'name'] = _short_name_table(tables[b'name'])
+    head = bytearray(tables[b'head'])
+    long_offsets = struct.unpack('>h', head[50:52])[0]
+    loca, glyf = tables[b'loca'], tables[b'glyf']
+    if long_offsets:
+        offsets = struct.unpack(f'>{len(loca) // 4}I', loca)
+    else:
+        offsets = [2 * offset for offset in
+                   struct.unpack(f'>{len(loca) // 2}H', loca)]
+    glyphs = [_glyph_without_instructions(glyf[start:end])
+              for start, end in zip(offsets, offsets[1:])]
+    offsets = [0]
+    for glyph in glyphs:
+        offsets.append(offsets[-1] + len(glyph))
+    tables[b'glyf'] = b''.join(glyphs)
+    if long_offsets:
+        tables[b'loca'] = struct.pack(f'>{len(offsets)}I', *offsets)
+    else:
+        tables[b'loca'] = struct.pack(f'>{len(offsets)}H',
+                                      *(offset // 2 for offset in offsets))
+    struct.pack_into('>I', head, 8, 0)
+    tables[b'head'] = bytes(head)
+
+    tags = sorted(tables)
+    entry_selector = len(tags).bit_length() - 1
+    search_range = 16 << entry_selector
+    directory = [font[:4], struct.pack('>4H', len(tags), search_range,
+                                       entry_selector,
+                                       16 * len(tags) - search_range)]
+    data = []
+    offset = 12 + 16 * len(tags)
+    for tag in tags:
+        table = tables[tag]
+        directory.append(struct.pack('>4sIII', tag, _checksum(table),
+                                     offset, len(table)))
+        table += b'\0' * (-len(table) % 4)
+        data.append(table)
+        offset += len(table)
+    font = bytearray(b''.join(directory + data))
+    head_offset = struct.unpack('>I', font[12 + 16 * tags.index(b'head')
+                                           + 8:][:4])[0]
+    struct.pack_into('>I', font, head_offset + 8,
+                     (0xB1B0AFBA - _checksum(bytes(font))) & 0xFFFFFFFF)
+    return bytes(font)
+
+
+def fill_byte_range(data):
+    """Return data with its signature byte range set to its layout.
+
+    The byte range of the signature dictionary, written as BYTE_RANGE
+    with placeholder numbers of the same width, is set to cover the
+    whole file except the hex string of the /Contents that follows it.
+    """
+    data = bytearray(data)
+    start = data.index(BYTE_RANGE)
+    end = data.index(b']', start) + 1
+    hole = data.index(b'/Contents <', end) + len(b'/Contents ')
+    hole_end = data.index(b'>', hole) + 1
+    byte_range = BYTE_RANGE + b'0 %010d %010d %010d ]' % (
+        hole, hole_end, len(data) - hole_end)
+    if len(byte_range) != end - start:
+        raise CompactError('signature byte range has the wrong width')
+    data[start:end] = byte_range
+    return bytes(data)
+
+
+def split_pdf(data):
+    """Return the header, objects and trailer of a ReportLab document.
+
+    objects maps each object number to its body, between "obj" and
+    "endobj".
+    """
+    xref = int(re.search(rb'startxref\s+(\d+)', data).group(1))
+    match = re.match(rb'xref\s+0 (\d+)\s', data[xref:])
+    if match is None:
+        raise CompactError('document has no cross-reference table')
+    count = int(match.group(1))
+    table = data[xref:].split(b'\n', 2)[2]
+    offsets = [int(table[20 * i:20 * i + 10]) for i in range(1, count)]
+    objects = {}
+    for number, (start, end) in enumerate(zip(offsets, offsets[1:] + [xref]),
+                                          1):
+        obj = data[start:end]
+        body = obj[obj.index(b'obj') + 3:obj.rindex(b'endobj')]
+        objects[number] = body.strip(b'\r\n')
+    trailer = data[data.index(b'trailer', xref):data.rindex(b'startxref')]
+    return data[:offsets[0]], objects, trailer
+
+
+def _stream_parts(body):
+    dictionary, rest = body.split(b'stream', 1)
+    length = int(re.search(rb'/Length (\d+)', dictionary).group(1))
+    stream = rest.lstrip(b'\r')[1:length + 1]
+    return dictionary.strip(), stream
+
+
+def _decode(dictionary, stream):
+    """Undo the ASCII85 and Flate filters; return the filters left."""
+    match = re.search(rb'/Filter \[([^\]]*)\]', dictionary)
+    filters = match.group(1).split() if match else []
+    while filters and filters[0] in (b'/ASCII85Decode', b'/FlateDecode'):
+        if filters.pop(0) == b'/ASCII85Decode':
+            stream = asciiBase85Decode(stream)
+        else:
+            stream = zlib.decompress(stream)
+    return filters, stream
+
+
+def _stream_object(dictionary, filters, stream, **lengths):
+    dictionary = re.sub(rb'\s*/Filter \[[^\]]*\]', b'', dictionary)
+    for key, value in dict(lengths, Length=len(stream)).items():
+        dictionary = re.sub(rb'/%s \d+' % key.encode(),
+                            b'/%s %d' % (key.encode(), value), dictionary)
+    if filters:
+        dictionary = dictionary[:-2].rstrip() + b' /Filter %s\n>>' % (
+            filters[0] if len(filters) == 1
+            else b'[ ' + b' '.join(filters) + b' ]')
+    return b'%s\nstream\n%s\nendstream' % (dictionary, stream)
+
+
+def _compact_stream(body, content):
+    dictionary, stream = _stream_parts(body)
+    if b'/Filter' not in dictionary:
+        # Left uncompressed to be patched in place, as the appearance of
+        # a reserved signature is.
+        return body
+    filters, stream = _decode(dictionary, stream)
+    if filters:
+        # Image data in its own encoding.
+        return _stream_object(dictionary, filters, stream)
+    lengths = {}
+    if b'/Length1' in dictionary:
+        stream = strip_font_program(stream)
+        lengths['Length1'] = len(stream)
+    elif content:
+        stream = compact_numbers(stream)
+    return _stream_object(dictionary, [b'/FlateDecode'],
+                          zlib.compress(stream, 9), **lengths)
+
+
+class StreamCache:
+    """Rewritten stream objects keyed by digest, for the process."""
+
+    def __init__(self, entries=DEFAULT_STREAM_ENTRIES):
+        self.entries = entries
+        self._streams = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, body, content):
+        key = (hashlib.sha256(body).digest(), content)
+        with self._lock:
+            compacted = self._streams.get(key)
+            if compacted is not None:
+                self._streams.move_to_end(key)
+                return compacted
+        compacted = _compact_stream(body, content)
+        with self._lock:
+            self._streams[key] = compacted
+            while len(self._streams) > self.entries:
+                self._streams.popitem(last=False)
+        return compacted
+
+    def clear(self):
+        with self._lock:
+            self._streams.clear()
+
+
+STREAM_CACHE = StreamCache()
+
+
+def _merge_duplicates(objects):
+    """Keep one of each set of identical objects, fixing the references."""
+    while True:
+        first = {}
+        duplicates = {}
+        for number, body in objects.items():
+            duplicates[number] = first.setdefault(body, number)
+        duplicates = {number: kept for number, kept in duplicates.items()
+                      if number != kept}
+        if not duplicates:
+            return objects
+
+        def reference(match):
+            number = int(match.group(1))
+            return b'%d 0 R' % duplicates.get(number, number)
+
+        merged = {}
+        for number, body in objects.items():
+            if number in duplicates:
+                continue
+            if b'stream' in body:
+                dictionary, rest = body.split(b'stream', 1)
+                body = (_REFERENCE.sub(reference, dictionary) + b'stream'
+                        + rest)
+            else:
+                body = _REFERENCE.sub(reference, body)
+            merged[number] = body
+        objects = merged
+
+
+def compact_pdf(data):
+    """Return a ReportLab document rewritten to take fewer bytes."""
+    header, objects, trailer = split_pdf(data)
+    size = max(objects) + 1
+    contents = {int(number) for number in
+                re.findall(rb'/Contents (\d+) 0 R', b''.join(objects.values()))}
+    for number, body in objects.items():
+        if b'stream' in body:
+            content = (number in contents
+                       or re.search(rb'/Subtype /Form\b', body) is not None)
+            objects[number] = STREAM_CACHE.get(body, content)
+        elif b'/ByteRange' not in body:
+            objects[number] = compact_numbers(body)
+    objects = _merge_duplicates(objects)
+
+    out = [header.replace(b'%PDF-1.4', b'%PDF-1.5', 1)]
+    offset = len(out[0])
+    # Object number -> (type, field 2, field 3) of its xref stream entry.
+    entries = {0: (0, 0, 65535)}
+    packed = []
+    for number, body in objects.items():
+        # A signature dictionary must stay outside the object stream,
+        # where its byte range can be signed.
+        if b'stream' in body or b'/ByteRange' in body:
+            entries[number] = (1, offset, 0)
+            obj = b'%d 0 obj\n%s\nendobj\n' % (number, body)
+            out.append(obj)
+            offset += len(obj)
+        else:
+            entries[number] = (2, size, len(packed))
+            packed.append((number, body))
+    index = []
+    bodies = []
+    position = 0
+    for number, body in packed:
+        index.append(b'%d %d' % (number, position))
+        bodies.append(body)
+        position += len(body) + 1
+    index = b' '.join(index) + b'\n'
+    stream = zlib.compress(index + b'\n'.join(bodies), 9)
+    obj = (b'%d 0 obj\n<< /Type /ObjStm /N %d /First %d /Filter /FlateDecode'
+           b' /Length %d >>\nstream\n%s\nendstream\nendobj\n'
+           % (size, len(packed), len(index), len(stream), stream))
+    entries[size] = (1, offset, 0)
+    out.append(obj)
+    offset += len(obj)
+
+    xref = size + 1
+    entries[xref] = (1, offset, 0)
+    width = max(1, (offset.bit_length() + 7) // 8)
+    rows = []
+    for number in range(xref + 1):
+        kind, field, generation = entries.get(number, (0, 0, 0))
+        rows.append(struct.pack('>B', kind) + field.to_bytes(width, 'big')
+                    + struct.pack('>H', generation))
+    stream = zlib.compress(b''.join(rows), 9)
+    keys = b' '.join(re.findall(rb'/(?:Root|Info) \d+ 0 R|/ID\s*\[<\w+><\w+>\]',
+                                trailer))
+    out.append(b'%d 0 obj\n<< /Type /XRef /Size %d /W [ 1 %d 2 ] %s'
+               b' /Filter /FlateDecode /Length %d >>\nstream\n%s\nendstream\n'
+               b'endobj\nstartxref\n%d\n%%%%EOF\n'
+               % (xref, xref + 1, width, keys, len(stream), stream, offset))
+    data = b''.join(out)
+    if BYTE_RANGE in data:
+        data = fill_byte_range(data)
+    return data
+
+
+def finish_pdf(filename, pdf, report=sys.stderr):
+    """Return a document compacted if the setup file asks for it.
+
+    Compacting reports the size of the document, written to filename,
+    before and after.
+    """
+    if not _ENABLED:
+        return pdf
+    compacted = compact_pdf(pdf)
+    report.write(f'{filename}: {len(pdf)} bytes, {len(compacted)} '
+                 f'compacted ({1 - len(compacted) / len(pdf):.0%} '
+                 f'smaller)\n')
+    return compacted
+
+
+def write_pdf(filename, pdf, report=sys.stderr):
+    """Write a document, compacted if the setup file asks for it."""
+    with open(filename, 'wb') as output_file:
+        output_file.write(finish_pdf(filename, pdf, report))
@@ -0,0 +1,237 @@
+"""QR codes drawn as vector paths.
+
+qrcode.make() renders the module matrix into a PIL image, which the
+canvas then resamples and encodes as an inline image in every document.
+draw_qr() draws the same matrix, quiet zone included, as one filled
+path instead: no image is created and the code stays sharp at any zoom.
+
+Encoded codes are kept in QR_CACHE, keyed by their data. The batch
+renderers of the generators (--batch) encode the codes of the whole
+batch in parallel with prefetch_qr() before rendering it, and report the
+time spent on QR codes, apart from layout, from QR_CACHE.stats().
+"""
+
+import collections
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import qrcode
+
+DEFAULT_QR_ENTRIES = 4096
+
+# Fewer codes are encoded as they are drawn: starting a process pool
+# takes longer than encoding them.
+MIN_PREFETCH = 8
+
+ERROR_CORRECTION = {
+    'L': qrcode.constants.ERROR_CORRECT_L,
+    'M': qrcode.constants.ERROR_CORRECT_M,
+    'Q': qrcode.constants.ERROR_CORRECT_Q,
+    'H': qrcode.constants.ERROR_CORRECT_H,
+}
+
+# The error correction level of the codes drawn; see configure_qr.
+_LEVEL = 'M'
+
+
+def module_rects(matrix):
+    """Return rectangles covering the dark modules of a QR matrix.
+
+    Each is (column, row, width, height), in modules from the top left
+    corner. Runs of dark modules in a row are merged, and so are runs
+    spanning the same columns in consecutive rows.
+    """
+    rects = []
+    # (start, end) of the runs of the previous row -> [column, row,
+    # width, height] of the rectangle they extend.
+    open_rects = {}
+    for row_index, row in enumerate(matrix):
+        runs = []
+        start = None
+        for column, dark in enumerate(row):
+            if dark and start is None:
+                start = column
+            elif not dark and start is not None:
+                runs.append((start, column))
+                start = None
+        if start is not None:
+            runs.append((start, len(row)))
+        next_rects = {}
+        for run in runs:
+            rect = open_rects.pop(run, None)
+            if rect is None:
+                rect = [run[0], row_index, run[1] - run[0], 0]
+            rect[3] += 1
+            next_rects[run] = rect
+        rects.extend(map(tuple, open_rects.values()))
+        open_rects = next_rects
+    rects.extend(map(tuple, open_rects.values()))
+    return rects
+
+
+def configure_qr(error_correction='M'):
+    """Set the error correction level (L, M, Q or H) of the process."""
+    global _LEVEL
+    if error_correction not in ERROR_CORRECTION:
+        raise ValueError(f'unknown QR error correction level '
+                         f'{error_correction!r}')
+    _LEVEL = error_correction
+
+
+def encode(data, error_correction='M'):
+    """Return the module count and path operators of the QR code of data.
+
+    The operators fill the dark modules, in units of one module from the
+    top left corner of the quiet zone. This is the part of drawing a QR
+    code worth running ahead of time, on a worker pool.
+    """
+    code = qrcode.QRCode(error_correction=ERROR_CORRECTION[error_correction])
+    code.add_data(data)
+    code.make(fit=True)
+    matrix = code.get_matrix()
+    # The coordinates are whole modules; formatting them as path.rect
+    # does, as floats, takes longer than computing the matrix.
+    return len(matrix), ' '.join('%d %d %d %d re' % rect
+                                 for rect in module_rects(matrix))
+
+
+def _timed_encode(key):
+    start = time.perf_counter()
+    modules, code = encode(*key)
+    return modules, code, time.perf_counter() - start
+
+
+class QRCache:
+    """Encoded QR codes keyed by data and level, with throughput counters.
+
+    Drawing the same reference code again (a re-render or a retry) never
+    encodes it again while it is in the cache. prefetch() encodes the
+    codes of a batch of documents on an executor before they are drawn.
+    """
+
+    def __init__(self, entries=DEFAULT_QR_ENTRIES):
+        self.entries = entries
+        self.hits = 0
+        self.misses = 0
+        # Codes encoded, and the time spent encoding and drawing them.
+        self.encoded = 0
+        self.encode_seconds = 0.0
+        self.draw_seconds = 0.0
+        self._codes = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _store(self, key, modules, code, seconds):
+        with self._lock:
+            self.encoded += 1
+            self.encode_seconds += seconds
+            self._codes[key] = (modules, code)
+            self._codes.move_to_end(key)
+            while len(self._codes) > self.entries:
+                self._codes.popitem(last=False)
+
+    def get(self, data, error_correction='M'):
+        """Return encode(data, error_correction), encoding it if needed."""
+        key = (data, error_correction)
+        with self._lock:
+            entry = self._codes.get(key)
+            if entry is not None:
+                self._codes.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        modules, code, seconds = _timed_encode(key)
+        self._store(key, modules, code, seconds)
+        return modules, code
+
+    def prefetch(self, datas, error_correction='M', executor=None,
+                 workers=None):
+        """Encode the codes of datas that are not cached, in parallel.
+
+        They are encoded on executor, a concurrent.futures executor, or
+        else on a process pool of workers processes made for the call;
+        QR encoding is pure Python, so threads would take turns. Without
+        an executor, fewer than MIN_PREFETCH codes are left to get().
+        """
+        keys = [(data, error_correction) for data in datas]
+        with self._lock:
+            missing = list(dict.fromkeys(key for key in keys
+                                         if key not in self._codes))
+        if not missing:
+            return
+        if executor is None:
+            if len(missing) < MIN_PREFETCH:
+                return
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                self._encode(missing, pool)
+        else:
+            self._encode(missing, executor)
+
+    def _encode(self, keys, executor):
+        for key, result in zip(keys, executor.map(_timed_encode, keys)):
+            self._store(key, *result)
+
+    def draw(self, canvas, data, x, y, size, error_correction='M'):
+        modules, code = self.get(data, error_correction)
+        start = time.perf_counter()
+        canvas.saveState()
+        # One unit per module, with the first row at the top.
+        canvas.translate(x, y + size)
+        canvas.scale(size / modules, -size / modules)
+        canvas.setFillColorRGB(0, 0, 0)
+        path = canvas.beginPath()
+        path._code.append(code)
+        canvas.drawPath(path, stroke=0, fill=1)
+        canvas.restoreState()
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self.draw_seconds += seconds
+
+    def stats(self):
+        """Return the counters, with the encoding rate in codes/s.
+
+        encode_seconds adds up the time of every worker, so the rate is
+        that of a single worker.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'encoded': self.encoded,
+                'encode_seconds': self.encode_seconds,
+                'draw_seconds': self.draw_seconds,
+                'codes_per_second': (self.encoded / self.encode_seconds
+                                     if self.encode_seconds else None),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._codes.clear()
+
+
+# Shared by every draw_qr call in the process.
+QR_CACHE = QRCache()
+
+
+def draw_qr(canvas, data, x, y, size):
+    """Draw the QR code of data in a square with its corner at (x, y).
+
+    The code is the one qrcode.make(data) makes, at the error correction
+    level set by configure_qr, scaled to size, and is taken from QR_CACHE.
+    """
+    QR_CACHE.draw(canvas, data, x, y, size, _LEVEL)
+
+
+def prefetch_qr(datas, executor=None, workers=None):
+    """Encode the QR codes of a batch of documents ahead of drawing."""
+    QR_CACHE.prefetch(datas, _LEVEL, executor, workers)
+
+
+def format_qr_stats(stats):
+    """Return a line of log describing QR_CACHE.stats()."""
+    rate = stats['codes_per_second']
+    return (f'QR codes: {stats["encoded"]} encoded in '
+            f'{stats["encode_seconds"]:.2f} s'
+            + (f' ({rate:.1f}/s per worker)' if rate is not None else '')
+            + f', {stats["hits"]} from the cache, drawn in '
+            f'{stats["draw_seconds"]:.2f} s')
@@ -0,0 +1,87 @@
+"""Reference codes printed and encoded in the QR code of a document.
+
+The reference of a document is the SHA-256 digest of its payload. By
+default the document carries all 64 hex digits of it, which needs a
+large QR symbol and a long line of small text. With "reference-code":
+"base32" in the setup file it carries a compact code instead: the
+first "reference-bits" bits of the digest (default 80) in Crockford's
+base32, which QR codes encode in alphanumeric mode, followed by a check
+character. The code is shown in groups of four characters.
+
+The full digest is still kept in the payload and printed by the
+generators after the code.
+"""
+
+import sys
+
+REFERENCE_FORMATS = ('hex', 'base32')
+
+DEFAULT_REFERENCE_BITS = 80
+
+# Crockford's base32: digits and letters, without I, L, O and U.
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+GROUP = 4
+
+_FORMAT = 'hex'
+_BITS = DEFAULT_REFERENCE_BITS
+
+
+class ReferenceCodeError(ValueError):
+    """Raised for a reference code format that cannot be used."""
+
+
+def configure_reference(format='hex', bits=DEFAULT_REFERENCE_BITS):
+    """Set the reference code format of the process."""
+    global _FORMAT, _BITS
+    if format not in REFERENCE_FORMATS:
+        raise ReferenceCodeError(f'unknown reference code format {format!r}')
+    if bits % 5 or not 40 <= bits <= 255:
+        raise ReferenceCodeError(f'reference bits must be a multiple of 5 '
+                                 f'from 40 to 255, not {bits}')
+    _FORMAT = format
+    _BITS = bits
+
+
+def check_character(code):
+    """Return the Luhn mod 32 check character of a base32 code."""
+    factor = 2
+    total = 0
+    for char in reversed(code):
+        addend = factor * ALPHABET.index(char)
+        factor = 3 - factor
+        total += addend // 32 + addend % 32
+    return ALPHABET[-total % 32]
+
+
+def _base32(digest_hex, bits):
+    value = int(digest_hex, 16) >> (len(digest_hex) * 4 - bits)
+    chars = [ALPHABET[(value >> shift) & 31]
+             for shift in range(bits - 5, -1, -5)]
+    code = ''.join(chars)
+    return code + check_character(code)
+
+
+def encoded_reference(digest_hex):
+    """Return the reference of a digest as encoded in the QR code."""
+    if _FORMAT == 'hex':
+        return digest_hex
+    return _base32(digest_hex, _BITS)
+
+
+def reference_code(digest_hex):
+    """Return the reference of a digest as printed on the document."""
+    code = encoded_reference(digest_hex)
+    if _FORMAT == 'hex':
+        return code
+    return '-'.join(code[i:i + GROUP] for i in range(0, len(code), GROUP))
+
+
+def print_reference(digest_hex, out=sys.stdout):
+    """Write the reference code of a digest, and the digest if it differs."""
+    code = reference_code(digest_hex)
+    if code == digest_hex:
+        out.write(f'{code}\n')
+    else:
+        out.write(f'{code} {digest_hex}\n')
+
@@ -0,0 +1,151 @@
+import collections
+import copy
+import threading
+
+from reportlab.pdfbase import pdfmetrics
+
+DEFAULT_SEGMENT_ENTRIES = 8192
+
+
+class _Segment:
+
+    def __init__(self, code, fonts):
+        # The content stream operators drawn for the field.
+        self.code = code
+        # (font name, text, {character: code}, internal name) for each
+        # run of text in the segment; the codes are None for fonts that
+        # are not subsetted.
+        self.fonts = fonts
+
+
+def _is_dynamic(font):
+    return hasattr(font, 'splitString')
+
+
+def _char_codes(state, text):
+    codes = {}
+    for char in map(ord, text):
+        if char == 0xa0:
+            char = 32
+        code = state.assignments.get(char)
+        if code is not None:
+            codes[char] = code
+    return codes
+
+
+class SegmentCache:
+    """Content stream segments of drawn fields, keyed by field and value.
+
+    A document that repeats a field value seen in an earlier document of
+    the process (typically a corrected resubmission, where only a field
+    or two changed) gets the operators of that field copied instead of
+    fitted and drawn again. This only saves the fitting and drawing of
+    the unchanged fields: the rest of the document is still built and
+    written in full, and the segments are kept in memory, for the
+    process.
+
+    TrueType text is encoded through per-document font subsets, so a
+    segment is only replayed if every character it shows has, or gets
+    when assigned in the same order, the code it had when the segment
+    was recorded; otherwise the field is drawn live. A changed field
+    that introduces new characters can therefore also send the fields
+    after it down the live path, but never produces a wrong glyph.
+
+    Segments must leave the graphics state as they found it, as drawOn
+    and draw_line do.
+    """
+
+    def __init__(self, entries=DEFAULT_SEGMENT_ENTRIES):
+        self.entries = entries
+        self.hits = 0
+        self.misses = 0
+        self._segments = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def replay(self, canvas, key):
+        with self._lock:
+            segment = self._segments.get(key)
+            if segment is not None:
+                self._segments.move_to_end(key)
+        if segment is None or not self._adopt_fonts(canvas._doc, segment):
+            self.misses += 1
+            return False
+        canvas._code.extend(segment.code)
+        self.hits += 1
+        return True
+
+    def record(self, canvas, key, start, runs):
+        """Keep what was drawn since len(canvas._code) was start.
+
+        runs lists the (font name, text) pairs the segment shows.
+        """
+        doc = canvas._doc
+        fonts = []
+        for font_name, text in runs:
+            font = pdfmetrics.getFont(font_name)
+            if _is_dynamic(font):
+                state = font.state[doc]
+                fonts.append((font_name, text, _char_codes(state, text),
+                              state.internalName))
+            else:
+                fonts.append((font_name, text, None,
+                              doc.fontMapping[font_name]))
+        segment = _Segment(canvas._code[start:], fonts)
+        with self._lock:
+            self._segments[key] = segment
+            self._segments.move_to_end(key)
+            while len(self._segments) > self.entries:
+                self._segments.popitem(last=False)
+
+    def _matches(self, doc, segment):
+        for font_name, _, codes, internal_name in segment.fonts:
+            font = pdfmetrics.getFont(font_name)
+            if codes is None:
+                if doc.fontMapping.get(font_name) != internal_name:
+                    return False
+                continue
+            state = getattr(font, 'state', {}).get(doc)
+            if state is None or state.internalName != internal_name:
+                return False
+            assignments = state.assignments
+            for char, code in codes.items():
+                if assignments.get(char) != code:
+                    return False
+        return True
+
+    def _adopt_fonts(self, doc, segment):
+        # Common case: every character is already encoded as recorded.
+        if self._matches(doc, segment):
+            return True
+        # Otherwise assign the new characters the way drawing would and
+        # check that they land on the recorded codes.
+        font_mapping = dict(doc.fontMapping)
+        delayed_fonts = len(doc.delayedFonts)
+        states = {}
+        for font_name, _, _, _ in segment.fonts:
+            font = pdfmetrics.getFont(font_name)
+            if _is_dynamic(font) and font_name not in states:
+                states[font_name] = copy.deepcopy(font.state.get(doc))
+        for font_name, text, codes, _ in segment.fonts:
+            font = pdfmetrics.getFont(font_name)
+            if codes is None:
+                doc.getInternalFontName(font_name)
+            else:
+                font.splitString(text, doc)
+                font.getSubsetInternalName(0, doc)
+        if self._matches(doc, segment):
+            return True
+        doc.fontMapping.clear()
+        doc.fontMapping.update(font_mapping)
+        del doc.delayedFonts[delayed_fonts:]
+        for font_name, state in states.items():
+            font = pdfmetrics.getFont(font_name)
+            if state is None:
+                del font.state[doc]
+            else:
+                font.state[doc] = state
+        return False
+
+    def clear(self):
+        with self._lock:
+            self._segments.clear()
@@ -0,0 +1,593 @@
+"""Signing of the generated forms, with a cached signature appearance.
+
+The signature box reads "Verified by GRNET S.A." and the signing time.
+endesive lays the box out and builds its appearance objects for every
+signature, although only the time differs from one document to the
+next. SignedData builds the appearance of a signing identity and box
+once, with a placeholder time of the same width, and for each document
+only writes the signing time into the copy of the text stream it adds.
+
+The placeholder has every digit, so they are all in the embedded font
+subset, and the signing time differs from it only in its digits, which
+all have the same width in the default font: the text is wrapped and
+placed exactly as endesive would place it.
+
+A Signer keeps a signing identity decrypted in memory; load_signer()
+loads each PKCS#12 file once per process, and signing_daemon serves one
+to other processes.
+
+With a signature reserved (the reserve-signature setup key), a document
+is written with its signature field, appearance and an empty /Contents
+of a fixed size already in it, the byte range set around it and a
+placeholder signing time. Signing it only writes the time, hashes the
+byte range and fills in the CMS signature: the document is neither
+parsed nor extended by an update. The reserved appearance is drawn in
+Helvetica, which needs no embedded font, and its text is blank until
+signing writes it, so an unsigned copy shows an empty box.
+
+write_document() signs a document still in memory and writes it out
+once: only the signed file, or the unsigned one with the signed copy
+made from it by the kernel.
+"""
+
+import collections
+import copy
+import datetime
+import hashlib
+import itertools
+import mmap
+import os
+import re
+import threading
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.serialization.pkcs12 import (
+    load_key_and_certificates
+)
+from endesive import signer as cms_signer
+from endesive.pdf import cms
+from endesive.pdf.PyPDF2_annotate.annotations.signature import Signature
+from endesive.pdf.PyPDF2_annotate.config.appearance import Appearance
+from endesive.pdf.PyPDF2_annotate.config.location import Location
+from endesive.pdf.PyPDF2_annotate.util.geometry import identity
+from reportlab.lib.utils import simpleSplit
+
+from pdf_compact import (BYTE_RANGE, fill_byte_range, finish_pdf, split_pdf,
+                         write_pdf)
+
+SIGNATURE_BOX = (450, 0, 600, 100)
+
+DEFAULT_APPEARANCE_ENTRIES = 64
+
+TIMESTAMP_FORMAT = "%Y%m%d%H%M%S+02'00'"
+
+# Bytes of CMS signature a reserved /Contents has room for.
+DEFAULT_SIGNATURE_SPACE = 8192
+
+# Written in place of the signing time, which has the same width.
+PLACEHOLDER_TIMESTAMP = "00000000000000+02'00'"
+
+_RESERVED_SPACE = 0
+
+_RESERVED_BYTE_RANGE = re.compile(
+    re.escape(BYTE_RANGE) + rb'0 (\d{10}) (\d{10}) (\d{10}) \]')
+
+# The dictionary of a reserved appearance, followed by its text.
+_APPEARANCE = (b'<<\n/BBox [ 0 0 %g %g ] /Resources <<\n/Font <<\n/Helv << '
+               b'/BaseFont /Helvetica /Encoding /WinAnsiEncoding '
+               b'/Subtype /Type1 /Type /Font >>\n>>\n>> /Subtype /Form '
+               b'/Type /XObject /Length %d\n>>\nstream\n')
+
+_RESERVED_APPEARANCE = re.compile(
+    re.escape(_APPEARANCE).replace(rb'%g', rb'([\d.]+)').replace(
+        rb'%d', rb'(\d+)'))
+
+_SIGNERS = {}
+_SIGNERS_LOCK = threading.Lock()
+
+
+class SigningError(ValueError):
+    """Raised for a signing identity or request that cannot be used."""
+
+
+def signing_details(timestamp):
+    """Return the endesive signing parameters of a signing time."""
+    return {
+        'sigflags': 3,
+        'sigpage': 0,
+        'contact': 'support@grnet.gr',
+        'location': 'Athens',
+        'signingdate': timestamp,
+        'reason': 'GRNET Signing Service',
+        'signature': f'Verified by GRNET S.A. {timestamp}',
+        'signaturebox': SIGNATURE_BOX,
+    }
+
+
+def configure_reservation(space=False):
+    """Reserve a signature in the documents written from now on.
+
+    space is the bytes of CMS signature to make room for, or True for
+    DEFAULT_SIGNATURE_SPACE; False does not reserve one.
+    """
+    global _RESERVED_SPACE
+    if space is True:
+        space = DEFAULT_SIGNATURE_SPACE
+    if space is not False and (not isinstance(space, int) or space < 0):
+        raise SigningError(f'invalid signature space: {space!r}')
+    _RESERVED_SPACE = space or 0
+
+
+def _literal(text):
+    return '(%s)' % text.replace('\\', '\\\\').replace(
+        '(', '\\(').replace(')', '\\)')
+
+
+def _appearance_text(width, height, timestamp, blank=False):
+    """Return the text of a signature appearance of width x height.
+
+    A blank text has spaces in place of every character shown, and the
+    same length.
+    """
+    font_size = 12
+    leading = 1.2 * font_size
+    lines = simpleSplit(signing_details(timestamp)['signature'],
+                        'Helvetica', font_size, width - 2)
+    # Vertically centred, as endesive places the text.
+    top = (height + len(lines) * leading) / 2 - 0.8 * font_size
+    strings = [_literal(line) for line in lines]
+    if blank:
+        strings = ['(%s)' % (' ' * (len(string) - 2)) for string in strings]
+    return '\n'.join(
+        ['q BT /Helv %d Tf 0 g %g TL 1 %g Td' % (font_size, leading, top)]
+        + ['%s Tj T*' % string for string in strings]
+        + ['ET Q']).encode('latin-1')
+
+
+def _reserved_appearance(box):
+    """Return the appearance stream of a reserved signature.
+
+    It shows nothing until the signature is signed: reserved_patches()
+    writes the text over its blank one.
+    """
+    x1, y1, x2, y2 = box
+    width, height = x2 - x1, y2 - y1
+    code = _appearance_text(width, height, PLACEHOLDER_TIMESTAMP, blank=True)
+    return (_APPEARANCE % (width, height, len(code))
+            + code + b'\nendstream')
+
+
+def reserve_signature(pdf, space=DEFAULT_SIGNATURE_SPACE, box=SIGNATURE_BOX):
+    """Return a ReportLab document with a signature reserved in it.
+
+    The signature field of its first page gets the appearance and
+    details of signing_details() and room for space bytes of CMS
+    signature; sign_reserved() signs it.
+    """
+    header, objects, trailer = split_pdf(pdf)
+    root = int(re.search(rb'/Root (\d+) 0 R', trailer).group(1))
+    catalog = objects[root]
+    pages = int(re.search(rb'/Pages (\d+) 0 R', catalog).group(1))
+    page = int(re.search(rb'/Kids \[\s*(\d+) 0 R', objects[pages]).group(1))
+    if b'/AcroForm' in catalog or b'/Annots' in objects[page]:
+        raise SigningError('document already has a form or annotations')
+    details = signing_details(PLACEHOLDER_TIMESTAMP)
+    signature, widget, appearance = (len(objects) + 1, len(objects) + 2,
+                                     len(objects) + 3)
+    objects[root] = catalog.replace(
+        b'<<', b'<<\n/AcroForm << /Fields [ %d 0 R ] /SigFlags %d >>'
+        % (widget, details['sigflags']), 1)
+    objects[page] = objects[page].replace(
+        b'<<', b'<<\n/Annots [ %d 0 R ]' % widget, 1)
+    # The byte range comes before the hole, with numbers of fixed width
+    # for fill_byte_range().
+    objects[signature] = (
+        b'<<\n/Type /Sig /Filter /Adobe.PPKLite /SubFilter '
+        b'/adbe.pkcs7.detached /Contact %s /Location %s /Reason %s '
+        b'/M (D:%s)\n%s0 0000000000 0000000000 0000000000 ]\n'
+        b'/Contents <%s>\n>>'
+        % (_literal(details['contact']).encode(),
+           _literal(details['location']).encode(),
+           _literal(details['reason']).encode(),
+           PLACEHOLDER_TIMESTAMP.encode(), BYTE_RANGE, b'0' * (2 * space)))
+    objects[widget] = (
+        b'<<\n/AP << /N %d 0 R >> /F 132 /FT /Sig /P %d 0 R '
+        b'/Rect [ %g %g %g %g ] /Subtype /Widget /T (Signature1) '
+        b'/Type /Annot /V %d 0 R\n>>'
+        % ((appearance, page) + tuple(box) + (signature,)))
+    objects[appearance] = _reserved_appearance(box)
+
+    out = [header]
+    offsets = []
+    offset = len(header)
+    for number, body in objects.items():
+        obj = b'%d 0 obj\n%s\nendobj\n' % (number, body)
+        offsets.append(offset)
+        out.append(obj)
+        offset += len(obj)
+    out.append(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    out.extend(b'%010d 00000 n \n' % offset for offset in offsets)
+    out.append(re.sub(rb'/Size \d+', b'/Size %d' % (len(objects) + 1),
+                      trailer))
+    out.append(b'startxref\n%d\n%%%%EOF\n' % offset)
+    return fill_byte_range(b''.join(out))
+
+
+def prepare_for_signing(pdf):
+    """Return pdf with a signature reserved, if configured to."""
+    if not _RESERVED_SPACE:
+        return pdf
+    return reserve_signature(pdf, _RESERVED_SPACE)
+
+
+def is_reserved(pdf):
+    """Tell whether pdf has a reserved signature, not yet signed."""
+    return (_RESERVED_BYTE_RANGE.search(pdf) is not None
+            and pdf.find(PLACEHOLDER_TIMESTAMP.encode()) != -1)
+
+
+def _find_all(data, sub):
+    positions = []
+    position = data.find(sub)
+    while position != -1:
+        positions.append(position)
+        position = data.find(sub, position + len(sub))
+    return positions
+
+
+def reserved_patches(pdf, key, cert, othercerts, timestamp):
+    """Return the writes that sign the reserved signature of pdf.
+
+    pdf may be bytes or a memory map of the file; it is hashed where it
+    lies, with the signing time in place of the placeholder and the
+    appearance text written over its blank one, and not copied. The
+    result lists (offset, bytes) to write over the document.
+    """
+    placeholder = PLACEHOLDER_TIMESTAMP.encode()
+    stamp = timestamp.encode()
+    positions = _find_all(pdf, placeholder)
+    match = _RESERVED_BYTE_RANGE.search(pdf)
+    appearance = _RESERVED_APPEARANCE.search(pdf)
+    if len(stamp) != len(placeholder) or len(positions) != 1 \
+            or match is None or appearance is None:
+        raise SigningError('document has no reserved signature for '
+                           f'{timestamp}')
+    width, height, text_length = appearance.groups()
+    text = _appearance_text(float(width), float(height), timestamp)
+    if len(text) != int(text_length):
+        raise SigningError(f'appearance of {timestamp} does not fit its '
+                           f'reserved text')
+    hole, after, length = (int(value) for value in match.groups())
+    patches = sorted([(positions[0], stamp), (appearance.end(), text)])
+    digest = hashlib.sha256()
+    with memoryview(pdf) as view:
+        for start, end in ((0, hole), (after, after + length)):
+            for position, patch in patches:
+                if start <= position < end:
+                    digest.update(view[start:position])
+                    digest.update(patch)
+                    start = position + len(patch)
+            digest.update(view[start:end])
+    contents = cms_signer.sign(None, key, cert, othercerts, 'sha256', True,
+                               digest.digest()).hex().encode()
+    if len(contents) > after - hole - 2:
+        raise SigningError(f'signature of {len(contents) // 2} bytes does '
+                           f'not fit in {(after - hole - 2) // 2}')
+    return patches + [(hole + 1, contents)]
+
+
+def apply_signature(pdf, signature):
+    """Return the document pdf with a signature() result applied."""
+    patches, update = signature
+    data = bytearray(pdf)
+    for offset, patch in patches:
+        data[offset:offset + len(patch)] = patch
+    return bytes(data + update)
+
+
+def sign_reserved(pdf, key, cert, othercerts, timestamp):
+    """Return a document with a reserved signature signed in place."""
+    return apply_signature(pdf, (reserved_patches(pdf, key, cert,
+                                                  othercerts, timestamp),
+                                 b''))
+
+
+def _pdf_text(text):
+    # As the annotation library writes the text of the default font.
+    return text.encode('utf-16-be')
+
+
+def _build_appearance(udct, box, page_ref):
+    """Build the normal appearance of a text signature as endesive does."""
+    x1, y1, x2, y2 = box
+    annotation = Signature(Location(x1=x1, y1=y1, x2=x2, y2=y2, page=0),
+                           Appearance())
+    text = udct.get('text', {})
+    font_size = text.get('fontsize', 12)
+    annotation.add_default_font()
+    annotation.set_signature_appearance(
+        ['fill_colour', 0, 0, 0],
+        ['font', 'default', font_size],
+        ['text_box', udct['signature'], 'default', 0, 0, x2 - x1, y2 - y1,
+         font_size, text.get('wraptext', True), text.get('textalign', 'left'),
+         'middle', text.get('linespacing', 1.2)],
+    )
+    return annotation.as_pdf_object(identity(), page=page_ref)['/AP']['/N']
+
+
+def _substitute(obj, old, new):
+    """Return obj with old replaced by new in the streams under it.
+
+    Objects without old under them are returned as they are; the ones on
+    the way to a stream that has it are copied. Returns None if old is
+    not in exactly one stream, once.
+    """
+    count = [0]
+
+    def walk(obj):
+        changed = {}
+        for key, value in obj.items():
+            if hasattr(value, 'items'):
+                value_copy = walk(value)
+                if value_copy is not value:
+                    changed[key] = value_copy
+        stream = getattr(obj, 'stream', None)
+        found = stream.count(old) if stream is not None else 0
+        if not changed and not found:
+            return obj
+        obj = copy.copy(obj)
+        obj.update(changed)
+        if found:
+            count[0] += found
+            obj.stream = stream.replace(old, new)
+        return obj
+
+    result = walk(obj)
+    return result if count[0] == 1 else None
+
+
+class AppearanceCache:
+    """Signature appearances keyed by identity, box and text, sans time."""
+
+    def __init__(self, entries=DEFAULT_APPEARANCE_ENTRIES):
+        self.entries = entries
+        self.hits = 0
+        self.misses = 0
+        self._appearances = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def appearance(self, cert, udct, box, page_ref):
+        """Return the normal appearance of a signature.
+
+        If the signing time is in the signature text it is taken out of
+        the key and written into a copy of the cached appearance.
+        """
+        timestamp = udct.get('signingdate', '')
+        text = udct['signature']
+        if not timestamp or text.count(timestamp) != 1:
+            return _build_appearance(udct, box, page_ref)
+        # Every digit, so that all of them are in the embedded subset.
+        digits = itertools.cycle('0123456789')
+        placeholder = re.sub(r'\d', lambda match: next(digits), timestamp)
+        key = (cert.fingerprint(hashes.SHA256()), tuple(box),
+               text.replace(timestamp, placeholder),
+               repr(sorted(udct.get('text', {}).items())))
+        with self._lock:
+            cached = self._appearances.get(key)
+            if cached is not None:
+                self._appearances.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if cached is None:
+            template = dict(udct, signature=key[2])
+            cached = _build_appearance(template, box, page_ref)
+            with self._lock:
+                self._appearances[key] = cached
+                while len(self._appearances) > self.entries:
+                    self._appearances.popitem(last=False)
+        appearance = _substitute(cached, _pdf_text(placeholder),
+                                 _pdf_text(timestamp))
+        if appearance is None:
+            return _build_appearance(udct, box, page_ref)
+        return appearance
+
+    def clear(self):
+        with self._lock:
+            self._appearances.clear()
+
+
+# Shared by every signature made in the process.
+APPEARANCE_CACHE = AppearanceCache()
+
+
+class SignedData(cms.SignedData):
+    """endesive's SignedData, with text appearances from APPEARANCE_CACHE.
+
+    endesive has no hook for the appearance alone: addAnnotation() has it
+    annotate the page with a blank manual appearance, and the cached one
+    is added in its place when endesive adds it to the document.
+    """
+
+    _appearance = None
+
+    def addAnnotation(self, cert, udct, box, page0ref, obj13, obj13ref,
+                      new_13):
+        if 'signature' not in udct:
+            return super().addAnnotation(cert, udct, box, page0ref, obj13,
+                                         obj13ref, new_13)
+        blank = {key: value for key, value in udct.items()
+                 if key != 'signature'}
+        blank['signature_manual'] = []
+        self._appearance = APPEARANCE_CACHE.appearance(cert, udct, box,
+                                                       page0ref)
+        try:
+            super().addAnnotation(cert, blank, box, page0ref, obj13,
+                                  obj13ref, new_13)
+        finally:
+            self._appearance = None
+
+    def _extend(self, obj):
+        # The first object endesive adds is the normal appearance.
+        appearance, self._appearance = self._appearance, None
+        return super()._extend(obj if appearance is None else appearance)
+
+
+class Signer:
+    """A signing identity loaded from a PKCS#12 file, kept in memory.
+
+    Decrypting the bundle takes as long as a signature, so a process
+    signing many documents loads it once and calls sign() for each;
+    sign() may be called from several threads.
+    """
+
+    def __init__(self, certificate_filename, password):
+        with open(certificate_filename, 'rb') as cert_in:
+            cert_data = cert_in.read()
+        self.key, self.cert, self.othercerts = load_key_and_certificates(
+            cert_data, password.encode('utf-8'), default_backend())
+        if self.key is None or self.cert is None:
+            raise SigningError(f'{certificate_filename} has no key and '
+                               f'certificate')
+
+    def sign(self, pdf, timestamp=None):
+        """Return the signed update to append to the PDF bytes pdf."""
+        if timestamp is None:
+            timestamp = datetime.datetime.now().strftime(TIMESTAMP_FORMAT)
+        return SignedData().sign(pdf, signing_details(timestamp), self.key,
+                                 self.cert, self.othercerts, 'sha256', None)
+
+    def signature(self, pdf, timestamp=None):
+        """Return the signature of pdf, as (patches, update).
+
+        patches lists the (offset, bytes) to write over the document and
+        update the bytes to append to it: a reserved signature is signed
+        in place, any other document gets a signed update. pdf may be a
+        memory map of the file, but only a reserved signature is hashed
+        where it lies: endesive parses any other document from bytes, so
+        a map of one is copied into memory whole.
+        """
+        if not is_reserved(pdf):
+            if not isinstance(pdf, bytes):
+                pdf = bytes(pdf)
+            return [], self.sign(pdf, timestamp)
+        if timestamp is None:
+            timestamp = datetime.datetime.now().strftime(TIMESTAMP_FORMAT)
+        return reserved_patches(pdf, self.key, self.cert, self.othercerts,
+                                timestamp), b''
+
+    def sign_document(self, pdf, timestamp=None):
+        """Return the PDF bytes pdf signed."""
+        return apply_signature(pdf, self.signature(pdf, timestamp))
+
+
+def load_signer(certificate_filename, password):
+    """Return the process-wide Signer of a PKCS#12 file and password.
+
+    The file is loaded again if it has changed since.
+    """
+    stat = os.stat(certificate_filename)
+    key = (os.path.realpath(certificate_filename), stat.st_mtime_ns,
+           stat.st_size, hashlib.sha256(password.encode('utf-8')).digest())
+    with _SIGNERS_LOCK:
+        signer = _SIGNERS.get(key)
+        if signer is None:
+            signer = _SIGNERS[key] = Signer(certificate_filename, password)
+        return signer
+
+
+def signed_filename(pdf_filename):
+    """Return the name of the signed copy of a PDF file."""
+    filename, file_extension = os.path.splitext(pdf_filename)
+    return f'{filename}-signed{file_extension}'
+
+
+def _copy(source, destination, count):
+    """Copy the first count bytes of a file to another in the kernel."""
+    offset = 0
+    while offset < count:
+        try:
+            copied = os.copy_file_range(source, destination, count - offset,
+                                        offset, offset)
+        except (AttributeError, OSError):
+            # Older kernels, or files on different file systems.
+            os.lseek(destination, offset, os.SEEK_SET)
+            copied = os.sendfile(destination, source, offset, count - offset)
+        if not copied:
+            raise OSError(f'short copy: {offset} of {count} bytes')
+        offset += copied
+
+
+def _write_signature(output_file, length, signature):
+    patches, update = signature
+    for offset, patch in patches:
+        os.pwrite(output_file.fileno(), patch, offset)
+    os.pwrite(output_file.fileno(), update, length)
+
+
+def write_signed(pdf_filename, pdf, signature, keep_unsigned=False):
+    """Write the signed copy of the document pdf, and pdf if asked to.
+
+    signature is the (patches, update) of Signer.signature(). The
+    document is written once: with keep_unsigned it goes to pdf_filename
+    and the kernel copies it to <name>-signed<ext>, where the signature
+    is written over it.
+    """
+    with open(signed_filename(pdf_filename), 'w+b') as decl_signed_file:
+        if keep_unsigned:
+            with open(pdf_filename, 'w+b') as decl_file:
+                decl_file.write(pdf)
+                decl_file.flush()
+                _copy(decl_file.fileno(), decl_signed_file.fileno(),
+                      len(pdf))
+        else:
+            decl_signed_file.write(pdf)
+            decl_signed_file.flush()
+        _write_signature(decl_signed_file, len(pdf), signature)
+
+
+def prepare_document(pdf_filename, pdf):
+    """Return a rendered document as it is to be signed.
+
+    A signature is reserved in it if the setup file asks for it, and it
+    is compacted if asked to.
+    """
+    return finish_pdf(pdf_filename, prepare_for_signing(pdf))
+
+
+def write_document(pdf_filename, pdf, signer=None, keep_unsigned=False):
+    """Write a rendered document, signed if a signer is given.
+
+    signer is a Signer or a signing_daemon.SignerClient. Unsigned, the
+    document goes to pdf_filename; signed, to <name>-signed<ext> only,
+    unless keep_unsigned, after prepare_document().
+    """
+    if signer is None:
+        write_pdf(pdf_filename, pdf)
+        return
+    pdf = prepare_document(pdf_filename, pdf)
+    write_signed(pdf_filename, pdf, signer.signature(pdf), keep_unsigned)
+
+
+def sign_file(pdf_filename, signer):
+    """Sign a PDF file into <name>-signed<ext> next to it.
+
+    The file is mapped rather than read: a reserved signature is hashed
+    in place, and the signed copy is copied by the kernel with the
+    signature written over it. A file without a reserved signature is
+    read into memory once for endesive to parse; see Signer.signature().
+    """
+    with open(pdf_filename, 'rb') as decl_file:
+        with mmap.mmap(decl_file.fileno(), 0,
+                       access=mmap.ACCESS_READ) as decl_pdf:
+            signature = signer.signature(decl_pdf)
+            length = len(decl_pdf)
+        with open(signed_filename(pdf_filename), 'w+b') as decl_signed_file:
+            _copy(decl_file.fileno(), decl_signed_file.fileno(), length)
+            _write_signature(decl_signed_file, length, signature)
+
+
+def crypto_sign(certificate_filename, password, pdf_filename):
+    """Sign a PDF file into <name>-signed<ext> next to it."""
+    sign_file(pdf_filename, load_signer(certificate_filename, password))
@@ -0,0 +1,185 @@
+"""A local signing daemon that keeps a signing identity loaded.
+
+    signing_daemon.py -c CERTIFICATE [-p PASSWORD] -S SOCKET
+
+decrypts the PKCS#12 bundle once and signs the documents the generators
+(run with --signer SOCKET) or a SignerClient send it over a Unix socket,
+so the key is neither read nor decrypted again for each document. The
+password may also be given in the SIGNER_PASSWORD environment variable,
+or typed in. The socket is only accessible to the user running the
+daemon: anyone who can connect to it can sign.
+
+Each request is a 4-byte big-endian length followed by that many bytes
+of PDF; the reply is "+" and the signature, or "-" and an error message,
+also preceded by their length. A signature is the number of patches
+(4 bytes), each patch as its offset (8 bytes), length (4 bytes) and
+bytes, and then the update to append to the PDF, all big-endian: the
+document itself is not sent back. A connection may carry any number of
+requests.
+"""
+
+import argparse
+import getpass
+import os
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import threading
+
+from signing import SigningError, load_signer
+
+# The largest document accepted, in bytes.
+MAX_DOCUMENT = 64 * 1024 * 1024
+
+_LENGTH = struct.Struct('>I')
+
+_PATCH = struct.Struct('>QI')
+
+
+def _receive(connection, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(min(size - len(data), 1 << 20))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def _send(connection, status, data):
+    connection.sendall(status + _LENGTH.pack(len(data)) + data)
+
+
+def _pack_signature(signature):
+    patches, update = signature
+    return b''.join([_LENGTH.pack(len(patches))]
+                    + [_PATCH.pack(offset, len(patch)) + patch
+                       for offset, patch in patches]
+                    + [update])
+
+
+def _unpack_signature(data):
+    (count,) = _LENGTH.unpack_from(data)
+    position = _LENGTH.size
+    patches = []
+    for _ in range(count):
+        offset, length = _PATCH.unpack_from(data, position)
+        position += _PATCH.size
+        patches.append((offset, data[position:position + length]))
+        position += length
+    return patches, data[position:]
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            header = _receive(self.request, _LENGTH.size)
+            if header is None:
+                return
+            (size,) = _LENGTH.unpack(header)
+            if size > MAX_DOCUMENT:
+                _send(self.request, b'-', b'document too large')
+                return
+            pdf = _receive(self.request, size)
+            if pdf is None:
+                return
+            try:
+                signature = self.server.signer.signature(pdf)
+            except Exception as e:
+                _send(self.request, b'-', f'cannot sign: {e}'.encode())
+            else:
+                _send(self.request, b'+', _pack_signature(signature))
+
+
+class SigningServer(socketserver.ThreadingUnixStreamServer):
+    """Signs the documents sent to a Unix socket with one Signer."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, signer):
+        self.signer = signer
+        if os.path.exists(socket_path) \
+                and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            os.unlink(socket_path)
+        umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, _Handler)
+        finally:
+            os.umask(umask)
+
+
+class SignerClient:
+    """A connection to a signing daemon; may be shared by threads."""
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def signature(self, pdf):
+        """Return the signature of the PDF pdf, as Signer.signature()."""
+        with self._lock:
+            if self._connection is None:
+                self._connection = socket.socket(socket.AF_UNIX,
+                                                 socket.SOCK_STREAM)
+                self._connection.connect(self.socket_path)
+            try:
+                self._connection.sendall(_LENGTH.pack(len(pdf)))
+                self._connection.sendall(pdf)
+                reply = _receive(self._connection, 1 + _LENGTH.size)
+                if reply is None:
+                    raise SigningError('signing daemon closed the connection')
+                (size,) = _LENGTH.unpack(reply[1:])
+                data = _receive(self._connection, size)
+                if data is None:
+                    raise SigningError('signing daemon closed the connection')
+            except (OSError, SigningError):
+                self.close()
+                raise
+        if reply[:1] != b'+':
+            raise SigningError(data.decode(errors='replace'))
+        return _unpack_signature(data)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-c', '--certificate', required=True,
+                        help='certificate file')
+    parser.add_argument('-p', '--password',
+                        help='certificate password; if not given, it is '
+                        'taken from SIGNER_PASSWORD or asked for')
+    parser.add_argument('-S', '--socket', required=True,
+                        help='Unix socket to listen on')
+    args = parser.parse_args()
+
+    password = args.password
+    if password is None:
+        password = os.environ.get('SIGNER_PASSWORD')
+    if password is None:
+        password = getpass.getpass('certificate password: ')
+
+    try:
+        signer = load_signer(args.certificate, password)
+    except (OSError, ValueError) as e:
+        sys.exit(f'{args.certificate}: {e}')
+
+    # Remove the socket on kill as on Ctrl-C.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with SigningServer(args.socket, signer) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(args.socket)
@@ -0,0 +1,221 @@
+"""Signing of batches of documents on a pool of worker processes.
+
+    signing_pool.py -c CERTIFICATE [-p PASSWORD] [-j WORKERS] PDF...
+
+signs the PDF files given into <name>-signed<ext> files, like the
+generators do, and prints the throughput of every worker. A batch or
+service that renders documents in one process hands their bytes to a
+SigningPool, which signs them on other cores while it renders the next
+ones; the generators do so with --batch and a certificate file, through
+a BatchWriter. Only the signatures come back from the workers, to be
+written with signing.write_signed().
+
+Each worker process loads the signing identity once, when it starts; the
+password is sent to it through the pool's pipe. At most max_in_flight
+documents are queued or being signed at a time: submit() waits for one
+to finish beyond that, so a fast renderer cannot fill memory with
+documents waiting to be signed.
+"""
+
+import argparse
+import collections
+import functools
+import getpass
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from signing import (load_signer, prepare_document, write_document,
+                     write_signed)
+
+_SIGNER = None
+
+
+def _start_worker(certificate_filename, password):
+    global _SIGNER
+    _SIGNER = load_signer(certificate_filename, password)
+
+
+def _sign(pdf):
+    start = time.perf_counter()
+    signature = _SIGNER.signature(pdf)
+    return os.getpid(), time.perf_counter() - start, signature
+
+
+class SigningPool:
+    """Signs PDF bytes on worker processes that each keep a Signer.
+
+    submit() returns a future of the signature of a document, as
+    Signer.signature() returns it; map() signs a sequence of documents
+    and yields their signatures in order. Use it as a context manager,
+    or call close().
+    """
+
+    def __init__(self, certificate_filename, password, workers=None,
+                 max_in_flight=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or 2 * self.workers
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_start_worker,
+            initargs=(certificate_filename, password))
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        # Worker process id -> [documents signed, seconds signing].
+        self._stats = collections.defaultdict(lambda: [0, 0.0])
+        self._lock = threading.Lock()
+
+    def _done(self, result, future):
+        self._slots.release()
+        if future.cancelled():
+            result.cancel()
+            return
+        if future.exception() is not None:
+            result.set_exception(future.exception())
+            return
+        pid, seconds, signature = future.result()
+        with self._lock:
+            stats = self._stats[pid]
+            stats[0] += 1
+            stats[1] += seconds
+        result.set_result(signature)
+
+    def submit(self, pdf):
+        """Queue the PDF bytes pdf for signing, waiting for room if full."""
+        self._slots.acquire()
+        result = Future()
+        try:
+            future = self._executor.submit(_sign, pdf)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(functools.partial(self._done, result))
+        return result
+
+    def map(self, pdfs):
+        """Yield the signatures of the documents pdfs, in order."""
+        futures = collections.deque()
+        for pdf in pdfs:
+            futures.append(self.submit(pdf))
+            # Signed documents are held until the ones before them are.
+            while futures and (futures[0].done()
+                               or len(futures) >= self.max_in_flight):
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+    def stats(self):
+        """Return the documents signed and time taken by each worker.
+
+        The result maps each worker process id to its counters, with its
+        rate in documents/s.
+        """
+        with self._lock:
+            return {
+                pid: {
+                    'documents': documents,
+                    'seconds': seconds,
+                    'documents_per_second': (documents / seconds
+                                             if seconds else None),
+                }
+                for pid, (documents, seconds) in self._stats.items()
+            }
+
+    def close(self):
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BatchWriter:
+    """Writes the documents of a batch as signing.write_document() does.
+
+    With a SigningPool they are signed on its workers: write() queues a
+    document, writes out the ones signed before it and only waits while
+    pool.max_in_flight are queued, so the caller renders the next ones
+    meanwhile. Without one they are signed with signer, if given, and
+    written one at a time. Use it as a context manager, or call close()
+    to write the documents still queued.
+    """
+
+    def __init__(self, pool=None, signer=None, keep_unsigned=False):
+        self.pool = pool
+        self.signer = signer
+        self.keep_unsigned = keep_unsigned
+        self._pending = collections.deque()
+
+    def write(self, pdf_filename, pdf):
+        """Write a rendered document, signed."""
+        if self.pool is None:
+            write_document(pdf_filename, pdf, self.signer, self.keep_unsigned)
+            return
+        self.queue(pdf_filename, prepare_document(pdf_filename, pdf))
+
+    def queue(self, pdf_filename, pdf):
+        """Sign a document as it is on the pool and write it when signed."""
+        self._pending.append((pdf_filename, pdf, self.pool.submit(pdf)))
+        while self._pending and (self._pending[0][2].done()
+                                 or len(self._pending)
+                                 >= self.pool.max_in_flight):
+            self._write_first()
+
+    def _write_first(self):
+        pdf_filename, pdf, future = self._pending.popleft()
+        write_signed(pdf_filename, pdf, future.result(), self.keep_unsigned)
+
+    def close(self):
+        while self._pending:
+            self._write_first()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def sign_files(pool, filenames):
+    """Sign PDF files into <name>-signed<ext> files on a SigningPool."""
+    with BatchWriter(pool) as writer:
+        for filename in filenames:
+            with open(filename, 'rb') as pdf_file:
+                writer.queue(filename, pdf_file.read())
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-c', '--certificate', required=True,
+                        help='certificate file')
+    parser.add_argument('-p', '--password',
+                        help='certificate password; if not given, it is '
+                        'taken from SIGNER_PASSWORD or asked for')
+    parser.add_argument('-j', '--workers', type=int,
+                        help='worker processes (default: one per core)')
+    parser.add_argument('pdfs', nargs='+', metavar='PDF',
+                        help='PDF files to sign')
+    args = parser.parse_args()
+
+    password = args.password
+    if password is None:
+        password = os.environ.get('SIGNER_PASSWORD')
+    if password is None:
+        password = getpass.getpass('certificate password: ')
+
+    start = time.perf_counter()
+    with SigningPool(args.certificate, password, args.workers) as pool:
+        sign_files(pool, args.pdfs)
+        stats = pool.stats()
+    elapsed = time.perf_counter() - start
+    for pid, worker in sorted(stats.items()):
+        rate = worker['documents_per_second']
+        sys.stderr.write(f'worker {pid}: {worker["documents"]} documents'
+                         + (f', {rate:.1f}/s' if rate is not None else '')
+                         + '\n')
+    sys.stderr.write(f'{len(args.pdfs)} documents in {elapsed:.1f} s, '
+                     f'{len(args.pdfs) / elapsed:.1f}/s\n')
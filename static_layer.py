@@ -0,0 +1,94 @@
+import copy
+import io
+import threading
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfgen.canvas import Canvas
+
+
+class _CompiledLayer:
+
+    def __init__(self, font_mapping, code, fonts):
+        # Font names the scratch document had before the layer was drawn.
+        self.font_mapping = font_mapping
+        # The content stream operators of the layer.
+        self.code = code
+        # (font name, internal name, subset state) for each font the layer
+        # introduced; the state is None for non-subsetted fonts.
+        self.fonts = fonts
+
+
+class StaticLayer:
+    """The payload-independent part of a page, drawn once per process.
+
+    The drawing function is run once on a scratch canvas and its content
+    stream is kept together with the font subset assignments it made.
+    stamp() puts that stream into a Form XObject of the target document
+    and draws the form, so the layer costs a list copy per document
+    instead of re-running the drawing code. If the target document has
+    already used fonts when stamp() is called, the layer is drawn live
+    into the form instead, as the kept stream would not match its font
+    subsets.
+
+    The drawing function may only draw paths and text; images, colour
+    spaces and transparency are not carried over.
+    """
+
+    def __init__(self, name, draw, pagesize=A4):
+        self.name = name
+        self.draw = draw
+        self.pagesize = pagesize
+        self._compiled = None
+        self._lock = threading.Lock()
+
+    def compile(self):
+        with self._lock:
+            if self._compiled is None:
+                self._compiled = self._compile()
+            return self._compiled
+
+    def _compile(self):
+        canvas = Canvas(io.BytesIO(), pagesize=self.pagesize)
+        doc = canvas._doc
+        font_mapping = dict(doc.fontMapping)
+        canvas.beginForm(self.name)
+        self.draw(canvas)
+        code = list(canvas._code)
+        canvas.endForm()
+        fonts = []
+        for font_name, internal_name in doc.fontMapping.items():
+            if font_name in font_mapping:
+                continue
+            font = pdfmetrics.getFont(font_name)
+            state = getattr(font, 'state', {}).get(doc)
+            fonts.append((font_name, internal_name, copy.deepcopy(state)))
+        return _CompiledLayer(font_mapping, code, fonts)
+
+    def _replay(self, canvas, compiled):
+        doc = canvas._doc
+        if doc.fontMapping != compiled.font_mapping:
+            return False
+        for font_name, _, state in compiled.fonts:
+            font = pdfmetrics.getFont(font_name)
+            if state is not None and doc in font.state:
+                return False
+        for font_name, internal_name, state in compiled.fonts:
+            font = pdfmetrics.getFont(font_name)
+            if state is None:
+                doc.getInternalFontName(font_name)
+            else:
+                font.state[doc] = copy.deepcopy(state)
+                doc.fontMapping[font_name] = internal_name
+                doc.delayedFonts.append(font)
+        canvas._code.extend(compiled.code)
+        return True
+
+    def stamp(self, canvas):
+        if not canvas.hasForm(self.name):
+            compiled = self.compile()
+            canvas.beginForm(self.name)
+            if not self._replay(canvas, compiled):
+                self.draw(canvas)
+            canvas.endForm()
+        canvas.doForm(self.name)
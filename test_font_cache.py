@@ -0,0 +1,73 @@
+"""Checks of the fonts loaded through font_cache.
+
+    python -m pytest test_font_cache.py
+
+A font built from the cache must be the TTFont that ReportLab would
+have parsed; the checks fail when a ReportLab upgrade changes what
+TTFont.__init__ sets. They are skipped if DejaVu Sans is not installed.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from reportlab.pdfgen.canvas import Canvas
+
+import font_cache
+from font_cache import FontCache, parse_font
+
+FONT_FILE = '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+
+TEXT = 'Υπεύθυνη Δήλωση 0123456789'
+
+
+@unittest.skipUnless(os.path.exists(FONT_FILE), 'needs DejaVu Sans')
+class FontCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = FontCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cached_font(self):
+        parsed = parse_font('Test', FONT_FILE)
+        self.cache.load_font('Test', FONT_FILE)
+        with mock.patch('font_cache.parse_font') as parse:
+            cached = self.cache.load_font('Test', FONT_FILE)
+        parse.assert_not_called()
+        self.assertEqual(sorted(vars(cached)), sorted(vars(parsed)))
+        for name in ('fontName', '_asciiReadable', 'shapable'):
+            self.assertEqual(getattr(cached, name), getattr(parsed, name))
+        self.assertEqual(sorted(vars(cached.face)), sorted(vars(parsed.face)))
+        for name, value in vars(parsed.face).items():
+            if name in ('_ttf_data', '_pdfScale'):
+                continue
+            self.assertEqual(getattr(cached.face, name), value, name)
+            self.assertIs(type(getattr(cached.face, name)), type(value),
+                          name)
+        self.assertEqual(cached.stringWidth(TEXT, 10),
+                         parsed.stringWidth(TEXT, 10))
+        self.assertEqual(cached.splitString(TEXT, Canvas(io.BytesIO())._doc),
+                         parsed.splitString(TEXT, Canvas(io.BytesIO())._doc))
+
+    def test_foreign_file(self):
+        self.cache.load_font('Test', FONT_FILE)
+        face_file, = [name for name in os.listdir(self.directory)
+                      if name.endswith('.face')]
+        face_path = os.path.join(self.directory, face_file)
+        os.chmod(face_path, 0o666)
+        # Parsed again rather than loaded from a file others can write.
+        with mock.patch('font_cache.parse_font',
+                        wraps=font_cache.parse_font) as parse:
+            self.cache.load_font('Test', FONT_FILE)
+        parse.assert_called_once_with('Test', FONT_FILE)
+        self.assertEqual(os.stat(face_path).st_mode & 0o777, 0o600)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+"""Rendering checks of the forms.
+
+    python -m pytest test_forms.py
+
+The fonts are taken from setup.json, falling back to DejaVu; the checks
+are skipped if neither is installed.
+"""
+
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from reportlab.pdfgen.canvas import Canvas
+
+import generate_authorization
+import generate_declaration
+from form_setup import SetupError
+from form_template import compare_pdfs, pymupdf
+from image_assets import asset_path
+from layout import load_plan
+from text_fit import FitError, original_fit_error
+
+FALLBACK_FONTS = {
+    'font-regular': '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    'font-bold': '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
+    'font-bold-italic':
+        '/usr/share/fonts/truetype/dejavu/DejaVuSerif-Bold.ttf',
+}
+
+MARKUP_TEXT = 'Πρώτη γραμμή<br/>δεύτερη <b>έντονη</b> γραμμή'
+
+_SETUP_FILE = None
+
+
+def setUpModule():
+    global _SETUP_FILE
+    with open(asset_path('setup.json')) as config_file:
+        config_data = json.load(config_file)
+    for key, path in FALLBACK_FONTS.items():
+        config_data[key] = config_data.get(key, []) + [path]
+    fd, _SETUP_FILE = tempfile.mkstemp(suffix='.json')
+    with os.fdopen(fd, 'w') as config_file:
+        json.dump(config_data, config_file)
+    try:
+        generate_declaration.setup(_SETUP_FILE)
+        generate_authorization.setup(_SETUP_FILE)
+    except SetupError as e:
+        raise unittest.SkipTest(str(e))
+
+
+def tearDownModule():
+    if _SETUP_FILE is not None:
+        os.unlink(_SETUP_FILE)
+
+
+def declaration_payload(**values):
+    payload = generate_declaration.load_payload(asset_path('data.json'))
+    payload.update(values)
+    generate_declaration.make_reference(payload)
+    return payload
+
+
+def authorization_payload(**values):
+    payload = generate_authorization.load_payload(
+        asset_path('auth_data.json'))
+    payload.update(values)
+    generate_authorization.make_reference(payload)
+    return payload
+
+
+class MarkupTest(unittest.TestCase):
+
+    def test_markup_field(self):
+        payload = declaration_payload(declaration_text=MARKUP_TEXT)
+        plan = load_plan(generate_declaration.LAYOUT_FILE)
+        fields, _ = plan.flow(generate_declaration.make_fields(payload))
+        code = []
+        # The second time the fields are replayed from their segments.
+        for _ in range(2):
+            canvas = Canvas(io.BytesIO())
+            plan.draw_fields(canvas, fields)
+            code.append(list(canvas._code))
+            canvas.save()
+        self.assertEqual(code[0], code[1])
+
+
+class OverflowTest(unittest.TestCase):
+
+    def test_field_named(self):
+        payload = generate_declaration.load_payload(asset_path('data.json'))
+        payload['name'] = 'Χ' * 3000
+        with self.assertRaises(FitError) as context:
+            list(generate_declaration.render_batch([payload]))
+        error = original_fit_error(context.exception)
+        self.assertEqual(error.field, 'name')
+        self.assertTrue(str(error).startswith('field name: cannot fit'))
+
+
+@unittest.skipIf(pymupdf is None, 'comparing renderings needs PyMuPDF')
+class BackendTest(unittest.TestCase):
+    """The template backend draws what the platypus backend draws."""
+
+    def assert_declaration_backends_agree(self, payload):
+        module = generate_declaration
+        fields, continuation = load_plan(module.LAYOUT_FILE).flow(
+            module.make_fields(payload))
+        output = io.BytesIO()
+        module.render_platypus(output, payload, fields, continuation, qr=True)
+        template_pdf = module.render_template(
+            module.make_template(), payload, fields, continuation, qr=True)
+        self.assertFalse(any(compare_pdfs(output.getvalue(), template_pdf)))
+
+    def test_declaration(self):
+        self.assert_declaration_backends_agree(declaration_payload())
+
+    def test_declaration_markup(self):
+        self.assert_declaration_backends_agree(
+            declaration_payload(declaration_text=MARKUP_TEXT))
+
+    def test_authorization(self):
+        module = generate_authorization
+        payload = authorization_payload()
+        output = io.BytesIO()
+        module.render_platypus(output, payload, qr=True)
+        template_pdf = module.render_template(module.make_template(),
+                                              payload, qr=True)
+        self.assertFalse(any(compare_pdfs(output.getvalue(), template_pdf)))
+
+    def test_batch(self):
+        payloads = [declaration_payload(surname=f'Παναγιωταρά {i}')
+                    for i in range(3)]
+        rendered = {
+            backend: list(generate_declaration.render_batch(
+                [dict(payload) for payload in payloads], backend, qr=False))
+            for backend in ('platypus', 'template')
+        }
+        for platypus_pdf, template_pdf in zip(rendered['platypus'],
+                                              rendered['template']):
+            self.assertFalse(any(compare_pdfs(platypus_pdf, template_pdf)))
+
+
+if __name__ == '__main__':
+    unittest.main()
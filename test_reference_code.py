@@ -0,0 +1,94 @@
+"""Checks of the compact reference codes.
+
+    python -m pytest test_reference_code.py
+"""
+
+import hashlib
+import io
+import unittest
+
+from reference_code import (ALPHABET, ReferenceCodeError, check_character,
+                            configure_reference, encoded_reference,
+                            print_reference, reference_code)
+
+# SHA-256 of the empty string.
+DIGEST = 'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855'
+
+
+def luhn_valid(code):
+    """Validate a code ending in its check character, as Luhn mod N does."""
+    factor = 1
+    total = 0
+    for char in reversed(code):
+        addend = factor * ALPHABET.index(char)
+        factor = 3 - factor
+        total += addend // 32 + addend % 32
+    return total % 32 == 0
+
+
+def decode(code):
+    value = 0
+    for char in code:
+        value = value * 32 + ALPHABET.index(char)
+    return value
+
+
+class ReferenceCodeTest(unittest.TestCase):
+
+    def tearDown(self):
+        configure_reference()
+
+    def test_hex(self):
+        self.assertEqual(encoded_reference(DIGEST), DIGEST)
+        self.assertEqual(reference_code(DIGEST), DIGEST)
+
+    def test_known_codes(self):
+        configure_reference('base32')
+        self.assertEqual(encoded_reference(DIGEST), 'WERC8GMRZGE196QVQ')
+        self.assertEqual(reference_code(DIGEST), 'WERC-8GMR-ZGE1-96QV-Q')
+        configure_reference('base32', 40)
+        self.assertEqual(encoded_reference(DIGEST), 'WERC8GMRA')
+        out = io.StringIO()
+        print_reference(DIGEST, out)
+        self.assertEqual(out.getvalue(), f'WERC-8GMR-A {DIGEST}\n')
+
+    def test_round_trip(self):
+        for bits in (40, 80, 255):
+            configure_reference('base32', bits)
+            for data in (b'', b'abc', b'declaration'):
+                digest = hashlib.sha256(data).hexdigest()
+                code = encoded_reference(digest)
+                self.assertEqual(len(code), bits // 5 + 1)
+                self.assertEqual(decode(code[:-1]),
+                                 int(digest, 16) >> (256 - bits))
+                self.assertTrue(luhn_valid(code))
+
+    def test_typo(self):
+        configure_reference('base32')
+        code = encoded_reference(DIGEST)
+        for position in range(len(code)):
+            for char in ALPHABET:
+                if char != code[position]:
+                    typo = code[:position] + char + code[position + 1:]
+                    self.assertFalse(luhn_valid(typo), typo)
+
+    def test_transposition(self):
+        configure_reference('base32')
+        code = encoded_reference(DIGEST)
+        # WERC-8GMR-ZGE1-96QV-Q with 96 typed as 69.
+        self.assertEqual(check_character('WERC8GMRZGE169QV'), 'M')
+        for position in range(len(code) - 1):
+            first, second = code[position:position + 2]
+            if first != second:
+                swapped = (code[:position] + second + first
+                           + code[position + 2:])
+                self.assertFalse(luhn_valid(swapped), swapped)
+
+    def test_invalid_configuration(self):
+        self.assertRaises(ReferenceCodeError, configure_reference, 'base64')
+        self.assertRaises(ReferenceCodeError, configure_reference, 'base32', 42)
+        self.assertRaises(ReferenceCodeError, configure_reference, 'base32', 35)
+
+
+if __name__ == '__main__':
+    unittest.main()
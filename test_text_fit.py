@@ -0,0 +1,80 @@
+"""Checks of the font size search of text_fit.
+
+    python -m pytest test_text_fit.py
+
+The paragraphs are set in Helvetica, which needs no setup.
+"""
+
+import io
+import unittest
+
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
+
+from text_fit import (MIN_FONT_SIZE, FitError, original_fit_error,
+                      shrink_to_fit)
+
+TEXT = ' '.join(['Solemn declaration of article 8'] * 12)
+
+
+def fits_at(size, width, height):
+    style = ParagraphStyle('test', fontName='Helvetica', fontSize=size)
+    w, h = Paragraph(TEXT, style).wrap(width, height)
+    return w <= width and h <= height
+
+
+def shrink(width, height, size=12, min_size=MIN_FONT_SIZE):
+    style = ParagraphStyle('test', fontName='Helvetica', fontSize=size)
+    return shrink_to_fit(Paragraph(TEXT, style), style, width, height,
+                         min_size)
+
+
+class ShrinkToFitTest(unittest.TestCase):
+
+    def test_fits(self):
+        paragraph, style = shrink(400, 400)
+        self.assertEqual(style.fontSize, 12)
+
+    def test_largest_size(self):
+        for width, height in ((200, 60), (400, 40), (250, 100)):
+            paragraph, style = shrink(width, height)
+            self.assertLess(style.fontSize, 12)
+            self.assertTrue(fits_at(style.fontSize, width, height))
+            self.assertFalse(fits_at(style.fontSize + 1, width, height))
+            self.assertEqual(paragraph.style.fontSize, style.fontSize)
+
+    def test_floor(self):
+        paragraph, style = shrink(200, 60, min_size=5)
+        self.assertEqual(style.fontSize, 5)
+        # It would fit at 5pt, but not at 6pt or larger.
+        self.assertRaises(FitError, shrink, 200, 60, min_size=6)
+
+    def test_below_floor(self):
+        # A style already at the floor is not shrunk further.
+        self.assertRaises(FitError, shrink, 40, 10, size=MIN_FONT_SIZE)
+
+    def test_error(self):
+        with self.assertRaises(FitError) as context:
+            shrink(40, 10)
+        error = context.exception
+        self.assertEqual((error.width, error.height, error.min_size),
+                         (40, 10, MIN_FONT_SIZE))
+        self.assertIn('40.0x10.0pt', str(error))
+
+
+class ReraiseTest(unittest.TestCase):
+
+    def test_page_callback(self):
+        def first_page(canvas, doc):
+            shrink(40, 10)
+
+        doc = SimpleDocTemplate(io.BytesIO())
+        with self.assertRaises(FitError) as context:
+            doc.build([Spacer(1, 1)], onFirstPage=first_page)
+        error = original_fit_error(context.exception)
+        self.assertEqual((error.width, error.height), (40, 10))
+        self.assertNotIn('handle_pageBegin', str(error))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,282 @@
+import collections
+import copy
+import threading
+
+from reportlab.platypus import Paragraph
+from reportlab.lib.styles import ParagraphStyle
+
+from fit_cache import FitCache
+
+# No paragraph is ever shrunk below this size; if the text still does not
+# fit, fitting fails instead of producing illegible (or negative) sizes.
+MIN_FONT_SIZE = 4
+
+# Shared by every create_para call in the process; see configure_fit_cache.
+FIT_CACHE = FitCache()
+
+PARAGRAPH_POOL_ENTRIES = 4096
+
+
+class FitError(ValueError):
+    """Raised when a text does not fit its box even at the minimum size.
+
+    ReportLab re-raises errors from page callbacks with the message as
+    the only argument, so a FitError may also be made from a message
+    alone; its box and size are then None, and original_fit_error()
+    finds the error it was made from.
+    """
+
+    def __init__(self, text, width=None, height=None, min_size=None,
+                 field=None):
+        self.text = text
+        self.width = width
+        self.height = height
+        self.min_size = min_size
+        self.field = field
+        if width is None:
+            super().__init__(text)
+            return
+        excerpt = text if len(text) <= 40 else text[:37] + '...'
+        message = (f'cannot fit {excerpt!r} in a {width:.1f}x{height:.1f}pt '
+                   f'box at font size {min_size} or larger')
+        if field is not None:
+            message = f'field {field}: {message}'
+        super().__init__(message)
+
+
+def original_fit_error(error):
+    """Return the FitError, with its field and box, that error comes from.
+
+    ReportLab re-raises an error from a page callback as a new one with
+    the callback in its message, while handling the original.
+    """
+    while error.width is None and isinstance(error.__context__, FitError):
+        error = error.__context__
+    return error
+
+
+class ParagraphPool:
+    """Fitted and wrapped paragraphs, keyed like the fit cache.
+
+    get() hands out shallow copies: the parsed fragments and the wrapped
+    lines are shared, while drawOn() and wrap() only set attributes of
+    the copy, so one pooled paragraph can be drawn by several threads
+    and documents at once.
+    """
+
+    def __init__(self, entries=PARAGRAPH_POOL_ENTRIES):
+        self.entries = entries
+        self.hits = 0
+        self.misses = 0
+        self._paragraphs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            paragraph = self._paragraphs.get(key)
+            if paragraph is None:
+                self.misses += 1
+                return None
+            self._paragraphs.move_to_end(key)
+            self.hits += 1
+        return copy.copy(paragraph)
+
+    def put(self, key, paragraph):
+        with self._lock:
+            self._paragraphs[key] = paragraph
+            self._paragraphs.move_to_end(key)
+            while len(self._paragraphs) > self.entries:
+                self._paragraphs.popitem(last=False)
+        return copy.copy(paragraph)
+
+    def clear(self):
+        with self._lock:
+            self._paragraphs.clear()
+
+
+PARAGRAPH_POOL = ParagraphPool()
+
+_STYLES = {}
+_STYLES_LOCK = threading.Lock()
+
+
+def get_style(font_name, font_size):
+    """Return the shared paragraph style for a font and size.
+
+    The styles are shared by every paragraph of the process and must not
+    be changed; shrink_to_fit works on a clone.
+    """
+    key = (font_name, font_size)
+    style = _STYLES.get(key)
+    if style is None:
+        with _STYLES_LOCK:
+            style = _STYLES.setdefault(key, ParagraphStyle('default',
+                                                           fontName=font_name,
+                                                           fontSize=font_size))
+    return style
+
+
+def shared_para(contents, style):
+    """Return a paragraph of constant contents in a story style.
+
+    The paragraph is parsed once per process and pooled; the style must
+    not change after the first call, as with the styles set up by the
+    generators.
+    """
+    key = (contents, style)
+    paragraph = PARAGRAPH_POOL.get(key)
+    if paragraph is None:
+        paragraph = PARAGRAPH_POOL.put(key, Paragraph(contents, style))
+    return paragraph
+
+
+def _fits(paragraph, assigned_width, assigned_height):
+    w, h = paragraph.wrap(assigned_width, assigned_height)
+    return w <= assigned_width and h <= assigned_height, h
+
+
+def shrink_to_fit(paragraph, style, assigned_width, assigned_height,
+                  min_size=MIN_FONT_SIZE):
+    """Return the paragraph and style at the largest size that fits.
+
+    Sizes are tried in whole-point steps below the style's size, as the
+    old linear search did, but the first probe is estimated from the
+    overflow (line count scales with the font size) and the rest of the
+    range is bisected, so only a handful of wraps are needed.
+    """
+    fits, h = _fits(paragraph, assigned_width, assigned_height)
+    if fits:
+        return paragraph, style
+
+    start_size = style.fontSize
+    style = style.clone('default')
+
+    def probe(steps):
+        style.fontSize = start_size - steps
+        candidate = Paragraph(paragraph.text, style)
+        return candidate, _fits(candidate, assigned_width, assigned_height)
+
+    # lo: steps known to overflow; hi: steps at which we stop looking.
+    lo = 0
+    hi = int(start_size - min_size)
+    if hi < 1:
+        raise FitError(paragraph.text, assigned_width, assigned_height,
+                       min_size)
+    best = None
+
+    estimate = start_size * min(1, assigned_height / h)
+    guess = min(hi, max(1, int(start_size - estimate)))
+    candidate, (fits, h) = probe(guess)
+    if fits:
+        best = (guess, candidate)
+        hi = guess
+    else:
+        lo = guess
+
+    if best is None:
+        candidate, (fits, h) = probe(hi)
+        if not fits:
+            raise FitError(paragraph.text, assigned_width, assigned_height,
+                           min_size)
+        best = (hi, candidate)
+
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        candidate, (fits, h) = probe(mid)
+        if fits:
+            best = (mid, candidate)
+            hi = mid
+        else:
+            lo = mid
+
+    steps, paragraph = best
+    style.fontSize = start_size - steps
+    return paragraph, style
+
+
+def configure_fit_cache(path=None, **kwargs):
+    """Replace the process fit cache, optionally backed by a file."""
+    global FIT_CACHE
+    FIT_CACHE.close()
+    FIT_CACHE = FitCache(path=path, **kwargs)
+    return FIT_CACHE
+
+
+def measure_fit(contents, width, height,
+                font_name='Font-Regular',
+                font_size=10):
+    """Return the size create_para would use and the overflow ratio.
+
+    The overflow ratio is the height the text needs at font_size over
+    the height of the box. The size is None if the text does not fit
+    even at the minimum size.
+    """
+    style = get_style(font_name, font_size)
+    paragraph = Paragraph(contents, style)
+    fits, h = _fits(paragraph, width, height)
+    overflow = h / height
+    if fits:
+        return font_size, overflow
+    key = FitCache.make_key(contents, font_name, font_size, width, height)
+    fitted_size = FIT_CACHE.get(key)
+    if fitted_size is None:
+        try:
+            paragraph, style = shrink_to_fit(paragraph, style, width, height)
+        except FitError:
+            return None, overflow
+        fitted_size = style.fontSize
+        FIT_CACHE.put(key, fitted_size)
+    return fitted_size, overflow
+
+
+def split_para(contents, width, height,
+               font_name='Font-Regular',
+               font_size=10):
+    """Wrap contents once at font_size and split it at the box height.
+
+    Returns the paragraph holding the lines that fit the box (None if
+    not even one line does) and a list of paragraphs with the rest.
+    """
+    style = get_style(font_name, font_size)
+    paragraph = Paragraph(contents, style)
+    fits, _ = _fits(paragraph, width, height)
+    if fits:
+        return paragraph, []
+    parts = paragraph.split(width, height)
+    if not parts:
+        return None, [paragraph]
+    return parts[0], parts[1:]
+
+
+def create_para(contents, width, height,
+                font_name='Font-Regular',
+                font_size=10):
+    """Return a paragraph of contents fitted and wrapped to the box.
+
+    Paragraphs come from the process-wide pool, so the markup of a text
+    seen before in the same box is neither parsed nor wrapped again.
+    """
+    key = FitCache.make_key(contents, font_name, font_size, width, height)
+    paragraph = PARAGRAPH_POOL.get(key)
+    if paragraph is not None:
+        return paragraph
+    fitted_size = FIT_CACHE.get(key)
+    if fitted_size is not None:
+        paragraph = Paragraph(contents, get_style(font_name, fitted_size))
+        paragraph.wrap(width, height)
+    else:
+        style = get_style(font_name, font_size)
+        paragraph = Paragraph(contents, style)
+        paragraph, style = shrink_to_fit(paragraph, style, width, height)
+        FIT_CACHE.put(key, style.fontSize)
+    return PARAGRAPH_POOL.put(key, paragraph)
+
+
+def draw_para(canvas, contents, origin_x, origin_y, width, height,
+              font_name='Font-Regular',
+              font_size=10):
+    paragraph = create_para(contents,
+                            width, height,
+                            font_name=font_name,
+                            font_size=font_size)
+    paragraph.drawOn(canvas, origin_x, origin_y)
@@ -0,0 +1,134 @@
+"""Vectorised width measurement for one-line field values.
+
+Most form fields are short, plain strings that fit on one line at their
+layout size. For those the Platypus machinery (markup parsing, line
+breaking, shrink-to-fit) is not needed: knowing that the string is
+narrower than its box is enough to draw it directly.
+
+The advance widths of each registered TrueType font are loaded into a
+NumPy array once, so the widths of a whole column of values (every
+field of a payload, or the same field over a batch of payloads) are
+computed with a few array operations instead of a Python loop per
+character. Without NumPy, or for fonts that are not TrueType, widths
+are measured with pdfmetrics.stringWidth one string at a time.
+"""
+
+import threading
+
+from reportlab.lib.colors import black
+from reportlab.pdfbase import pdfmetrics
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from text_fit import get_style
+
+# Characters outside the Basic Multilingual Plane always take the
+# Platypus path, so the width tables stay small.
+TABLE_SIZE = 0x10000
+
+# A value is only drawn directly if it is narrower than its box by this
+# much, so that rounding differences never make it disagree with
+# Paragraph.wrap about a string that exactly fills the box.
+WIDTH_MARGIN = 0.01
+
+_TABLES = {}
+_TABLES_LOCK = threading.Lock()
+
+
+def _width_table(font_name):
+    """Return the advance widths (1/1000 em) of a TrueType font, or None."""
+    font = pdfmetrics.getFont(font_name)
+    entry = _TABLES.get(font_name)
+    if entry is not None and entry[0] is font:
+        return entry[1]
+    face = getattr(font, 'face', None)
+    char_widths = getattr(face, 'charWidths', None)
+    if numpy is None or char_widths is None:
+        table = None
+    else:
+        table = numpy.full(TABLE_SIZE, face.defaultWidth, dtype=numpy.float64)
+        codes = numpy.fromiter((code for code in char_widths
+                                if code < TABLE_SIZE), dtype=numpy.int64)
+        table[codes] = [char_widths[code] for code in codes.tolist()]
+    with _TABLES_LOCK:
+        # The font may have been registered again with another file.
+        _TABLES[font_name] = (font, table)
+    return table
+
+
+def is_plain(text):
+    """True if Paragraph would draw the text as it is, on one line.
+
+    Markup, entities, characters outside the BMP and runs of whitespace
+    (which Paragraph collapses) rule the fast path out.
+    """
+    return (isinstance(text, str) and text != ''
+            and '<' not in text and '&' not in text
+            and text == ' '.join(text.split())
+            and ord(max(text)) < TABLE_SIZE)
+
+
+def string_widths(texts, font_name, font_size):
+    """Return the widths in points of texts set in one font and size."""
+    table = _width_table(font_name)
+    if table is None or not texts:
+        return [pdfmetrics.stringWidth(text, font_name, font_size)
+                for text in texts]
+    joined = ''.join(texts)
+    codes = numpy.frombuffer(joined.encode('utf-32-le'), dtype=numpy.uint32)
+    lengths = numpy.fromiter((len(text) for text in texts),
+                             dtype=numpy.int64, count=len(texts))
+    starts = numpy.zeros(len(texts), dtype=numpy.int64)
+    numpy.cumsum(lengths[:-1], out=starts[1:])
+    # reduceat needs in-range starts; empty strings are zeroed below.
+    totals = numpy.add.reduceat(table[numpy.minimum(codes, TABLE_SIZE - 1)],
+                                numpy.minimum(starts, max(len(codes) - 1, 0)))
+    totals[lengths == 0] = 0
+    return totals * (font_size * 0.001)
+
+
+def single_line_fits(items):
+    """Decide which values can be drawn directly on one line.
+
+    items is a sequence of (text, font name, font size, width, height).
+    Returns a list of booleans: True if the text is plain, one line of
+    it fits the box height and the whole string fits the box width at
+    the given size. Items are measured in one pass per font.
+    """
+    result = [False] * len(items)
+    groups = {}
+    for index, (text, font_name, font_size, width, height) \
+            in enumerate(items):
+        if get_style(font_name, font_size).leading > height:
+            continue
+        if not is_plain(text):
+            continue
+        groups.setdefault(font_name, []).append(index)
+    for font_name, indices in groups.items():
+        # Measured at 1000pt and scaled, so one call covers every size.
+        widths = string_widths([items[i][0] for i in indices], font_name,
+                               1000)
+        for index, width in zip(indices, widths):
+            _, _, font_size, box_width, _ = items[index]
+            result[index] = (width * font_size * 0.001
+                             <= box_width - WIDTH_MARGIN)
+    return result
+
+
+def draw_line(canvas, text, x, y, font_name, font_size):
+    """Draw text as draw_para would draw a one-line paragraph of it.
+
+    The paragraph is one leading high and drawn with its bottom at y;
+    its baseline is one font size below its top.
+    """
+    leading = get_style(font_name, font_size).leading
+    canvas.saveState()
+    canvas.setFillColor(black)
+    text_object = canvas.beginText(x, y + leading - font_size)
+    text_object.setFont(font_name, font_size, leading)
+    text_object.textOut(text)
+    canvas.drawText(text_object)
+    canvas.restoreState()